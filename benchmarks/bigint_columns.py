@@ -0,0 +1,88 @@
+"""Measures what migrating the snowflake and money columns from numeric to bigint (``0006_bigint_columns.py``) gains.
+
+Fills the economy table of a scratch schema, then times fetching all of it and measures its unique key before and after
+the migration. Uses the database in the `.env` file (or the `DB_*` environment variables), and drops the schema when
+done.
+
+    python benchmarks/bigint_columns.py --guilds 300 --users 1000
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import uuid
+from pathlib import Path
+from time import perf_counter
+
+import asyncpg
+from dotenv import load_dotenv
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from core.migrations import discover_migrations, migrate  # noqa: E402
+
+RUNS = 5
+SNOWFLAKE = 10**17  # Discord IDs have 18 or 19 digits, which is what makes numeric slow
+
+
+async def measure(pool: asyncpg.Pool, label: str) -> None:
+	async with pool.acquire() as connection:
+		await connection.fetch("SELECT guild_id, user_id, cash, bank FROM economy")  # warms the cache up
+		start = perf_counter()
+		for _ in range(RUNS):
+			await connection.fetch("SELECT guild_id, user_id, cash, bank FROM economy")
+		elapsed = (perf_counter() - start) / RUNS
+		sizes = await connection.fetchrow(
+			"SELECT pg_size_pretty(pg_relation_size('economy')) AS heap,"
+			" pg_size_pretty(pg_relation_size('economy_guild_user_key')) AS key"
+		)
+	print(f"{label:<26} fetch all {elapsed * 1000:7.1f} ms   heap {sizes['heap']:>8}   unique key {sizes['key']:>8}")
+
+
+async def main(guilds: int, users: int) -> None:
+	load_dotenv()
+	options = dict(
+		host=os.getenv("DB_HOST"),
+		port=os.getenv("DB_PORT"),
+		database=os.getenv("DB_NAME", "lumin_beta"),
+		user="lumin",
+		password=os.getenv("DB_PASSWORD"),
+	)
+	schema = f"benchmark_{uuid.uuid4().hex[:8]}"
+	connection = await asyncpg.connect(**options)
+	await connection.execute(f"CREATE SCHEMA {schema}")
+	try:
+		pool = await asyncpg.create_pool(**options, min_size=1, max_size=1, server_settings={"search_path": schema})
+		migrations = discover_migrations()
+		await migrate(pool, [migration for migration in migrations if migration.version < 6])
+		await pool.execute(
+			"INSERT INTO economy (guild_id, user_id, cash, bank)"
+			" SELECT $1::bigint + g, $1::bigint + u, u * 100, g * 100"
+			" FROM generate_series(1, $2) g, generate_series(1, $3) u",
+			SNOWFLAKE,
+			guilds,
+			users,
+		)
+		await pool.execute("ANALYZE economy")
+		print(f"{guilds * users} economy rows")
+		await measure(pool, "numeric")
+
+		await migrate(pool, migrations)
+		await pool.execute("ANALYZE economy")
+		await measure(pool, "bigint")
+		# the dropped numeric columns keep their space in the heap until the rows are rewritten
+		await pool.execute("VACUUM FULL economy")
+		await measure(pool, "bigint, after VACUUM FULL")
+		await pool.close()
+	finally:
+		await connection.execute(f"DROP SCHEMA {schema} CASCADE")
+		await connection.close()
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("--guilds", type=int, default=300)
+	parser.add_argument("--users", type=int, default=1000, help="economy rows per guild")
+	args = parser.parse_args()
+	asyncio.run(main(args.guilds, args.users))
@@ -0,0 +1,195 @@
+"""Measures the memory each cache profile (see `core/profiles.py`) takes per 1000 guilds.
+
+Every profile runs in its own process, which loads synthetic guilds into a connection state the way the gateway sends
+them for the profile's intents: the members and presences of the online members with ``presences``, the members in voice
+with ``voice_states``, and only the bot otherwise. 85% of the guilds are small, 13% medium and 2% large.
+
+    python benchmarks/cache_profiles.py --guilds 1000
+"""
+
+import argparse
+import gc
+import importlib
+import inspect
+import json
+import random
+import subprocess
+import sys
+from pathlib import Path
+
+import discord
+import psutil
+from discord.ext import commands
+
+ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT))
+
+from core.profiles import PROFILES, cache_usage, needed_intents  # noqa: E402
+
+JOINED_AT = "2025-01-01T00:00:00+00:00"
+
+
+def cogs() -> list[type[commands.Cog]]:
+	"""Returns the cogs of every module in ``cogs/``, whose `intents` the profiles add to."""
+	found = []
+	for path in sorted((ROOT / "cogs").glob("*.py")):
+		module = importlib.import_module(f"cogs.{path.stem}")
+		found += [
+			cls
+			for _, cls in inspect.getmembers(module, inspect.isclass)
+			if issubclass(cls, commands.Cog) and cls.__module__ == module.__name__
+		]
+	return found
+
+
+def user(user_id: int) -> dict:
+	return {
+		"id": str(user_id),
+		"username": f"user{user_id:x}name",
+		"discriminator": "0",
+		"avatar": "a" * 32 if user_id % 3 else None,
+		"global_name": f"User {user_id}",
+		"public_flags": 0,
+	}
+
+
+def guild(guild_id: int, intents: discord.Intents, rng: random.Random) -> dict:
+	"""Returns the GUILD_CREATE payload of a guild with the given intents."""
+	kind = rng.random()
+	count = 30 if kind < 0.85 else 200 if kind < 0.98 else 5000
+	large = count > 250
+	member_ids = [1] + [guild_id * 10 + member for member in range(count)]
+	in_voice = member_ids[1:4]
+	online = member_ids if not large else member_ids[: count // 7]
+	if intents.presences:
+		listed = online  # Discord sends every member of small guilds, and the online ones of large guilds
+	elif intents.voice_states:
+		listed = [1] + in_voice
+	else:
+		listed = [1]
+
+	data = {
+		"id": str(guild_id),
+		"name": f"guild {guild_id}",
+		"icon": None,
+		"owner_id": "2",
+		"member_count": count,
+		"large": large,
+		"features": [],
+		"roles": [
+			{
+				"id": str(guild_id + role),
+				"name": f"role {role}",
+				"permissions": "1024",
+				"position": role,
+				"colors": {"primary_color": role},
+				"hoist": False,
+				"managed": False,
+				"mentionable": False,
+				"flags": 0,
+			}
+			for role in range(15)
+		],
+		"channels": [
+			{
+				"id": str(guild_id + 100 + channel),
+				"type": 2 if channel % 5 == 0 else 0,
+				"name": f"channel-{channel}",
+				"position": channel,
+				"permission_overwrites": [{"id": str(guild_id), "type": 0, "allow": "0", "deny": "2048"}],
+				"topic": "a topic" * 3,
+				"bitrate": 64000,
+				"user_limit": 0,
+			}
+			for channel in range(20)
+		],
+		"threads": [],
+		"emojis": [
+			{
+				"id": str(guild_id + 500 + emoji),
+				"name": f"emoji{emoji}",
+				"animated": False,
+				"managed": False,
+				"require_colons": True,
+				"available": True,
+				"roles": [],
+			}
+			for emoji in range(20)
+		],
+		"stickers": [],
+		"members": [
+			{
+				"user": user(member_id),
+				"roles": [str(guild_id + 1 + member_id % 3)],
+				"joined_at": JOINED_AT,
+				"flags": 0,
+				"deaf": False,
+				"mute": False,
+				"nick": None if member_id % 4 else f"nick {member_id}",
+			}
+			for member_id in listed
+		],
+		"voice_states": [],
+	}
+	if intents.voice_states:
+		data["voice_states"] = [
+			{
+				"user_id": str(member_id),
+				"channel_id": str(guild_id + 100),
+				"session_id": "session",
+				"deaf": False,
+				"mute": False,
+				"self_deaf": False,
+				"self_mute": False,
+				"self_video": False,
+				"suppress": False,
+			}
+			for member_id in in_voice
+		]
+	if intents.presences:
+		data["presences"] = [
+			{
+				"user": {"id": str(member_id)},
+				"status": "online",
+				"client_status": {"desktop": "online"},
+				"activities": [{"name": "Custom Status", "type": 4, "state": "busy"}] if member_id % 2 else [],
+			}
+			for member_id in online
+		]
+	return data
+
+
+def measure(profile_name: str, guilds: int) -> None:
+	"""Loads the guilds with a profile and prints how much the RSS grew."""
+	profile = PROFILES[profile_name]
+	intents, member_cache_flags = profile.resolve(needed_intents(cogs()))
+	client = discord.AutoShardedClient(
+		intents=intents, member_cache_flags=member_cache_flags, chunk_guilds_at_startup=False
+	)
+	state = client._connection
+	state.user = discord.ClientUser(state=state, data={**user(1), "bot": True, "verified": True, "mfa_enabled": False})
+	rng = random.Random(1)
+	# serialized like they come from the gateway, so building them doesn't count
+	payloads = [json.dumps(guild((number + 1) << 22, intents, rng)) for number in range(guilds)]
+	gc.collect()
+	before = psutil.Process().memory_info().rss
+	for payload in payloads:
+		state._add_guild_from_data(json.loads(payload))
+	del payloads
+	gc.collect()
+	grown = psutil.Process().memory_info().rss - before
+
+	caches = ", ".join(f"{usage.name} {usage.count}" for usage in cache_usage(client) if usage.count)
+	print(f"{profile.name:<9} {grown / 1024**2 * 1000 / guilds:6.1f} MiB per 1k guilds   {caches}")
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("--guilds", type=int, default=1000)
+	parser.add_argument("--profile", choices=PROFILES, help="only measure this profile, in this process")
+	args = parser.parse_args()
+	if args.profile:
+		measure(args.profile, args.guilds)
+	else:
+		for name in PROFILES:
+			subprocess.run([sys.executable, __file__, "--guilds", str(args.guilds), "--profile", name], check=True)
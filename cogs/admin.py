@@ -1,3 +1,4 @@
+import io
 from logging import getLogger
 from time import perf_counter
 from typing import Literal, Optional
@@ -7,11 +8,17 @@ from discord import app_commands
 from discord.ext import commands
 
 from core import Context, MyClient, update_slash_localizations
+from core.metrics import LatencyStats, render_metrics
+from core.profiles import cache_usage, describe_intents
+from helpers import LazyModule, seconds_to_text
 
 logger = getLogger(__name__)
+psutil = LazyModule("psutil")
 
 
 class Admin(commands.Cog):
+	deadline = 120.0  # syncing the command tree and reloading cogs can take a while
+
 	def __init__(self, client: MyClient):
 		self.client: MyClient = client
 
@@ -72,6 +79,185 @@ class Admin(commands.Cog):
 		await ctx.reply(content="Reloaded localization files.")
 		logger.info(f"{ctx.author.name} reloaded localization files.")
 
+	@commands.hybrid_command(
+		hidden=True, name="messagecache", description="msgcache_specs-description", usage="msgcache_specs-usage"
+	)
+	@commands.is_owner()
+	@app_commands.describe(limit="msgcache_specs-args-limit-description")
+	@app_commands.rename(limit="msgcache_specs-args-limit-name")
+	async def messagecache(self, ctx: Context, limit: commands.Range[int, 1, 25] = 10):
+		cache = self.client.message_cache
+		lines = [
+			f"**{len(cache)}** messages in **{len(cache.guilds)}** guilds,"
+			f" using **{cache.size / 1024**2:.2f}/{cache.max_size / 1024**2:.0f} MiB**"
+		]
+		for guild_id, bucket in cache.stats()[:limit]:
+			guild = self.client.get_guild(guild_id)
+			lines.append(
+				f"`{guild_id}` {guild.name if guild else 'Unknown'}:"
+				f" {len(bucket.messages)}/{cache.per_guild} messages, {bucket.size / 1024:.1f} KiB,"
+				f" {bucket.hit_rate:.0%} hit rate ({bucket.hits}/{bucket.hits + bucket.misses})"
+			)
+		await ctx.reply(content="\n".join(lines))
+
+	@commands.hybrid_command(
+		hidden=True, name="dbstats", description="dbstats_specs-description", usage="dbstats_specs-usage"
+	)
+	@commands.is_owner()
+	@app_commands.describe(limit="dbstats_specs-args-limit-description", plans="dbstats_specs-args-plans-description")
+	@app_commands.rename(limit="dbstats_specs-args-limit-name", plans="dbstats_specs-args-plans-name")
+	async def dbstats(self, ctx: Context, limit: commands.Range[int, 1, 25] = 10, plans: bool = False):
+		db = self.client.db
+		stats = db.top(limit)
+		lines = [
+			f"**{sum(s.calls for s in db.stats.values())}** queries over **{len(db.stats)}** statements,"
+			f" **{len(db.slow_queries)}** slow queries captured (over {db.slow_query_threshold * 1000:.0f}ms)"
+		]
+		if db.breaker:
+			lines.append(
+				f"Circuit breaker is **{db.breaker.state}**, {db.breaker.failures} failures in a row,"
+				f" tripped {db.breaker.trips} times"
+			)
+		replica = self.client.queries.replica
+		if replica:
+			lag = f"{replica.lag:.1f}s behind" if replica.lag is not None else "unreachable"
+			lines.append(
+				f"Read replica is **{lag}** ({'in use' if replica.available else 'not in use'}),"
+				f" served **{sum(s.calls for s in replica.pool.stats.values())}** queries"
+			)
+		bus, prefixes = self.client.invalidation, self.client.prefixes
+		if bus:
+			lines.append(
+				f"Invalidation bus is **{'connected' if bus.connected else 'disconnected'}**,"
+				f" received {bus.received} invalidations, resynced {bus.resyncs} times,"
+				f" {prefixes.hits / max(prefixes.hits + prefixes.misses, 1):.0%} prefix cache hits"
+			)
+		for s in stats:
+			lines.append(
+				f"`{s.name}`: {s.calls} calls, {s.total_time:.2f}s total, {s.mean_time * 1000:.1f}ms mean,"
+				f" p95 ≤{s.percentile(0.95) * 1000:.0f}ms, {s.max_time * 1000:.0f}ms max,"
+				f" {s.total_wait / s.calls * 1000:.1f}ms pool wait, {s.rows} rows"
+			)
+		content = "\n".join(lines)
+
+		files = []
+		if len(content) > 2000:
+			files.append(discord.File(io.BytesIO(content.encode()), filename="dbstats.txt"))
+			content = lines[0]
+		if plans and db.slow_queries:
+			report = "\n\n".join(
+				f"{query.name} took {query.duration * 1000:.0f}ms at {query.captured_at:%Y-%m-%d %H:%M:%S} UTC\n"
+				f"{query.query}\n\n{query.plan}"
+				for query in reversed(db.slow_queries)
+			)
+			files.append(discord.File(io.BytesIO(report.encode()), filename="slow_queries.txt"))
+		await ctx.reply(content=content, files=files)
+
+	@commands.hybrid_command(
+		hidden=True, name="memory", description="memory_specs-description", usage="memory_specs-usage"
+	)
+	@commands.is_owner()
+	@app_commands.describe(sample="memory_specs-args-sample-description")
+	@app_commands.rename(sample="memory_specs-args-sample-name")
+	async def memory(self, ctx: Context, sample: commands.Range[int, 10, 10000] = 1000):
+		benchmark = perf_counter()
+		usage = cache_usage(self.client, sample=sample)
+		end = perf_counter() - benchmark
+		rss = psutil.Process().memory_info().rss
+		cached = sum(cache.size for cache in usage)
+		lines = [
+			f"**{rss / 1024**2:.1f} MiB** in use, of which the caches take ~**{cached / 1024**2:.1f} MiB**,"
+			f" {cached / max(len(self.client.guilds), 1) * 1000 / 1024**2:.1f} MiB per 1k guilds",
+			f"Cache profile **{self.client.cache_profile.name}**, "
+			+ describe_intents(self.client.intents, self.client._connection.member_cache_flags),
+		]
+		for cache in usage:
+			lines.append(
+				f"`{cache.name}`: {cache.count} cached, ~{cache.size / 1024**2:.2f} MiB"
+				f" ({cache.per_object:.0f} bytes each)"
+			)
+		lines.append(f"Measured {sample} objects per cache in {end * 1000:.0f}ms")
+		await ctx.reply(content="\n".join(lines))
+
+	@commands.hybrid_command(
+		hidden=True, name="stats", description="stats_specs-description", usage="stats_specs-usage"
+	)
+	@commands.is_owner()
+	@app_commands.describe(limit="stats_specs-args-limit-description")
+	@app_commands.rename(limit="stats_specs-args-limit-name")
+	async def stats(self, ctx: Context, limit: commands.Range[int, 1, 25] = 5):
+		metrics = self.client.metrics
+		uptime = metrics.uptime
+		commands_run = metrics.commands.values()
+		routes = [stats for paths in metrics.routes.values() for stats in paths.values()]
+		events = sum(metrics.events.values())
+		lines = [
+			f"Recording for **{seconds_to_text(int(uptime))}**: **{sum(s.calls for s in commands_run)}** commands"
+			f" ({sum(s.failures for s in commands_run)} failed), **{events}** gateway events ({events / uptime:.1f}/s),"
+			f" **{sum(s.calls for s in routes)}** REST requests ({sum(s.failures for s in routes)} failed)"
+		]
+		shards = self.client.shards
+		if shards:
+			lines.append(
+				"Shard latency: "
+				+ ", ".join(
+					f"`{shard_id}` {'closed' if shard.is_closed() else f'{shard.latency * 1000:.0f}ms'}"
+					for shard_id, shard in sorted(shards.items())
+				)
+			)
+		cache = self.client.message_cache
+		hits = sum(bucket.hits for bucket in cache.guilds.values())
+		lookups = hits + sum(bucket.misses for bucket in cache.guilds.values())
+		caches = [
+			f"{len(self.client.guilds)} guilds",
+			f"{len(self.client.users)} users",
+			f"{sum(len(guild._members) for guild in self.client.guilds)} members",
+			f"{len(cache)} messages ({hits / max(lookups, 1):.0%} hits)",
+		]
+		for name, (_, guild_cache) in self.client.resume.caches.items():
+			caches.append(
+				f"{len(guild_cache)} {name} ({guild_cache.hits / max(guild_cache.hits + guild_cache.misses, 1):.0%} hits)"
+			)
+		lines.append(f"Caches: {', '.join(caches)}")
+		chunker = self.client.chunker
+		lines.append(
+			f"Chunking: {chunker.completed} guilds chunked, {chunker.failed} failed, {chunker.queued} queued,"
+			f" {chunker.deduplicated} duplicate requests"
+		)
+		db = self.client.db
+		if db:
+			idle = db.get_idle_size()
+			lines.append(
+				f"Database pool: {db.get_size() - idle}/{db.get_max_size()} connections in use, {idle} idle,"
+				f" {sum(s.calls for s in db.stats.values())} queries"
+			)
+
+		def top(title: str, stats: list[LatencyStats]) -> None:
+			if stats:
+				lines.append(f"**{title}**")
+			for s in sorted(stats, key=lambda s: s.calls, reverse=True)[:limit]:
+				lines.append(
+					f"`{s.name}`: {s.calls} calls, {s.mean_time * 1000:.0f}ms mean,"
+					f" p95 ≤{s.percentile(0.95) * 1000:.0f}ms, {s.failures} failed"
+				)
+
+		top("Commands", list(commands_run))
+		if metrics.events:
+			lines.append("**Gateway events**")
+			for name, count in sorted(metrics.events.items(), key=lambda item: item[1], reverse=True)[:limit]:
+				lines.append(f"`{name}`: {count} ({count / uptime * 60:.1f}/min)")
+		top("REST routes", routes)
+		content = "\n".join(lines)
+
+		# everything, as Prometheus scrapes it
+		files = [
+			discord.File(io.BytesIO(render_metrics(metrics.collect(self.client)).encode()), filename="metrics.txt")
+		]
+		if len(content) > 2000:
+			files.append(discord.File(io.BytesIO(content.encode()), filename="stats.txt"))
+			content = lines[0]
+		await ctx.reply(content=content, files=files)
+
 	@commands.hybrid_command(hidden=True, name="sync", description="sync_specs-description", usage="sync_specs-usage")
 	@commands.is_owner()
 	@app_commands.describe(
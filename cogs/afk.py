@@ -4,27 +4,51 @@ import discord
 from discord import app_commands
 from discord.ext import commands
 
-from core import Context, MyClient
+from core import Context, DatabaseUnavailable, GuildCache, MyClient
 from helpers import CustomMember, CustomUser, regex
 
 
 @app_commands.guild_only()
 @commands.guild_only()
 class AFK(commands.Cog):
+	intents = discord.Intents(guild_messages=True)  # AFK ends with the member's next message
+
 	def __init__(self, client: MyClient):
 		self.client = client
 		self.custom_response = client.custom_response
+		# the IDs of the AFK members by guild, so most messages don't need a query. See `core.invalidation`
+		self.active: GuildCache[set[int]] = GuildCache(self._load_active, encode=list, decode=set)
+
+	async def cog_load(self) -> None:
+		self.client.invalidation.subscribe("afk", self.active.handle)
+		self.client.resume.track("afk", "afk", self.active)
+
+	async def cog_unload(self) -> None:
+		self.client.invalidation.unsubscribe("afk", self.active.handle)
+		self.client.resume.untrack("afk")
+
+	async def _load_active(self, guild_id: int) -> set[int]:
+		# cached until the next change, so read from the primary, the replica may not have the change yet
+		rows = await self.client.queries.fetch("afk.active_users", guild_id, connection=self.client.db)
+		return {row["user_id"] for row in rows}
+
+	async def set_afk(self, ctx: Context, statement: str, *args: str) -> None:
+		"""Runs an AFK statement for the author, and drops the cached AFK members of the guild."""
+		await self.client.queries.execute(statement, ctx.guild.id, ctx.author.id, *args)
+		# don't wait for the notification, the next message of the author should see the change
+		self.active.invalidate(ctx.guild.id)
 
 	@commands.Cog.listener("on_message")
 	async def check_afk(self, message: discord.Message) -> None:
 		"""Listens to messages sent. If the author of the message is AFK, turn AFK off."""
 		if not message.guild:
 			return
-		row = await self.client.db.fetchrow(
-			"SELECT * FROM afk WHERE guild_id = $1 AND user_id = $2 AND state = TRUE",
-			message.guild.id,
-			message.author.id,
-		)
+		try:
+			if message.author.id not in await self.active.get(message.guild.id):
+				return
+			row = await self.client.queries.fetchrow("afk.get_active", message.guild.id, message.author.id)
+		except DatabaseUnavailable:
+			return  # AFK is skipped while the database is down
 		if not row:
 			return
 
@@ -34,12 +58,7 @@ class AFK(commands.Cog):
 		if ctx.command and ctx.command.name == "afk":
 			return
 
-		await self.client.db.execute(
-			"UPDATE afk SET state = $1 WHERE user_id = $2 AND guild_id = $3",
-			False,
-			ctx.author.id,
-			ctx.guild.id,
-		)
+		await self.set_afk(ctx, "afk.deactivate")
 		try:
 			await ctx.author.edit(nick=row["previous_nick"])
 		except discord.Forbidden:
@@ -57,11 +76,12 @@ class AFK(commands.Cog):
 		afk_lines = []
 
 		for user in message.mentions:
-			row = await self.client.db.fetchrow(
-				"SELECT * FROM afk WHERE guild_id = $1 AND user_id = $2 AND state = TRUE",
-				message.guild.id,
-				user.id,
-			)
+			try:
+				if user.id not in await self.active.get(message.guild.id):
+					continue
+				row = await self.client.queries.fetchrow("afk.get_active", message.guild.id, user.id)
+			except DatabaseUnavailable:
+				return
 
 			if row and row["user_id"] != message.author.id:
 				# Use localization for each AFK user
@@ -91,20 +111,9 @@ class AFK(commands.Cog):
 		if regex.DISCORD_INVITE.search(reason):
 			return await ctx.send("afk.link")
 
-		row = await self.client.db.fetchrow(
-			"SELECT * FROM afk WHERE user_id = $1 AND guild_id = $2",
-			ctx.author.id,
-			ctx.guild.id,
-		)
+		row = await self.client.queries.fetchrow("afk.get", ctx.guild.id, ctx.author.id)
 		if not row:
-			await self.client.db.execute(
-				"INSERT INTO afk (user_id, guild_id, message, state, previous_nick) VALUES($1, $2, $3, $4, $5)",
-				ctx.author.id,
-				ctx.guild.id,
-				reason,
-				True,
-				ctx.author.display_name,
-			)
+			await self.set_afk(ctx, "afk.insert", reason, ctx.author.display_name)
 			try:
 				await ctx.author.edit(
 					nick=(await self.custom_response("afk.name", ctx, nickname=ctx.author.display_name))
@@ -115,12 +124,7 @@ class AFK(commands.Cog):
 
 		if row["state"]:
 			# Turn off AFK
-			await self.client.db.execute(
-				"UPDATE afk SET state = $1 WHERE user_id = $2 AND guild_id = $3",
-				False,
-				ctx.author.id,
-				ctx.guild.id,
-			)
+			await self.set_afk(ctx, "afk.deactivate")
 			try:
 				await ctx.author.edit(nick=row["previous_nick"])
 			except discord.Forbidden:
@@ -128,14 +132,7 @@ class AFK(commands.Cog):
 			return await ctx.send("afk.off")
 		else:
 			# Turn on AFK
-			await self.client.db.execute(
-				"UPDATE afk SET state = $1, message = $2, previous_nick = $3 WHERE user_id = $4 AND guild_id = $5",
-				True,
-				reason,
-				ctx.author.display_name,
-				ctx.author.id,
-				ctx.guild.id,
-			)
+			await self.set_afk(ctx, "afk.activate", reason, ctx.author.display_name)
 			try:
 				await ctx.author.edit(
 					nick=(await self.custom_response("afk.name", ctx, nickname=ctx.author.display_name))
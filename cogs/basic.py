@@ -13,7 +13,7 @@ class Basic(commands.Cog, name="Basic"):
 	async def ping(self, ctx: Context):
 		# Database ping calculation
 		database_start = perf_counter()
-		await self.client.db.execute("SELECT 1")
+		await self.client.queries.execute("ping")
 		database = perf_counter() - database_start
 
 		await ctx.send("ping", latency=float(self.client.latency), db=float(database))
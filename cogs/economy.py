@@ -96,20 +96,10 @@ class EconomyHelper:
 			await self.remove_money(user_id, guild_id, -need, "bank")
 
 		if wallet == "cash":
-			await self.client.db.execute(
-				"UPDATE economy SET cash = $1 WHERE user_id = $2 AND guild_id = $3",
-				cash + amount,
-				user_id,
-				guild_id,
-			)
+			await self.client.queries.execute("economy.set_cash", guild_id, user_id, cash + amount)
 			return cash + amount
 		else:
-			await self.client.db.execute(
-				"UPDATE economy SET bank = $1 WHERE user_id = $2 AND guild_id = $3",
-				bank + amount,
-				user_id,
-				guild_id,
-			)
+			await self.client.queries.execute("economy.set_bank", guild_id, user_id, bank + amount)
 			return bank + amount
 
 	async def remove_money(
@@ -148,21 +138,11 @@ class EconomyHelper:
 		if wallet == "cash":
 			if cash - amount < 0:
 				raise ValueError("Not enough money")
-			await self.client.db.execute(
-				"UPDATE economy SET cash = $1 WHERE user_id = $2 AND guild_id = $3",
-				cash - amount,
-				user_id,
-				guild_id,
-			)
-			return int(cash - amount)
+			await self.client.queries.execute("economy.set_cash", guild_id, user_id, cash - amount)
+			return cash - amount
 		else:
-			await self.client.db.execute(
-				"UPDATE economy SET bank = $1 WHERE user_id = $2 AND guild_id = $3",
-				bank - amount,
-				user_id,
-				guild_id,
-			)
-			return int(bank - amount)
+			await self.client.queries.execute("economy.set_bank", guild_id, user_id, bank - amount)
+			return bank - amount
 
 	async def get_balance(
 		self,
@@ -195,25 +175,13 @@ class EconomyHelper:
 
 		match wallet:
 			case "cash":
-				balance = await self.client.db.fetchval(
-					"SELECT cash FROM economy WHERE user_id = $1 AND guild_id = $2",
-					user_id,
-					guild_id,
-				)
+				balance = await self.client.queries.fetchval("economy.cash", guild_id, user_id)
 			case "bank":
-				balance = await self.client.db.fetchval(
-					"SELECT bank FROM economy WHERE user_id = $1 AND guild_id = $2",
-					user_id,
-					guild_id,
-				)
+				balance = await self.client.queries.fetchval("economy.bank", guild_id, user_id)
 			case _:
-				row = await self.client.db.fetchrow(
-					"SELECT * FROM economy WHERE user_id = $1 AND guild_id = $2",
-					user_id,
-					guild_id,
-				)
-				return int(row["cash"]), int(row["bank"])
-		return int(balance)
+				row = await self.client.queries.fetchrow("economy.get", guild_id, user_id)
+				return row["cash"], row["bank"]
+		return balance
 
 	async def register_user(self, user_id: int, guild_id: int) -> None:
 		"""
@@ -231,17 +199,9 @@ class EconomyHelper:
 		ValueError
 		        If the user is already in the database.
 		"""
-		row = await self.client.db.fetchrow(
-			"SELECT * FROM economy WHERE user_id = $1 AND guild_id = $2",
-			user_id,
-			guild_id,
-		)
+		row = await self.client.queries.fetchrow("economy.get", guild_id, user_id)
 		if not row:
-			await self.client.db.execute(
-				"INSERT INTO economy(user_id, guild_id) VALUES($1, $2)",
-				user_id,
-				guild_id,
-			)
+			await self.client.queries.execute("economy.insert", guild_id, user_id, 0, 0)
 		else:
 			raise ValueError("User already registered ({} @ {})".format(user_id, guild_id))
 
@@ -266,40 +226,14 @@ class EconomyHelper:
 		wallet: Literal[`"cash"`, `"bank"`]
 		        The wallet to set the balance of. Defaults to cash.
 		"""
-		row = await self.client.db.fetchrow(
-			"SELECT * FROM economy WHERE user_id = $1 AND guild_id = $2",
-			user_id,
-			guild_id,
-		)
+		row = await self.client.queries.fetchrow("economy.get", guild_id, user_id)
 		if not row:
-			if wallet == "cash":
-				await self.client.db.execute(
-					"INSERT INTO economy(user_id, guild_id, cash) VALUES($1, $2, $3)",
-					user_id,
-					guild_id,
-					amount,
-				)
-			else:
-				await self.client.db.execute(
-					"INSERT INTO economy(user_id, guild_id, bank) VALUES($1, $2, $3)",
-					user_id,
-					guild_id,
-					amount,
-				)
-		if wallet == "cash":
-			await self.client.db.execute(
-				"UPDATE economy SET cash = $1 WHERE user_id = $2 AND guild_id = $3",
-				amount,
-				user_id,
-				guild_id,
-			)
+			cash, bank = (amount, 0) if wallet == "cash" else (0, amount)
+			await self.client.queries.execute("economy.insert", guild_id, user_id, cash, bank)
+		elif wallet == "cash":
+			await self.client.queries.execute("economy.set_cash", guild_id, user_id, amount)
 		else:
-			await self.client.db.execute(
-				"UPDATE economy SET bank = $1 WHERE user_id = $2 AND guild_id = $3",
-				amount,
-				user_id,
-				guild_id,
-			)
+			await self.client.queries.execute("economy.set_bank", guild_id, user_id, amount)
 
 
 @app_commands.guild_only()
@@ -312,10 +246,7 @@ class Economy(commands.GroupCog, name="Economy", group_name="economy"):
 
 	@commands.hybrid_command(name="leaderboard", description="leaderboard_specs-description")
 	async def leaderboard(self, ctx: commands.Context):
-		rows = await self.client.db.fetch(
-			"SELECT * FROM economy WHERE guild_id = $1 ORDER BY cash+bank DESC LIMIT 10",
-			ctx.guild.id,
-		)
+		rows = await self.client.queries.fetch("economy.leaderboard", ctx.guild.id)
 		message: dict = await self.custom_response("leaderboard", ctx)
 		embeds: list[discord.Embed] = message.get("embeds")
 		if not rows:
@@ -624,7 +555,7 @@ class Shop(commands.Cog, name="Shop"):
 		fallback="shop_specs-fallback",
 	)
 	async def shop(self, ctx: Context):
-		row = await self.client.db.fetch("SELECT * FROM shop WHERE guild_id = $1", str(ctx.guild.id))
+		row = await self.client.queries.fetch("shop.list", ctx.guild.id)
 		if not row:
 			return await ctx.send("shop.list.empty")
 
@@ -650,11 +581,7 @@ class Shop(commands.Cog, name="Shop"):
 	@app_commands.rename(item_name="buy_specs-args-item-name")
 	@app_commands.describe(item_name="buy_specs-args-item-description")
 	async def buy(self, ctx: Context, item_name: str):
-		row = await self.client.db.fetchrow(
-			"SELECT * FROM shop WHERE guild_id = $1 AND LOWER(item_name) = $2",
-			ctx.guild.id,
-			item_name.lower(),
-		)
+		row = await self.client.queries.fetchrow("shop.get", ctx.guild.id, item_name)
 		if not row:
 			await ctx.send("shop.buy.errors.not_found")
 			return
@@ -699,16 +626,12 @@ class Shop(commands.Cog, name="Shop"):
 	@app_commands.checks.has_permissions(manage_guild=True, manage_roles=True)
 	@commands.has_permissions(manage_guild=True, manage_roles=True)
 	async def set_item(self, ctx: Context, item_name: str, price: int, description: str, role: discord.Role):
-		row = await self.client.db.fetchrow(
-			"SELECT * FROM shop WHERE guild_id = $1 AND LOWER(item_name) = $2",
-			str(ctx.guild.id),
-			item_name.lower(),
-		)
+		row = await self.client.queries.fetchrow("shop.get", ctx.guild.id, item_name)
 		if row:
 			await ctx.send("shop.set.errors.already_item")
 			return
 
-		items = await self.client.db.fetch("SELECT * FROM shop WHERE guild_id = $1", ctx.guild.id)
+		items = await self.client.queries.fetch("shop.list", ctx.guild.id)
 		if len(items) + 1 >= 10:
 			await ctx.send("shop.set.errors.limit")
 			return
@@ -717,14 +640,8 @@ class Shop(commands.Cog, name="Shop"):
 			await ctx.send("shop.set.errors.role_higher")
 			return
 
-		await self.client.db.execute(
-			"INSERT INTO shop(item_name, item_description, item_price, role, guild_id, creator_id) VALUES($1, $2, $3, $4, $5, $6)",
-			item_name,
-			description,
-			price,
-			role.id,
-			ctx.guild.id,
-			ctx.author.id,
+		await self.client.queries.execute(
+			"shop.insert", ctx.guild.id, item_name, description, price, role.id, ctx.author.id
 		)
 
 		item = ShopItem(item_name, price, description, role)
@@ -739,11 +656,7 @@ class Shop(commands.Cog, name="Shop"):
 	@app_commands.describe(item_name="remove_item_specs-args-item-description")
 	@app_commands.checks.has_permissions(manage_guild=True)
 	async def remove_item(self, ctx: Context, item_name: str):
-		row = await self.client.db.fetchrow(
-			"SELECT * FROM shop WHERE guild_id = $1 AND LOWER(item_name) = $2",
-			ctx.guild.id,
-			item_name.lower(),
-		)
+		row = await self.client.queries.fetchrow("shop.get", ctx.guild.id, item_name)
 		if not row:
 			await ctx.send("shop.remove.errors.not_found")
 			return
@@ -758,11 +671,7 @@ class Shop(commands.Cog, name="Shop"):
 			await ctx.send("shop.remove.errors.role_higher")
 			return
 
-		await self.client.db.execute(
-			"DELETE FROM shop WHERE guild_id = $1 AND LOWER(item_name) = $2",
-			ctx.guild.id,
-			item.name.lower(),
-		)
+		await self.client.queries.execute("shop.delete", ctx.guild.id, item.name)
 		await ctx.send("shop.remove.success", item=item)
 
 
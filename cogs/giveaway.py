@@ -1,4 +1,5 @@
 import asyncio
+import contextvars
 import random
 from datetime import datetime, timedelta
 from typing import Optional
@@ -21,7 +22,12 @@ class Giveaway(commands.Cog, name="Giveaway"):
 		self.GIVEAWAY_EMOJI = "🎉"
 
 	async def load_active_giveaways(self):
-		giveaways = await self.client.db.fetch("SELECT * FROM giveaways WHERE ended = FALSE")
+		if self.client.shard_ids is None:  # this process runs every shard
+			giveaways = await self.client.queries.fetch("giveaways.active")
+		else:
+			giveaways = await self.client.queries.fetch(
+				"giveaways.active_for_shards", self.client.shard_count, list(self.client.shard_ids)
+			)
 
 		for giveaway in giveaways:
 			end_time = giveaway["ends_at"]
@@ -42,7 +48,8 @@ class Giveaway(commands.Cog, name="Giveaway"):
 				self.client.loop.create_task(self.end_giveaway(None, giveaway["message_id"], giveaway["channel_id"]))
 
 	async def cog_load(self):
-		await self.load_active_giveaways()
+		if not self.client.interactions_only:  # the gateway processes end the giveaways
+			await self.load_active_giveaways()
 
 	async def end_giveaway(self, ctx: Context | None, message_id: int, channel_id: int, right_now: bool = False):
 		if message_id not in self.active_giveaways:
@@ -65,6 +72,9 @@ class Giveaway(commands.Cog, name="Giveaway"):
 				participants = []
 			else:
 				participants = [user.id async for user in reaction.users() if user.id != self.client.user.id]
+				# those who left the server since can't win, if its members can be checked
+				if message.guild and await self.client.chunker.chunk(message.guild):
+					participants = [user_id for user_id in participants if message.guild.get_member(user_id)]
 
 			winners = []
 			winner_ids = []
@@ -82,21 +92,11 @@ class Giveaway(commands.Cog, name="Giveaway"):
 				response = await self.custom_response("giveaway.end.no_winners", ctx or message)
 				await message.reply(**response)
 
-			await self.client.db.execute(
-				"UPDATE giveaways SET ended = TRUE, won_by = $1 WHERE message_id = $2",
-				winner_ids,
-				message_id,
-			)
+			await self.client.queries.execute("giveaways.end", message_id, winner_ids)
 			del self.active_giveaways[message_id]
 
-			await self.client.db.execute(
-				"UPDATE giveaways SET ended = TRUE, won_by = $1 WHERE message_id = $2",
-				winner_ids,
-				message_id,
-			)
-
 		except discord.NotFound:
-			await self.client.db.execute("DELETE FROM giveaways WHERE message_id = $1", message_id)
+			await self.client.queries.execute("giveaways.delete", message_id)
 		except Exception as e:
 			logger.error(f"Error ending giveaway: {e}")
 			raise e
@@ -144,10 +144,8 @@ class Giveaway(commands.Cog, name="Giveaway"):
 
 		await message.add_reaction(self.GIVEAWAY_EMOJI)
 
-		await self.client.db.execute(
-			"INSERT INTO giveaways"
-			" (guild_id, channel_id, message_id, author_id, prize, winners, ends_at, ended, won_by)"
-			" VALUES ($1, $2, $3, $4, $5, $6, $7, FALSE, NULL)",
+		await self.client.queries.execute(
+			"giveaways.insert",
 			ctx.guild.id,
 			ctx.channel.id,
 			message.id,
@@ -163,7 +161,8 @@ class Giveaway(commands.Cog, name="Giveaway"):
 			"channel_id": ctx.channel.id,
 		}
 
-		self.client.loop.create_task(self.end_giveaway(ctx, message.id, ctx.channel.id))
+		# the giveaway ends long after the command, so it mustn't inherit the command's deadline
+		self.client.loop.create_task(self.end_giveaway(ctx, message.id, ctx.channel.id), context=contextvars.Context())
 
 	@giveaway.command(name="end", description="gw_end-description", usage="gw_end-usage", aliases=["reroll"])
 	@app_commands.rename(message="gw_end-args-message_id-name")
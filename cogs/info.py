@@ -3,11 +3,8 @@ import re
 from typing import Optional
 
 import discord
-import pypokedex
-import requests
 from discord import app_commands
 from discord.ext import commands
-from emoji.unicode_codes import EMOJI_DATA
 
 from core import Context, MyClient
 from helpers.custom_args import (
@@ -26,8 +23,14 @@ from helpers.custom_args import (
 	CustomVoiceChannel,
 	IPAddress,
 )
+from helpers.lazy import LazyModule
 from helpers.regex import DISCORD_TEMPLATE
 
+# each is used by a single command, don't load them with the cog
+emoji_data = LazyModule("emoji.unicode_codes")
+pypokedex = LazyModule("pypokedex")
+requests = LazyModule("requests")
+
 
 class Info(commands.Cog, name="Information"):
 	def __init__(self, client: MyClient):
@@ -112,7 +115,7 @@ class Info(commands.Cog, name="Information"):
 			emoji = discord.PartialEmoji.from_str(emoji_name)
 		if isinstance(emoji, discord.Emoji):
 			await ctx.send("info.emoji.custom_emoji", emoji=CustomEmoji.from_emoji(emoji))
-		elif isinstance(emoji, discord.PartialEmoji) and emoji.name in EMOJI_DATA:
+		elif isinstance(emoji, discord.PartialEmoji) and emoji.name in emoji_data.EMOJI_DATA:
 			await ctx.send("info.emoji.unicode_emoji", emoji=CustomPartialEmoji.from_emoji(emoji))
 		else:
 			raise commands.BadArgument("emoji")
@@ -170,11 +173,14 @@ class Info(commands.Cog, name="Information"):
 			except discord.NotFound:
 				pass
 
-		template_code = await self.client.db.fetchrow("SELECT * FROM snapshots WHERE code = $1", template.lower())
-		if template_code:
+		template_code = await self.client.queries.fetchrow("snapshots.get", template.lower())
+		snapshots = self.client.get_cog("Snapshots")
+		if template_code and snapshots:
+			# snapshots are stored as deltas, so the payload has to be reconstructed to count roles and channels
+			payload = await snapshots.get_snapshot(template_code["code"])
 			return await ctx.send(
 				"info.template",
-				template=await CustomTemplate.from_dict(self.client, template_code),
+				template=await CustomTemplate.from_dict(self.client, {**template_code, "payload": payload}),
 			)
 		raise commands.BadArgument("template")
 
@@ -1,12 +1,17 @@
+import asyncio
 import datetime
 import sys
-from typing import Literal, Optional, Union, overload
+from dataclasses import dataclass
+from logging import getLogger
+from typing import Any, Literal, Optional, Union, overload
 
+import asyncpg
 import discord
 from discord import app_commands
-from discord.ext import commands
+from discord.ext import commands, tasks
+from discord.ext.localization import Localization
 
-from core import Context, MyClient
+from core import Context, DatabaseUnavailable, GuildCache, Invalidation, MyClient
 from helpers import (
 	CustomAutoModAction,
 	CustomAutoModRule,
@@ -17,12 +22,290 @@ from helpers import (
 	CustomUser,
 	FormatDateTime,
 	convert_to_custom_channel,
+	text_to_seconds,
 )
 
+logger = getLogger(__name__)
+
+ARCHIVE_QUEUE_SIZE = 50_000
+"""Maximum number of events waiting to be written. Events are dropped (and counted) when the queue is full."""
+ARCHIVE_BATCH_SIZE = 1_000
+"""Maximum number of events written with a single COPY."""
+ARCHIVE_FLUSH_INTERVAL = 1.0
+"""Seconds to wait for more events when a batch isn't full yet."""
+ARCHIVE_RETENTION_MONTHS = 6
+"""Number of monthly partitions to keep, including the current one."""
+ARCHIVE_TEXT_LIMIT = 200
+"""Maximum length of strings stored in an event's data."""
+SEARCH_PAGE_SIZE = 10
+
+_ACTOR_KEYS = ("created_by", "deleted_by", "updated_by")
+_TARGET_KEYS = ("channel", "message", "after", "rule", "execution", "invite")
+
+
+@dataclass(slots=True)
+class ArchivedEvent:
+	"""A log event read back from the archive."""
+
+	id: int
+	event: str
+	action: str
+	actor_id: Optional[int]
+	target_id: Optional[int]
+	ts: datetime.datetime
+	data: Optional[dict]
+
+	@property
+	def actor(self) -> str:
+		"""Returns a mention of the user who triggered the event, or ``-`` if unknown."""
+		return f"<@{self.actor_id}>" if self.actor_id else "-"
+
+	@property
+	def target(self) -> str:
+		"""Returns the ID of the event's target, or ``-`` if there is none."""
+		return str(self.target_id) if self.target_id else "-"
+
+	@property
+	def time(self) -> FormatDateTime:
+		"""Returns when the event happened as a relative Discord timestamp."""
+		return FormatDateTime(self.ts, "R")
+
+
+class LogArchive:
+	def __init__(self, client: MyClient):
+		"""Writes log events into the monthly partitioned ``log_events`` table.
+
+		Events are queued by `record` without waiting on the database and written in batches with COPY by a
+		background task, so listeners never block on ingest, not even during raids.
+
+		Parameters
+		----------
+		client: `MyClient`
+			The client with a `db` attribute.
+		"""
+		self.client = client
+		self.queue: asyncio.Queue[tuple] = asyncio.Queue(maxsize=ARCHIVE_QUEUE_SIZE)
+		self.dropped = 0
+		self._task: Optional[asyncio.Task] = None
+
+	@staticmethod
+	def _compact(value: Any) -> Any:
+		"""Reduces a localization argument to the few fields worth storing."""
+		if value is None or isinstance(value, (bool, int, float)):
+			return value
+		if isinstance(value, str):
+			return value[:ARCHIVE_TEXT_LIMIT]
+		compact = {}
+		for attribute in ("id", "code", "name", "content"):
+			item = getattr(value, attribute, None)
+			if isinstance(item, str):
+				compact[attribute] = item[:ARCHIVE_TEXT_LIMIT]
+			elif isinstance(item, int):
+				compact[attribute] = item
+		return compact or str(value)[:ARCHIVE_TEXT_LIMIT]
+
+	def record(self, guild_id: int, event: str, action: str, **kwargs: Any) -> None:
+		"""Queues a log event for archival. This never waits on the database.
+
+		Parameters
+		----------
+		guild_id: `int`
+			The guild's ID.
+		event: `str`
+			The name of the listener, e.g. ``on_guild_channel_delete``.
+		action: `str`
+			The kind of change within the event, e.g. ``delete`` or ``topic``.
+		kwargs
+			The arguments that were passed to the log message's localization.
+		"""
+		actor = next((kwargs[key] for key in _ACTOR_KEYS if kwargs.get(key)), None)
+		if actor is None:
+			message = kwargs.get("after") or kwargs.get("message")
+			actor = message.author if isinstance(message, CustomMessage) else None
+		target = next((kwargs[key] for key in _TARGET_KEYS if getattr(kwargs.get(key), "id", None)), None)
+
+		data = {key: self._compact(value) for key, value in kwargs.items() if value is not None}
+		try:
+			self.queue.put_nowait(
+				(
+					guild_id,
+					event,
+					action,
+					getattr(actor, "id", None),
+					getattr(target, "id", None),
+					discord.utils.utcnow(),
+					data,
+				)
+			)
+		except asyncio.QueueFull:
+			self.dropped += 1
+			if self.dropped % 1000 == 1:
+				logger.warning(f"Log archive queue is full, {self.dropped} events dropped so far")
+
+	def start(self) -> None:
+		if self._task is None or self._task.done():
+			self._task = asyncio.create_task(self._writer())
+
+	async def stop(self) -> None:
+		"""Stops the writer and flushes whatever is still queued."""
+		if self._task:
+			self._task.cancel()
+			try:
+				await self._task
+			except asyncio.CancelledError:
+				pass
+			self._task = None
+		records = self._drain([])
+		if records:
+			await self._write(records)
+
+	def _drain(self, records: list[tuple]) -> list[tuple]:
+		while len(records) < ARCHIVE_BATCH_SIZE:
+			try:
+				records.append(self.queue.get_nowait())
+			except asyncio.QueueEmpty:
+				break
+		return records
+
+	async def _writer(self) -> None:
+		while True:
+			records = self._drain([await self.queue.get()])
+			if len(records) < ARCHIVE_BATCH_SIZE:
+				# give quiet periods a chance to fill the batch, so we don't COPY one row at a time
+				await asyncio.sleep(ARCHIVE_FLUSH_INTERVAL)
+				records = self._drain(records)
+			try:
+				await self._write(records)
+			except Exception as e:
+				logger.error(f"Failed to archive {len(records)} log events: {e}")
+
+	async def _write(self, records: list[tuple]) -> None:
+		columns = ("guild_id", "event", "action", "actor_id", "target_id", "ts", "data")
+		try:
+			await self.client.db.copy_records_to_table("log_events", records=records, columns=columns)
+		except asyncpg.CheckViolationError:
+			# no partition for these rows yet (e.g. the month just rolled over)
+			for month in {self._month_start(record[5]) for record in records}:
+				await self.ensure_partition(month)
+			await self.client.db.copy_records_to_table("log_events", records=records, columns=columns)
+
+	@staticmethod
+	def _month_start(when: datetime.datetime) -> datetime.datetime:
+		return when.astimezone(datetime.timezone.utc).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+	@staticmethod
+	def _next_month(month: datetime.datetime) -> datetime.datetime:
+		return (
+			month.replace(year=month.year + 1, month=1) if month.month == 12 else month.replace(month=month.month + 1)
+		)
+
+	@staticmethod
+	def _partition_name(month: datetime.datetime) -> str:
+		return f"log_events_y{month.year}m{month.month:02}"
+
+	async def ensure_partition(self, month: datetime.datetime) -> None:
+		"""Creates the partition holding the events of ``month``, if it doesn't exist yet."""
+		await self.client.db.execute(
+			f"CREATE TABLE IF NOT EXISTS {self._partition_name(month)} PARTITION OF log_events"
+			f" FOR VALUES FROM ('{month.isoformat()}') TO ('{self._next_month(month).isoformat()}')"
+		)
+
+	async def maintain_partitions(self) -> None:
+		"""Creates the partitions for this and next month, and drops partitions older than the retention period.
+
+		Expired events are removed by dropping whole partitions, which is instant and leaves no dead tuples behind.
+		"""
+		current = self._month_start(discord.utils.utcnow())
+		await self.ensure_partition(current)
+		await self.ensure_partition(self._next_month(current))
+
+		oldest = current
+		for _ in range(ARCHIVE_RETENTION_MONTHS - 1):
+			oldest = (oldest - datetime.timedelta(days=1)).replace(day=1)
+		partitions = await self.client.queries.fetch("log_events.partitions")
+		for row in partitions:
+			name: str = row["relname"]
+			if name < self._partition_name(oldest):  # the names sort chronologically
+				await self.client.db.execute(f"DROP TABLE IF EXISTS {name}")
+				logger.info(f"Dropped expired log partition {name}")
+
+	async def search(
+		self,
+		guild_id: int,
+		*,
+		event: Optional[str] = None,
+		actor_id: Optional[int] = None,
+		since: Optional[datetime.datetime] = None,
+		before: Optional[tuple[datetime.datetime, int]] = None,
+		limit: int = SEARCH_PAGE_SIZE,
+	) -> list[ArchivedEvent]:
+		"""Searches a guild's archived events, newest first.
+
+		Pages are fetched with a keyset cursor instead of an OFFSET, so every page costs the same no matter how
+		deep the user pages.
+
+		Parameters
+		----------
+		guild_id: `int`
+			The guild's ID.
+		event: Optional[`str`]
+			Only return events from this listener, e.g. ``on_guild_channel_delete``.
+		actor_id: Optional[`int`]
+			Only return events triggered by this user.
+		since: Optional[`datetime.datetime`]
+			Only return events newer than this.
+		before: Optional[tuple[`datetime.datetime`, `int`]]
+			The ``(ts, id)`` cursor of the last event of the previous page.
+		limit: `int`
+			The maximum number of events to return.
+
+		Returns
+		-------
+		list[`ArchivedEvent`]
+			The matching events.
+		"""
+		before_ts, before_id = before or (None, None)
+		rows = await self.client.queries.fetch(
+			"log_events.search", guild_id, event or None, actor_id or None, since, before_ts, before_id, limit
+		)
+		return [ArchivedEvent(**dict(row)) for row in rows]
+
+
+class LogSearchView(discord.ui.View):
+	def __init__(self, cog: "LogCommands", ctx: Context, filters: dict, first_page: list[ArchivedEvent]):
+		"""Pages through the results of ``log search``, fetching each page on demand."""
+		super().__init__(timeout=300)
+		self.cog = cog
+		self.ctx = ctx
+		self.filters = filters
+		self.pages: list[list[ArchivedEvent]] = [first_page]
+		self.page = 0
+
+	async def interaction_check(self, interaction: discord.Interaction) -> bool:
+		return interaction.user == self.ctx.author
+
+	@discord.ui.button(emoji="◀️", style=discord.ButtonStyle.gray)
+	async def prev_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+		self.page = max(self.page - 1, 0)
+		await interaction.response.edit_message(**await self.cog.search_message(self.ctx, self.pages[self.page]))
+
+	@discord.ui.button(emoji="▶️", style=discord.ButtonStyle.gray)
+	async def next_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+		if self.page == len(self.pages) - 1:
+			last = self.pages[-1][-1]
+			events = await self.cog.archive.search(self.ctx.guild.id, before=(last.ts, last.id), **self.filters)
+			if not events:
+				await interaction.response.defer()
+				return
+			self.pages.append(events)
+		self.page += 1
+		await interaction.response.edit_message(**await self.cog.search_message(self.ctx, self.pages[self.page]))
+
 
 class LogCommands(commands.Cog, name="Logging"):
-	def __init__(self, client: MyClient) -> None:
+	def __init__(self, client: MyClient, archive: LogArchive) -> None:
 		self.client = client
+		self.archive = archive
 
 	@commands.hybrid_group(
 		name="log", fallback="log_specs-fallback", description="log_specs-description", usage="log_specs-usage"
@@ -47,19 +330,13 @@ class LogCommands(commands.Cog, name="Logging"):
 				await channel.webhooks(), name=f"{ctx.me.display_name} - Log"
 			) or await channel.create_webhook(name=f"{ctx.me.display_name} - Log", avatar=await ctx.me.avatar.read())
 		else:
-			await self.client.db.execute("UPDATE log SET is_on = FALSE WHERE guild_id = $1", ctx.guild.id)
+			await self.client.queries.execute("log.disable", ctx.guild.id)
+			self.client.message_cache.disable(ctx.guild.id)
 			await ctx.send("log.toggle.off")
 			return
 
-		await self.client.db.execute(
-			"INSERT INTO log (guild_id, webhook, channel, is_on) VALUES ($1, $2, $3, $4)"
-			" ON CONFLICT (guild_id) DO UPDATE"
-			" SET webhook = excluded.webhook, channel = excluded.channel, is_on = excluded.is_on",
-			ctx.guild.id,
-			webhook.url,
-			channel.id,
-			is_on,
-		)
+		await self.client.queries.execute("log.enable", ctx.guild.id, webhook.url, channel.id)
+		self.client.message_cache.enable(ctx.guild.id)
 		await ctx.send(content="log.toggle.on", channel=CustomTextChannel.from_channel(channel))
 
 	@log_toggle.command(name="add", description="logadd_specs-description", usage="logadd_specs-usage")
@@ -68,13 +345,9 @@ class LogCommands(commands.Cog, name="Logging"):
 	@commands.has_permissions(manage_guild=True)
 	async def log_module_add(self, ctx: Context, module: str):
 		if module == "all":
-			await self.client.db.execute("UPDATE log SET modules = DEFAULT WHERE guild_id = $1", ctx.guild.id)
+			await self.client.queries.execute("log.add_all_modules", ctx.guild.id)
 		else:
-			await self.client.db.execute(
-				"UPDATE log SET modules = array_append(modules, $1) WHERE guild_id = $2",
-				module,
-				ctx.guild.id,
-			)
+			await self.client.queries.execute("log.add_module", ctx.guild.id, module)
 
 		await ctx.send("log.module.add", module=module)
 
@@ -84,20 +357,122 @@ class LogCommands(commands.Cog, name="Logging"):
 	@commands.has_permissions(manage_guild=True)
 	async def log_module_remove(self, ctx: Context, module: str):
 		if module == "all":
-			await self.client.db.execute("UPDATE log SET modules = ARRAY[] WHERE guild_id = $1", ctx.guild.id)
+			await self.client.queries.execute("log.remove_all_modules", ctx.guild.id)
 		else:
-			await self.client.db.execute(
-				"UPDATE log SET modules = array_remove(modules, $1) WHERE guild_id = $2",
-				module,
-				ctx.guild.id,
-			)
+			await self.client.queries.execute("log.remove_module", ctx.guild.id, module)
 
 		await ctx.send("log.module.remove", module=module)
 
+	async def search_message(self, ctx: Context, events: list[ArchivedEvent]) -> dict:
+		message: dict = await self.client.custom_response("log.search.response", ctx, convert_embeds=False)
+		embeds: list[dict] = message.get("embeds", [])
+		if embeds:
+			template = embeds[0].get("fields", [None])[0]
+			if events and template:
+				embeds[0]["fields"] = [Localization.format_strings(template, entry=event) for event in events]
+			elif not events:
+				embeds[0]["fields"] = embeds[0].get("fields", [])[1:]
+		return CustomResponse.convert_embeds(message)
+
+	@log_toggle.command(name="search", description="logsearch_specs-description", usage="logsearch_specs-usage")
+	@app_commands.rename(
+		event="logsearch_specs-args-event-name",
+		user="logsearch_specs-args-user-name",
+		since="logsearch_specs-args-since-name",
+	)
+	@app_commands.describe(
+		event="logsearch_specs-args-event-description",
+		user="logsearch_specs-args-user-description",
+		since="logsearch_specs-args-since-description",
+	)
+	@commands.has_permissions(manage_guild=True)
+	async def log_search(
+		self,
+		ctx: Context,
+		event: Optional[str] = None,
+		user: Optional[discord.User] = None,
+		since: Optional[str] = None,
+	):
+		try:
+			since_dt = discord.utils.utcnow() - datetime.timedelta(seconds=text_to_seconds(since)) if since else None
+		except ValueError:
+			raise commands.BadArgument("since")
+
+		filters = {"event": event, "actor_id": user.id if user else None, "since": since_dt}
+		events = await self.archive.search(ctx.guild.id, **filters)
+		message = await self.search_message(ctx, events)
+		view = LogSearchView(self, ctx, filters, events) if len(events) == SEARCH_PAGE_SIZE else None
+		await ctx.send(**message, view=view)
+
 
 class LogListeners(commands.Cog):
-	def __init__(self, client: MyClient) -> None:
+	# the message, AutoMod and invite events it logs. The channel events come with the guilds
+	intents = discord.Intents(
+		guild_messages=True,
+		message_content=True,
+		auto_moderation_configuration=True,
+		auto_moderation_execution=True,
+		invites=True,
+	)
+
+	def __init__(self, client: MyClient, archive: LogArchive) -> None:
 		self.client = client
+		self.archive = archive
+		# whether logging is on and the webhook, by guild. Kept until the log row changes, see `core.invalidation`
+		self.settings: GuildCache[tuple[bool, Optional[discord.Webhook]]] = GuildCache(
+			self._load_settings, encode=self._encode_settings, decode=self._decode_settings
+		)
+
+	async def cog_load(self) -> None:
+		# message edits and deletions are only logged if the message is cached, so only cache where logging is on
+		for row in await self.client.queries.fetch("log.enabled_guilds"):
+			self.client.message_cache.enable(row["guild_id"])
+		self.client.invalidation.subscribe("log", self.invalidate_settings)
+		self.client.resume.track("log", "log", self.settings)
+		self.archive.start()
+		self.maintain_archive.add_exception_type(DatabaseUnavailable)
+		if self.client.is_primary_cluster:  # the partitions are shared by every process
+			self.maintain_archive.start()
+
+	async def cog_unload(self) -> None:
+		self.client.invalidation.unsubscribe("log", self.invalidate_settings)
+		self.client.resume.untrack("log")
+		self.maintain_archive.cancel()
+		await self.archive.stop()
+
+	async def _load_settings(self, guild_id: int) -> tuple[bool, Optional[discord.Webhook]]:
+		# cached until the next change, so read from the primary, the replica may not have the change yet
+		row = await self.client.queries.fetchrow("log.settings", guild_id, connection=self.client.db)
+		if not row:
+			return False, None
+		webhook = discord.Webhook.from_url(row["webhook"], client=self.client) if row["webhook"] else None
+		return bool(row["is_on"]), webhook
+
+	@staticmethod
+	def _encode_settings(settings: tuple[bool, Optional[discord.Webhook]]) -> tuple[bool, Optional[str]]:
+		is_on, webhook = settings
+		return is_on, webhook.url if webhook else None
+
+	def _decode_settings(self, data: tuple[bool, Optional[str]]) -> tuple[bool, Optional[discord.Webhook]]:
+		is_on, url = data
+		return is_on, discord.Webhook.from_url(url, client=self.client) if url else None
+
+	async def invalidate_settings(self, invalidation: Invalidation) -> None:
+		"""Drops the cached settings of a guild when they change, and turns its message cache on or off to match."""
+		self.settings.invalidate(invalidation.guild_id)
+		if invalidation.guild_id is None:
+			rows = await self.client.queries.fetch("log.enabled_guilds", connection=self.client.db)
+			self.client.message_cache.set_enabled(row["guild_id"] for row in rows)
+			return
+		is_on, _ = await self.settings.get(invalidation.guild_id)
+		if is_on:
+			self.client.message_cache.enable(invalidation.guild_id)
+		elif self.client.message_cache.is_enabled(invalidation.guild_id):
+			self.client.message_cache.disable(invalidation.guild_id)
+
+	@tasks.loop(hours=24)
+	async def maintain_archive(self):
+		await self.archive.maintain_partitions()
 
 	# TODO:
 	# 'on_guild_update', 'on_guild_emojis_update', 'on_guild_stickers_update',
@@ -230,10 +605,11 @@ class LogListeners(commands.Cog):
 		Optional[`discord.Webhook`]
 			The webhook associated with the given ``guild_id``
 		"""
-		webhook = await self.client.db.fetchval("SELECT webhook FROM log WHERE guild_id = $1", guild_id)
-		if not webhook:
+		try:
+			_, webhook = await self.settings.get(guild_id)
+		except DatabaseUnavailable:
 			return None
-		return discord.Webhook.from_url(webhook, client=self.client)
+		return webhook
 
 	async def send_webhook(self, guild_id: int, event: str, **kwargs):
 		"""
@@ -248,7 +624,9 @@ class LogListeners(commands.Cog):
 			return
 
 		# automatically retreive the name of the function that calls this function and use it as the key
-		key = f"log.{sys._getframe(1).f_code.co_name}.{event}"  # type: ignore
+		listener = sys._getframe(1).f_code.co_name  # type: ignore
+		key = f"log.{listener}.{event}"
+		self.archive.record(guild_id, listener, event, **kwargs)
 
 		webhook: Optional[discord.Webhook] = await self._get_webhook(guild_id)  # type: ignore
 		if not webhook:
@@ -289,8 +667,11 @@ class LogListeners(commands.Cog):
 		# retrieve calling function name
 		# func_name = sys._getframe(1).f_code.co_name  # type: ignore
 
-		result = await self.client.db.fetchval("SELECT is_on FROM log WHERE guild_id = $1", guild_id)
-		return result
+		try:
+			is_on, _ = await self.settings.get(guild_id)
+		except DatabaseUnavailable:
+			return False  # events aren't logged while the database is down
+		return is_on
 
 	@commands.Cog.listener()
 	async def on_message_edit(self, before: discord.Message, after: discord.Message):
@@ -512,5 +893,6 @@ class LogListeners(commands.Cog):
 
 
 async def setup(client: MyClient) -> None:
-	await client.add_cog(LogCommands(client))
-	await client.add_cog(LogListeners(client))
+	archive = LogArchive(client)
+	await client.add_cog(LogCommands(client, archive))
+	await client.add_cog(LogListeners(client, archive))
@@ -1,21 +1,20 @@
+import asyncio
 import datetime
 from copy import deepcopy
 from enum import Enum
 from typing import Any, Literal, Self
 
-import asyncpg
 import discord
 from discord import app_commands
 from discord.ext import commands
 
-from core import Context, MyClient
+from core import Context, MyClient, Queries
 from helpers import (
 	CustomGuild,
 	CustomMember,
 	CustomTextChannel,
 	CustomUser,
 	FormatDateTime,
-	convert_to_query,
 	custom_response,
 	seconds_to_text,
 	text_to_seconds,
@@ -116,7 +115,7 @@ class Case:
 	@classmethod
 	async def from_user(
 		cls,
-		db: asyncpg.Pool,
+		db: Queries,
 		user: discord.Member | discord.User,
 		client: discord.Client,
 		guild: discord.Guild,
@@ -127,8 +126,8 @@ class Case:
 
 		Parameters
 		----------
-		db: `asyncpg.Pool`
-		        The database connection pool.
+		db: `Queries`
+		        The statements to query the database with.
 		user: Union[`discord.Member`, `discord.User`]
 		        The user to get the cases from.
 		client: `discord.Client`
@@ -150,7 +149,7 @@ class Case:
 	@classmethod
 	async def from_moderator(
 		cls,
-		db: asyncpg.Pool,
+		db: Queries,
 		moderator: discord.User,
 		client: discord.Client,
 		guild: discord.Guild,
@@ -160,8 +159,8 @@ class Case:
 
 		Parameters
 		----------
-		db: `asyncpg.Pool`
-		        The database connection pool.
+		db: `Queries`
+		        The statements to query the database with.
 		moderator: `discord.User`
 		        The moderator to get the cases from.
 		client: `discord.Client`
@@ -181,7 +180,7 @@ class Case:
 	@classmethod
 	async def from_id(
 		cls,
-		db: asyncpg.Pool,
+		db: Queries,
 		client: discord.Client,
 		guild: discord.Guild,
 		case_id: int,
@@ -191,8 +190,8 @@ class Case:
 
 		Parameters
 		----------
-		db: `asyncpg.Pool`
-		        The database connection pool.
+		db: `Queries`
+		        The statements to query the database with.
 		client: `discord.Client`
 		        The client to get the guilds with.
 		guild: `discord.Guild`
@@ -207,52 +206,59 @@ class Case:
 		Optional[`Case`]
 		        The case.
 		"""
-		result = await db.fetch(
-			"SELECT * FROM cases WHERE case_id = $1 AND guild_id = $2",
-			case_id,
-			guild.id,
-		)
+		result = await db.fetchrow("cases.get", guild.id, case_id)
 		if not result:
 			return None
-		return cls.from_dict(result[0], client, get_type)
+		return cls.from_dict(result, client, get_type)
 
 	@classmethod
 	async def from_db(
 		cls,
-		db: asyncpg.Pool,
+		db: Queries,
 		client: discord.Client,
-		guild: discord.Guild | None = None,
+		guild: discord.Guild,
 		*,
 		limit: int | None = None,
 		get_type: bool = False,
-		**filters: Any,
+		user: discord.abc.Snowflake | None = None,
+		moderator: discord.abc.Snowflake | None = None,
+		expires: datetime.datetime | None = None,
 	) -> list[Any]:
 		"""
 		Retrieve cases from the database based on the provided attributes.
 
 		Parameters
 		----------
-		db: `asyncpg.Pool`
-		        The database connection pool.
+		db: `Queries`
+		        The statements to query the database with.
 		client: `discord.Client`
 		        The client instance.
 		guild: `discord.Guild`
-		        The guild to get the cases for. Defaults to None.
+		        The guild to get the cases for.
 		limit: `int`
 		        The limit of cases to retrieve. If None, retrieves all cases.
 		get_type: `bool`
 		        Set to true if you want a Case object. Set to false if you want a corresponding mod action object.
-		**filters: Any
-		        Additional filters for querying cases (e.g., user=..., moderator=...).
+		user: Optional[`discord.abc.Snowflake`]
+		        Only retrieve the cases of this user.
+		moderator: Optional[`discord.abc.Snowflake`]
+		        Only retrieve the cases given by this moderator.
+		expires: Optional[`datetime.datetime`]
+		        Only retrieve the cases expiring at this time.
 
 		Returns
 		-------
 		list[`Case`]
 		        A list of cases matching the filters.
 		"""
-		query, query_parameters = convert_to_query("cases", guild, limit, **filters)
-
-		result = await db.fetch(query, *query_parameters)
+		result = await db.fetch(
+			"cases.search",
+			guild.id,
+			user.id if user else None,
+			moderator.id if moderator else None,
+			expires,
+			limit,
+		)
 
 		case_mapping = {
 			CaseType.WARN: Warn,
@@ -303,19 +309,19 @@ class Case:
 		Example usage: when deleting a Case(type=CaseType.MUTE), you want to remove the timeout from the user."""
 		pass
 
-	async def delete(self, db: asyncpg.Pool) -> None:
+	async def delete(self, db: Queries) -> None:
 		"""Delete the case from the database. This will also call `before_deletion` and `after_deletion`.
 
 		Parameters
 		----------
-		db: `asyncpg.Pool`
-		        The database connection pool.
+		db: `Queries`
+		        The statements to query the database with.
 		"""
 		if self._user not in self._guild.members:
 			return
 
 		await self.before_deletion()
-		await db.execute("DELETE FROM cases WHERE case_id = $1", self.id)
+		await db.execute("cases.delete", self.id)
 		await self.after_deletion()
 
 	async def before_creation(self) -> None:
@@ -326,13 +332,13 @@ class Case:
 		"""An overrideable method that is called after a case is created. The default implementation does nothing."""
 		pass
 
-	async def create(self, db: asyncpg.Pool) -> Self | None:
+	async def create(self, db: Queries) -> Self | None:
 		"""Create the case in the database.
 
 		Parameters
 		----------
-		db: `asyncpg.Pool`
-		        The database connection pool.
+		db: `Queries`
+		        The statements to query the database with.
 
 		Returns
 		-------
@@ -344,7 +350,7 @@ class Case:
 
 		await self.before_creation()
 		await db.execute(
-			"INSERT INTO cases (type, guild_id, case_id, user_id, moderator_id, reason, expires, message) VALUES ($1, $2, $3, $4, $5, $6, $7, $8)",
+			"cases.insert",
 			self.type.value,
 			self._guild.id,
 			self.id,
@@ -362,24 +368,17 @@ class Case:
 		"""Generate a case ID from a message."""
 		return message.id
 
-	async def edit(self, db: asyncpg.Pool, case: Self) -> None:
+	async def edit(self, db: Queries, case: Self) -> None:
 		"""Edit the case in the database.
 
 		Parameters
 		----------
-		db: `asyncpg.Pool`
-		        The database connection pool.
+		db: `Queries`
+		        The statements to query the database with.
 		case: `Case`
 		        The new case data; if something is not set in the new case, it will be set to the old case's data.
 		"""
-		await db.execute(
-			"UPDATE cases SET user_id = $1, reason = $2, expires = $3, message = $4 WHERE case_id = $5",
-			case._user.id,
-			case.reason,
-			case.expires,
-			case.message,
-			self.id,
-		)
+		await db.execute("cases.update", self.id, case._user.id, case.reason, case.expires, case.message)
 
 	def copy(self) -> Self:
 		"""Copy the case."""
@@ -622,6 +621,8 @@ class Ban(Case):
 @commands.guild_only()
 @app_commands.guild_only()
 class Moderation(commands.GroupCog, name="Moderation", group_name="mod"):
+	intents = discord.Intents(members=True)  # cases are only made for members, the guilds are chunked to check
+
 	def __init__(self, client: MyClient) -> None:
 		self.client = client
 		self.custom_response = custom_response.CustomResponse(client, "mod")
@@ -629,19 +630,24 @@ class Moderation(commands.GroupCog, name="Moderation", group_name="mod"):
 	async def case_removal(self):
 		await self.client.wait_until_ready()
 
-		case_rows = await self.client.db.fetch(
-			"SELECT * FROM cases WHERE expires IS NOT NULL AND expires <= $1",
-			datetime.datetime.now(),
-		)
+		if self.client.shard_ids is None:  # this process runs every shard
+			case_rows = await self.client.queries.fetch("cases.expired", datetime.datetime.now())
+		else:
+			case_rows = await self.client.queries.fetch(
+				"cases.expired_for_shards",
+				datetime.datetime.now(),
+				self.client.shard_count,
+				list(self.client.shard_ids),
+			)
+		# every shard chunks its guilds one at a time, the shards work through theirs side by side
+		guilds = {self.client.get_guild(row["guild_id"]) for row in case_rows} - {None}
+		await asyncio.gather(*(self.client.chunker.chunk(guild) for guild in guilds))
 		for row in case_rows:
 			case = Case.from_dict(row, self.client, get_type=True)
 
 			if not case._guild:
 				continue
 
-			if not case._guild.chunked:
-				await case._guild.chunk()
-
 			match case.type:
 				case CaseType.WARN:
 					case = Warn.from_dict(row, self.client)
@@ -651,7 +657,7 @@ class Moderation(commands.GroupCog, name="Moderation", group_name="mod"):
 					case = Kick.from_dict(row, self.client)
 				case CaseType.BAN:
 					case = Ban.from_dict(row, self.client)
-			await case.delete(self.client.db)
+			await case.delete(self.client.queries)
 
 	async def cog_load(self):
 		self.client.loop.create_task(self.case_removal())
@@ -711,7 +717,7 @@ class Moderation(commands.GroupCog, name="Moderation", group_name="mod"):
 			expires,
 			ctx.message.reference.resolved.content if ctx.message.reference else None,
 		)
-		await warn.create(self.client.db)
+		await warn.create(self.client.queries)
 
 		await ctx.send("mod.warn.response", warn=warn)
 
@@ -754,7 +760,7 @@ class Moderation(commands.GroupCog, name="Moderation", group_name="mod"):
 			reason,
 			ctx.message.reference.resolved.content if ctx.message.reference else None,
 		)
-		await mute.create(self.client.db)
+		await mute.create(self.client.queries)
 
 		await ctx.send("mod.mute.response", mute=mute)
 
@@ -772,7 +778,7 @@ class Moderation(commands.GroupCog, name="Moderation", group_name="mod"):
 	async def unmute(self, ctx: Context, user: discord.Member):
 		if user.timed_out_until:
 			cases = await Mute.from_db(
-				self.client.db,
+				self.client.queries,
 				self.client,
 				ctx.guild,
 				user=user,
@@ -780,7 +786,7 @@ class Moderation(commands.GroupCog, name="Moderation", group_name="mod"):
 			)
 			if cases:
 				for case in cases:
-					await case.delete(self.client.db)
+					await case.delete(self.client.queries)
 			else:
 				await user.edit(timed_out_until=None)
 		await user.edit(timed_out_until=None)
@@ -809,7 +815,7 @@ class Moderation(commands.GroupCog, name="Moderation", group_name="mod"):
 			reason,
 			ctx.message.reference.resolved.content if ctx.message.reference else None,
 		)
-		await kick.create(self.client.db)
+		await kick.create(self.client.queries)
 
 		await ctx.send("mod.kick.response", kick=kick)
 
@@ -854,7 +860,7 @@ class Moderation(commands.GroupCog, name="Moderation", group_name="mod"):
 			expires,
 			ctx.message.reference.resolved.content if ctx.message.reference else None,
 		)
-		await ban.create(self.client.db)
+		await ban.create(self.client.queries)
 
 		await ctx.send("mod.ban.response", ban=ban)
 
@@ -866,11 +872,11 @@ class Moderation(commands.GroupCog, name="Moderation", group_name="mod"):
 	@app_commands.checks.has_permissions(ban_members=True)
 	@commands.has_permissions(ban_members=True)
 	async def unban(self, ctx: Context, user: discord.User):
-		cases = await Ban.from_db(self.client.db, self.client, ctx.guild, user=user)
+		cases = await Ban.from_db(self.client.queries, self.client, ctx.guild, user=user)
 		if cases:
 			for case in cases:
 				case._custom_response = self.custom_response
-				await case.delete(self.client.db)
+				await case.delete(self.client.queries)
 		else:
 			try:
 				await ctx.guild.unban(user, reason=f"Ban removed by {ctx.author}")
@@ -915,6 +921,9 @@ class Moderation(commands.GroupCog, name="Moderation", group_name="mod"):
 @commands.guild_only()
 @app_commands.guild_only()
 class Cases(commands.Cog, name="Cases"):
+	intents = discord.Intents(members=True)  # like `Moderation`, deleting a case checks the member
+	chunk_guild = True  # the users of the cases are looked up in the cache
+
 	def __init__(self, client: MyClient) -> None:
 		self.client = client
 		self.custom_response = custom_response.CustomResponse(client, "mod")
@@ -933,7 +942,7 @@ class Cases(commands.Cog, name="Cases"):
 		except ValueError:
 			raise commands.BadArgument
 
-		case = await Case.from_id(self.client.db, self.client, ctx.guild, case_id, get_type=True)
+		case = await Case.from_id(self.client.queries, self.client, ctx.guild, case_id, get_type=True)
 		if not case:
 			await ctx.send("mod.info.errors.not_found", case_id=case_id)
 			return
@@ -964,22 +973,22 @@ class Cases(commands.Cog, name="Cases"):
 			case_id = int(case_id)
 		except ValueError:
 			raise commands.BadArgument("case_id")
-		case = await Case.from_id(self.client.db, self.client, ctx.guild, case_id, get_type=True)
+		case = await Case.from_id(self.client.queries, self.client, ctx.guild, case_id, get_type=True)
 		if not case:
 			await ctx.send("mod.delete.errors.not_found", case_id=case_id)
 			return
 
 		match case.type:
 			case CaseType.WARN:
-				case = await Warn.from_id(self.client.db, self.client, ctx.guild, case_id)
+				case = await Warn.from_id(self.client.queries, self.client, ctx.guild, case_id)
 			case CaseType.MUTE:
-				case = await Mute.from_id(self.client.db, self.client, ctx.guild, case_id)
+				case = await Mute.from_id(self.client.queries, self.client, ctx.guild, case_id)
 			case CaseType.KICK:
-				case = await Kick.from_id(self.client.db, self.client, ctx.guild, case_id)
+				case = await Kick.from_id(self.client.queries, self.client, ctx.guild, case_id)
 			case CaseType.BAN:
-				case = await Ban.from_id(self.client.db, self.client, ctx.guild, case_id)
+				case = await Ban.from_id(self.client.queries, self.client, ctx.guild, case_id)
 		case._custom_response = self.custom_response
-		await case.delete(self.client.db)
+		await case.delete(self.client.queries)
 
 		await ctx.send("mod.delete.response", case=case)
 
@@ -1021,7 +1030,7 @@ class Cases(commands.Cog, name="Cases"):
 			case_id = int(case_id)
 		except ValueError:
 			raise commands.BadArgument("case_id")
-		case: Case = await Case.from_id(self.client.db, self.client, ctx.guild, case_id, get_type=True)
+		case: Case = await Case.from_id(self.client.queries, self.client, ctx.guild, case_id, get_type=True)
 		if case is None:
 			await ctx.send("mod.edit.errors.not_found", case_id=case_id)
 			return
@@ -1035,7 +1044,7 @@ class Cases(commands.Cog, name="Cases"):
 
 		new_case = case.copy()
 		setattr(new_case, value, new_value)
-		await case.edit(self.client.db, new_case)
+		await case.edit(self.client.queries, new_case)
 
 		await ctx.send("mod.edit.response", case=case)
 
@@ -1049,7 +1058,7 @@ class Cases(commands.Cog, name="Cases"):
 	async def list(self, ctx: Context, user: discord.Member = None):
 		user = user or ctx.author
 
-		cases = await Case.from_user(self.client.db, user, self.client, ctx.guild, 10)
+		cases = await Case.from_user(self.client.queries, user, self.client, ctx.guild, 10)
 
 		# since we need the case's information but we don't want to duplicate db calls,
 		# we check inside the actual command
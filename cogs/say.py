@@ -2,15 +2,16 @@ import random
 from urllib.parse import quote_plus
 
 import discord
-from art import text2art
 from discord import app_commands
 from discord.ext import commands
 
 from core import Context, MyClient
-from helpers import CustomResponse
+from helpers import CustomResponse, LazyModule
 from helpers.convert import text_to_emoji
 from helpers.regex import DISCORD_MESSAGE_URL
 
+art = LazyModule("art")  # only used by the ascii command
+
 
 class Say(commands.Cog, name="Says"):
 	def __init__(self, client: MyClient):
@@ -64,7 +65,7 @@ class Say(commands.Cog, name="Says"):
 	@app_commands.rename(message="asciisay_specs-args-message-name")
 	@app_commands.describe(message="asciisay_specs-args-message-description")
 	async def ascii_say(self, ctx: Context, *, message: commands.Range[str, 1, 20]):
-		await ctx.send("say.ascii", ascii=text2art(message))
+		await ctx.send("say.ascii", ascii=art.text2art(message))
 
 	@say.command(name="emoji", description="emojisay_specs-description", usage="emojisay_specs-usage")
 	@commands.has_permissions(manage_messages=True)
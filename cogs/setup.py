@@ -20,12 +20,7 @@ class Setup(commands.Cog, name="Setup"):
 	async def prefix(self, ctx: Context, prefix: str, mention: Optional[bool] = True):
 		if len(prefix) > 10:
 			return await ctx.send("setup.prefix.errors.long", prefix=prefix, limit=10)
-		await self.client.db.execute(
-			"UPDATE guilds SET prefix = $1, mention = $2 WHERE guild_id = $3",
-			prefix,
-			mention,
-			ctx.guild.id,
-		)
+		await self.client.queries.execute("guilds.set_prefix", ctx.guild.id, prefix, mention)
 		return await ctx.send("setup.prefix.set", prefix=prefix)
 
 
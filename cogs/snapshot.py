@@ -1,97 +1,635 @@
 import asyncio
+import base64
 import datetime
+import hashlib
 import json
 import uuid
-from typing import Optional, Union
+from dataclasses import dataclass, field
+from logging import getLogger
+from typing import Any, Literal, Optional, Union
 from uuid import UUID
 
 import asyncpg
 import discord
 from discord import app_commands
-from discord.ext import commands
+from discord.ext import commands, tasks
+from discord.ext.localization import Localization
+
+from core import Context, DatabaseUnavailable, MyClient
+from helpers import CustomResponse
+
+logger = getLogger(__name__)
+
+SNAPSHOT_FORMAT_VERSION = 2
+"""Version 1 stored the payload JSON-encoded twice, version 2 stores deltas and keeps icons in ``snapshot_blobs``."""
+SNAPSHOT_MAX_DEPTH = 10
+"""The maximum number of deltas between a snapshot and the full snapshot it is based on."""
+_SECTIONS = ("roles", "channels")
+SNAPSHOT_INTERVALS = {"hourly": 3600, "daily": 86400, "weekly": 604800}
+"""The intervals of scheduled snapshots, in seconds."""
+SCHEDULER_BATCH_SIZE = 200
+"""The maximum number of scheduled snapshots handled per minute."""
+SCHEDULER_CONCURRENCY = 4
+"""The maximum number of guilds captured at the same time by the scheduler."""
+RETENTION_BATCH_SIZE = 500
+ASSET_FETCH_CONCURRENCY = 8
+"""The maximum number of role icons downloaded at the same time while capturing a guild."""
+_NO_TEXT_SETTINGS = (discord.ChannelType.voice, discord.ChannelType.category, discord.ChannelType.stage_voice)
+
+
+def _capture_role(role: discord.Role, icon_hash: Optional[str]) -> dict:
+	return {
+		"perms": role.permissions.value,
+		"color": role.color.value,
+		"hoist": role.hoist,
+		"managable": role.managed,
+		"position": role.position,
+		"name": role.name,
+		# unicode emoji icons are stored as is, uploaded icons are stored once in `assets` and referenced by hash
+		"display_icon": role.display_icon if isinstance(role.display_icon, str) else None,
+		"icon_asset": icon_hash,
+	}
+
+
+def _capture_channel(channel: discord.abc.GuildChannel) -> dict:
+	channel_type = channel.type
+	return {
+		"position": channel.position,
+		"type": str(channel_type),
+		"category": channel.category.name if channel.category else None,
+		"name": channel.name,
+		"bitrate": channel.bitrate if channel_type == discord.ChannelType.voice else None,  # type: ignore
+		"slowmode": channel.slowmode_delay if channel_type not in _NO_TEXT_SETTINGS else None,  # type: ignore
+		"nsfw": channel.is_nsfw() if channel_type not in _NO_TEXT_SETTINGS else None,  # type: ignore
+		"user_limit": channel.user_limit if channel_type == discord.ChannelType.voice else None,  # type: ignore
+		"topic": channel.topic  # type: ignore
+		if channel_type not in (discord.ChannelType.voice, discord.ChannelType.category)
+		else None,
+		"permission_sync": channel.permissions_synced if channel_type != discord.ChannelType.category else None,
+		"default_auto_archive_duration": channel.default_auto_archive_duration  # type: ignore
+		if channel_type in (discord.ChannelType.text, discord.ChannelType.forum)
+		else 0,
+		"rtc_region": channel.rtc_region if channel_type == discord.ChannelType.voice else None,  # type: ignore
+		"overwrites": {
+			str(target.id): {
+				"allow": overwrite.pair()[0].value,
+				"deny": overwrite.pair()[1].value,
+				"role": target.name,
+			}
+			for target, overwrite in channel.overwrites.items()
+		},
+	}
+
+
+async def capture_guild(guild: discord.Guild, *, concurrency: int = ASSET_FETCH_CONCURRENCY) -> dict:
+	"""
+	Captures the roles and channels of a guild.
+
+	Role icons are downloaded concurrently and every distinct image is stored once in ``assets``, keyed by the
+	SHA-256 of its content, so roles sharing an icon don't duplicate it in the payload.
+
+	Parameters
+	----------
+	guild: `discord.Guild`
+	        The guild to capture.
+	concurrency: `int`
+	        The maximum number of icons downloaded at the same time.
+
+	Returns
+	-------
+	`dict`
+	        The payload of the snapshot.
+	"""
+	semaphore = asyncio.Semaphore(concurrency)
+	downloads: dict[str, asyncio.Task[bytes]] = {}  # asset key -> download, so an icon is only fetched once
+
+	async def download(asset: discord.Asset) -> bytes:
+		async with semaphore:
+			return await asset.read()
+
+	for role in guild.roles:
+		if isinstance(role.display_icon, discord.Asset) and role.display_icon.key not in downloads:
+			downloads[role.display_icon.key] = asyncio.create_task(download(role.display_icon))
+
+	assets: dict[str, bytes] = {}
+	hashes: dict[str, str] = {}  # asset key -> content hash
+	if downloads:
+		results = await asyncio.gather(*downloads.values(), return_exceptions=True)
+		for key, result in zip(downloads, results):
+			if isinstance(result, BaseException):
+				continue  # the icon is skipped, the role itself is still captured
+			content_hash = hashlib.sha256(result).hexdigest()
+			hashes[key] = content_hash
+			assets.setdefault(content_hash, result)
+
+	return {
+		"roles": {
+			str(role.id): _capture_role(
+				role, hashes.get(role.display_icon.key) if isinstance(role.display_icon, discord.Asset) else None
+			)
+			for role in guild.roles
+		},
+		"channels": {str(channel.id): _capture_channel(channel) for channel in guild.channels},
+		"assets": assets,
+	}
+
+
+def structure_hash(guild: discord.Guild) -> str:
+	"""
+	Hashes the roles and channels of a guild from the cache, without downloading anything.
+
+	Uploaded role icons are represented by their asset key, which changes whenever the icon does.
+
+	Parameters
+	----------
+	guild: `discord.Guild`
+	        The guild to hash.
+
+	Returns
+	-------
+	`str`
+	        The SHA-256 of the guild's structure.
+	"""
+	structure = {
+		"roles": {
+			str(role.id): _capture_role(
+				role, role.display_icon.key if isinstance(role.display_icon, discord.Asset) else None
+			)
+			for role in guild.roles
+		},
+		"channels": {str(channel.id): _capture_channel(channel) for channel in guild.channels},
+	}
+	return hashlib.sha256(json.dumps(structure, sort_keys=True).encode()).hexdigest()
+
+
+def _next_run(guild_id: int, interval: str, now: datetime.datetime) -> datetime.datetime:
+	"""Returns the next run of a schedule. Every guild gets a fixed offset in the interval, so runs are spread out."""
+	seconds = SNAPSHOT_INTERVALS[interval]
+	offset = (guild_id >> 22) % seconds  # the creation time of the guild is as good as random here
+	elapsed = (now.timestamp() - offset) % seconds
+	return now + datetime.timedelta(seconds=seconds - elapsed)
+
+
+def _delta(base: dict, payload: dict) -> dict:
+	"""Returns the roles and channels that were added, changed or removed between two payloads."""
+	return {
+		section: {
+			"set": {key: entry for key, entry in payload[section].items() if base[section].get(key) != entry},
+			"unset": [key for key in base[section] if key not in payload[section]],
+		}
+		for section in _SECTIONS
+	} | {"delta": True}
+
+
+def _apply_delta(base: dict, delta: dict) -> dict:
+	if not delta.get("delta"):
+		return delta
+	payload = base | {section: dict(base[section]) for section in _SECTIONS}
+	for section in _SECTIONS:
+		for key in delta[section]["unset"]:
+			payload[section].pop(key, None)
+		payload[section].update(delta[section]["set"])
+	return payload
+
+
+RESTORE_CONCURRENCY = 5
+"""The maximum number of restore requests in flight. discord.py queues requests sharing a rate limit bucket itself."""
+_CHANNEL_TYPES = {
+	"text": discord.ChannelType.text,
+	"news": discord.ChannelType.news,
+	"voice": discord.ChannelType.voice,
+	"stage_voice": discord.ChannelType.stage_voice,
+	"category": discord.ChannelType.category,
+	"forum": discord.ChannelType.forum,
+}
+
+
+@dataclass(slots=True)
+class RestoreStep:
+	"""A single change of a `RestorePlan`."""
+
+	action: Literal["create", "update", "delete"]
+	kind: Literal["role", "category", "channel"]
+	name: str
+	key: Optional[str] = None
+	"""The ID of the role or channel in the snapshot. ``None`` for deletions."""
+	target: Optional[Union[discord.Role, discord.abc.GuildChannel]] = None
+	"""The live role or channel. ``None`` for creations."""
+	changes: list[str] = field(default_factory=list)
+	"""The names of the changed attributes, for updates."""
+
+	@property
+	def fields(self) -> str:
+		return ", ".join(self.changes)
+
+
+@dataclass(slots=True)
+class RestorePlan:
+	"""The changes needed to bring a guild to the state of a snapshot."""
+
+	payload: dict
+	roles: dict[str, discord.Role]
+	"""Snapshot role IDs mapped to the live roles they were matched with."""
+	channels: dict[str, discord.abc.GuildChannel]
+	"""Snapshot channel IDs mapped to the live channels they were matched with."""
+	steps: list[RestoreStep] = field(default_factory=list)
+	reorder_roles: bool = False
+	reorder_channels: bool = False
+
+	def __len__(self) -> int:
+		return len(self.steps) + self.reorder_roles + self.reorder_channels
+
+	def count(self, action: str) -> int:
+		return sum(step.action == action for step in self.steps)
+
+
+def _is_editable(role: discord.Role) -> bool:
+	return not role.managed and not role.is_default() and role < role.guild.me.top_role
+
+
+def _role_options(entry: dict, guild: discord.Guild, assets: dict[str, bytes]) -> dict[str, Any]:
+	options: dict[str, Any] = {
+		"name": entry["name"],
+		"permissions": discord.Permissions(int(entry["perms"])),
+		"colour": discord.Colour(int(entry["color"] or 0)),
+		"hoist": bool(entry["hoist"]),
+	}
+	if "ROLE_ICONS" in guild.features:
+		if entry.get("icon_asset") and entry["icon_asset"] in assets:
+			options["display_icon"] = assets[entry["icon_asset"]]
+		elif entry.get("display_icon"):
+			options["display_icon"] = entry["display_icon"]
+	return options
+
+
+def _role_changes(role: discord.Role, entry: dict) -> list[str]:
+	changes = []
+	if role.name != entry["name"]:
+		changes.append("name")
+	if role.permissions.value != int(entry["perms"]):
+		changes.append("permissions")
+	if role.colour.value != int(entry["color"] or 0):
+		changes.append("colour")
+	if role.hoist != bool(entry["hoist"]):
+		changes.append("hoist")
+	# uploaded icons can't be compared without downloading them, only a missing or changed emoji counts
+	live_icon = role.display_icon if isinstance(role.display_icon, str) else bool(role.display_icon)
+	snapshot_icon = entry.get("display_icon") or bool(entry.get("icon_asset"))
+	if live_icon != snapshot_icon:
+		changes.append("display_icon")
+	return changes
+
+
+def _channel_options(entry: dict, channel_type: discord.ChannelType) -> dict[str, Any]:
+	options: dict[str, Any] = {"name": entry["name"]}
+	if channel_type in (discord.ChannelType.text, discord.ChannelType.news, discord.ChannelType.forum):
+		options["topic"] = entry["topic"] or None
+		options["nsfw"] = bool(entry["nsfw"])
+		if entry["default_auto_archive_duration"]:
+			options["default_auto_archive_duration"] = entry["default_auto_archive_duration"]
+		options["slowmode_delay"] = int(entry["slowmode"] or 0)
+	elif channel_type == discord.ChannelType.voice:
+		if entry["bitrate"]:
+			options["bitrate"] = int(entry["bitrate"])
+		options["user_limit"] = int(entry["user_limit"] or 0)
+		options["rtc_region"] = entry["rtc_region"]
+	return options
+
+
+def _channel_changes(channel: Any, entry: dict, channel_type: discord.ChannelType) -> list[str]:
+	changes = []
+	for option, value in _channel_options(entry, channel_type).items():
+		if getattr(channel, option, None) != value:
+			changes.append(option)
+	if (channel.category.name if channel.category else None) != entry["category"]:
+		changes.append("category")
+	return changes
+
+
+def _overwrites(
+	entry: dict, guild: discord.Guild, roles: dict[str, discord.Role]
+) -> dict[Union[discord.Role, discord.Member], discord.PermissionOverwrite]:
+	overwrites = {}
+	for key, overwrite in entry["overwrites"].items():
+		target = roles.get(key) or guild.get_member(int(key))
+		if target is None:
+			continue
+		overwrites[target] = discord.PermissionOverwrite.from_pair(
+			discord.Permissions(overwrite["allow"]), discord.Permissions(overwrite["deny"])
+		)
+	return overwrites
+
+
+def plan_restore(guild: discord.Guild, payload: dict) -> RestorePlan:
+	"""
+	Diffs a snapshot against the current state of a guild.
+
+	Roles and channels are matched by ID first, then by name (and type for channels). Everything the bot can't
+	manage, like managed roles or roles above its own, is left untouched.
+
+	Parameters
+	----------
+	guild: `discord.Guild`
+	        The guild to restore.
+	payload: `dict`
+	        The payload of the snapshot.
+
+	Returns
+	-------
+	`RestorePlan`
+	        The changes needed to restore the snapshot.
+	"""
+	plan = RestorePlan(payload=payload, roles={}, channels={})
+	snapshot_roles: dict[str, dict] = payload["roles"]
+	snapshot_channels: dict[str, dict] = payload["channels"]
+
+	unmatched_roles = {role.id: role for role in guild.roles}
+	roles_by_name: dict[str, list[discord.Role]] = {}
+	for role in guild.roles:
+		roles_by_name.setdefault(role.name, []).append(role)
+
+	for key, entry in snapshot_roles.items():
+		if entry["name"] == "@everyone":
+			plan.roles[key] = guild.default_role
+			unmatched_roles.pop(guild.default_role.id, None)
+			if guild.default_role.permissions.value != int(entry["perms"]):
+				plan.steps.append(RestoreStep("update", "role", "@everyone", key, guild.default_role, ["permissions"]))
+			continue
+		if entry["managable"]:  # integration roles come back with their bot
+			continue
+		role = unmatched_roles.get(int(key)) or next(
+			(role for role in roles_by_name.get(entry["name"], ()) if role.id in unmatched_roles), None
+		)
+		if role is None:
+			plan.steps.append(RestoreStep("create", "role", entry["name"], key))
+			continue
+		del unmatched_roles[role.id]
+		plan.roles[key] = role
+		if _is_editable(role) and (changes := _role_changes(role, entry)):
+			plan.steps.append(RestoreStep("update", "role", role.name, key, role, changes))
+
+	for role in unmatched_roles.values():
+		if _is_editable(role):
+			plan.steps.append(RestoreStep("delete", "role", role.name, target=role))
+
+	# their overwrites can only be compared once they exist, so the channels that have some are restored anyway
+	created_roles = {step.key for step in plan.steps if step.kind == "role" and step.action == "create"}
+
+	unmatched_channels = {channel.id: channel for channel in guild.channels}
+	channels_by_name: dict[tuple[str, str], list[discord.abc.GuildChannel]] = {}
+	for channel in guild.channels:
+		channels_by_name.setdefault((str(channel.type), channel.name), []).append(channel)
+
+	# categories first, channels are created inside them
+	for key, entry in sorted(snapshot_channels.items(), key=lambda item: item[1]["type"] != "category"):
+		channel_type = _CHANNEL_TYPES.get(entry["type"])
+		if channel_type is None:
+			continue
+		kind = "category" if channel_type == discord.ChannelType.category else "channel"
+		channel = unmatched_channels.get(int(key))
+		if channel is None or str(channel.type) != entry["type"]:
+			channel = next(
+				(
+					channel
+					for channel in channels_by_name.get((entry["type"], entry["name"]), ())
+					if channel.id in unmatched_channels
+				),
+				None,
+			)
+		if channel is None:
+			plan.steps.append(RestoreStep("create", kind, entry["name"], key))
+			continue
+		del unmatched_channels[channel.id]
+		plan.channels[key] = channel
+		changes = _channel_changes(channel, entry, channel_type) if kind == "channel" else []
+		if channel.name != entry["name"] and kind == "category":
+			changes.append("name")
+		overwrites = _overwrites(entry, guild, plan.roles)
+		if overwrites != channel.overwrites or not created_roles.isdisjoint(entry["overwrites"]):
+			changes.append("overwrites")
+		if changes:
+			plan.steps.append(RestoreStep("update", kind, channel.name, key, channel, changes))
+
+	for channel in unmatched_channels.values():
+		kind = "category" if isinstance(channel, discord.CategoryChannel) else "channel"
+		plan.steps.append(RestoreStep("delete", kind, channel.name, target=channel))
+
+	plan.reorder_roles = any(step.kind == "role" and step.action == "create" for step in plan.steps) or any(
+		int(snapshot_roles[key]["position"]) != role.position for key, role in plan.roles.items() if _is_editable(role)
+	)
+	plan.reorder_channels = any(step.kind != "role" and step.action != "update" for step in plan.steps) or any(
+		int(snapshot_channels[key]["position"]) != channel.position for key, channel in plan.channels.items()
+	)
+	return plan
+
+
+class RestoreExecutor:
+	def __init__(self, guild: discord.Guild, plan: RestorePlan, reason: str, concurrency: int = RESTORE_CONCURRENCY):
+		"""Applies a `RestorePlan` to a guild.
 
-from core import Context, MyClient
+		Steps run concurrently in dependency order: roles, then categories, then channels. discord.py waits on the
+		rate limit headers of every bucket, so there are no fixed sleeps and requests hitting different buckets
+		(like edits of different channels) don't wait on each other.
+
+		Parameters
+		----------
+		guild: `discord.Guild`
+			The guild to restore.
+		plan: `RestorePlan`
+			The plan to apply.
+		reason: `str`
+			The audit log reason of every change.
+		concurrency: `int`
+			The maximum number of requests in flight.
+		"""
+		self.guild = guild
+		self.plan = plan
+		self.reason = reason
+		self.semaphore = asyncio.Semaphore(concurrency)
+		self.failed: list[RestoreStep] = []
+
+	async def run(self) -> list[RestoreStep]:
+		"""Applies the plan and returns the steps that failed."""
+		steps = self.plan.steps
+		await self._run_all([step for step in steps if step.kind == "role"])
+		if self.plan.reorder_roles:
+			await self._guarded(self._reorder_roles(), "reorder the roles")
+		await self._run_all([step for step in steps if step.kind == "category"])
+		await self._run_all([step for step in steps if step.kind == "channel"])
+		if self.plan.reorder_channels:
+			await self._guarded(self._reorder_channels(), "reorder the channels")
+		return self.failed
+
+	async def _run_all(self, steps: list[RestoreStep]) -> None:
+		async def run(step: RestoreStep) -> None:
+			if not await self._guarded(self._apply(step), f"{step.action} {step.kind} {step.name!r}"):
+				self.failed.append(step)
+
+		await asyncio.gather(*(run(step) for step in steps))
+
+	async def _guarded(self, coro: Any, description: str) -> bool:
+		async with self.semaphore:
+			try:
+				await coro
+			except (discord.Forbidden, discord.NotFound, discord.HTTPException) as error:
+				logger.warning(f"Restore of guild {self.guild.id} failed to {description}: {error}")
+				return False
+		return True
+
+	async def _apply(self, step: RestoreStep) -> None:
+		if step.action == "delete":
+			await step.target.delete(reason=self.reason)  # type: ignore
+			return
+
+		entry = self.plan.payload["roles" if step.kind == "role" else "channels"][step.key]
+		if step.kind == "role":
+			if step.target and step.target.is_default():  # type: ignore
+				permissions = discord.Permissions(int(entry["perms"]))
+				await step.target.edit(permissions=permissions, reason=self.reason)  # type: ignore
+				return
+			options = _role_options(entry, self.guild, self.plan.payload.get("assets", {}))
+			if step.action == "create":
+				self.plan.roles[step.key] = await self.guild.create_role(**options, reason=self.reason)  # type: ignore
+			else:
+				await step.target.edit(**options, reason=self.reason)  # type: ignore
+			return
+
+		channel_type = _CHANNEL_TYPES[entry["type"]]
+		options = _channel_options(entry, channel_type)
+		options["overwrites"] = _overwrites(entry, self.guild, self.plan.roles)
+		if channel_type != discord.ChannelType.category:
+			options["category"] = self._category(entry["category"])
+		if step.action == "update":
+			await step.target.edit(**options, reason=self.reason)  # type: ignore
+			return
+
+		if channel_type in (discord.ChannelType.text, discord.ChannelType.news):
+			channel = await self.guild.create_text_channel(
+				**options, news=channel_type == discord.ChannelType.news, reason=self.reason
+			)
+		elif channel_type == discord.ChannelType.voice:
+			channel = await self.guild.create_voice_channel(**options, reason=self.reason)
+		elif channel_type == discord.ChannelType.stage_voice:
+			channel = await self.guild.create_stage_channel(**options, reason=self.reason)
+		elif channel_type == discord.ChannelType.category:
+			channel = await self.guild.create_category(**options, reason=self.reason)
+		else:
+			channel = await self.guild.create_forum(**options, reason=self.reason)
+		self.plan.channels[step.key] = channel
+
+	def _category(self, name: Optional[str]) -> Optional[discord.CategoryChannel]:
+		if name is None:
+			return None
+		for key, channel in self.plan.channels.items():
+			if isinstance(channel, discord.CategoryChannel) and self.plan.payload["channels"][key]["name"] == name:
+				return channel
+		return None
+
+	async def _reorder_roles(self) -> None:
+		roles = self.plan.payload["roles"]
+		editable = [(key, role) for key, role in self.plan.roles.items() if _is_editable(role)]
+		# hand the positions the roles already hold out again in the snapshot's order
+		ordered = sorted(editable, key=lambda item: int(roles[item[0]]["position"]))
+		slots = sorted(role.position for _, role in editable)
+		positions = {role: position for (_, role), position in zip(ordered, slots) if role.position != position}
+		if positions:
+			await self.guild.edit_role_positions(positions, reason=self.reason)  # type: ignore
+
+	async def _reorder_channels(self) -> None:
+		channels = self.plan.payload["channels"]
+		payload: list[Any] = [
+			{"id": channel.id, "position": int(channels[key]["position"])}
+			for key, channel in self.plan.channels.items()
+			if channel.position != int(channels[key]["position"])
+		]
+		if payload:
+			await self.guild._state.http.bulk_channel_update(self.guild.id, payload, reason=self.reason)
 
 
 class Snapshot(commands.Cog, name="Snapshots"):
+	deadline = 600.0  # restoring recreates the channels and roles one request at a time
+	intents = discord.Intents(members=True)  # restores the overwrites of the members
+
 	def __init__(self, client: MyClient):
 		self.client = client
-		self.connection: asyncpg.Pool = client.db
+		self.queries = client.queries
 		self.custom_response = client.custom_response
 
-	@staticmethod
-	async def save(ctx: Context) -> dict:
-		"""
-		Creates a snapshot of the server.
+	async def cog_load(self) -> None:
+		# retried with a backoff instead of stopping the loops while the database is down
+		self.scheduler.add_exception_type(DatabaseUnavailable)
+		self.prune_snapshots.add_exception_type(DatabaseUnavailable)
+		self.scheduler.start()
+		if self.client.is_primary_cluster:  # the retention is the same for every guild, one process prunes them all
+			self.prune_snapshots.start()
+
+	async def cog_unload(self) -> None:
+		self.scheduler.cancel()
+		self.prune_snapshots.cancel()
+
+	@tasks.loop(minutes=1)
+	async def scheduler(self):
+		if self.client.shard_ids is None:  # this process runs every shard
+			rows = await self.queries.fetch("snapshot_schedules.due", SCHEDULER_BATCH_SIZE)
+		else:
+			rows = await self.queries.fetch(
+				"snapshot_schedules.due_for_shards",
+				self.client.shard_count,
+				list(self.client.shard_ids),
+				SCHEDULER_BATCH_SIZE,
+			)
+		semaphore = asyncio.Semaphore(SCHEDULER_CONCURRENCY)
+
+		async def run(row: asyncpg.Record) -> None:
+			async with semaphore:
+				try:
+					await self.run_schedule(row["guild_id"], row["interval"], row["structure_hash"])
+				except Exception:
+					logger.exception(f"Scheduled snapshot of guild {row['guild_id']} failed")
+					await self.queries.execute(
+						"snapshot_schedules.reschedule",
+						row["guild_id"],
+						_next_run(row["guild_id"], row["interval"], discord.utils.utcnow()),
+					)
 
-		Parameters
-		----------
-		ctx: `Context`
-		        The context to get the guild data from.
+		await asyncio.gather(*(run(row) for row in rows))
+
+	@scheduler.before_loop
+	async def before_scheduler(self):
+		await self.client.wait_until_ready()
+
+	async def run_schedule(self, guild_id: int, interval: str, last_hash: Optional[str]) -> None:
+		"""Takes a scheduled snapshot of a guild, unless nothing changed since the last one."""
+		now = discord.utils.utcnow()
+		guild = self.client.get_guild(guild_id)
+		current_hash = structure_hash(guild) if guild else last_hash
+		if guild and current_hash != last_hash:
+			await self.store_snapshot(
+				guild.id,
+				await self.custom_response("snapshot.strings.automatic_snapshot", guild),
+				self.client.user.id,
+				await capture_guild(guild),
+				automatic=True,
+			)
+		await self.queries.execute(
+			"snapshot_schedules.complete",
+			guild_id,
+			_next_run(guild_id, interval, now),
+			current_hash,
+		)
 
-		Returns
-		-------
-		`dict`
-		        The payload of the snapshot.
+	@tasks.loop(hours=1)
+	async def prune_snapshots(self):
 		"""
+		Deletes automatic snapshots outside of the retention tiers: every snapshot of the last day, the latest one of
+		each day of the last week and the latest one of each week of the last 8 weeks.
 
-		payload = {"roles": {}, "channels": {}}
-
-		for x in ctx.guild.roles:
-			payload["roles"][x.id] = {
-				"perms": x.permissions.value,
-				"color": x.color.value,
-				"hoist": x.hoist,
-				"managable": x.managed,
-				"position": x.position,
-				"name": x.name,
-				"display_icon": (await x.display_icon.read()).decode("latin1")
-				if x.display_icon and x.display_icon is discord.Asset
-				else x.display_icon
-				if x.display_icon
-				else None,
-			}
-
-		for x in ctx.guild.channels:
-			payload["channels"][x.id] = {
-				"position": x.position,
-				"type": str(x.type),
-				"category": x.category.name if x.category else None,
-				"name": x.name,
-				"bitrate": x.bitrate if x.type == [discord.ChannelType.voice] else None,
-				"slowmode": x.slowmode_delay
-				if x.type
-				not in [
-					discord.ChannelType.voice,
-					discord.ChannelType.category,
-					discord.ChannelType.stage_voice,
-				]
-				else None,
-				"nsfw": x.is_nsfw()
-				if x.type
-				not in [
-					discord.ChannelType.voice,
-					discord.ChannelType.category,
-					discord.ChannelType.stage_voice,
-				]
-				else None,
-				"user_limit": x.user_limit if x.type in [discord.ChannelType.voice] else None,
-				"topic": x.topic if x.type not in [discord.ChannelType.voice, discord.ChannelType.category] else None,
-				"permission_sync": x.permissions_synced if x.type not in [discord.ChannelType.category] else None,
-				"default_auto_archive_duration": x.default_auto_archive_duration
-				if x.type in [discord.ChannelType.text, discord.ChannelType.forum]
-				else 0,
-				"rtc_region": x.rtc_region if x.type in [discord.ChannelType.voice] else None,
-			}
-			payload["channels"][x.id]["overwrites"] = {}
-			for y in x.overwrites:
-				payload["channels"][x.id]["overwrites"][y.id] = {
-					"allow": x.overwrites[y].pair()[0].value,
-					"deny": x.overwrites[y].pair()[1].value,
-					"role": y.name,
-				}
-
-		return payload
+		Snapshots other snapshots are based on are kept with them, and manual snapshots are never deleted.
+		"""
+		while True:
+			status = await self.queries.execute("snapshots.prune", RETENTION_BATCH_SIZE)
+			if int(status.split()[-1]) < RETENTION_BATCH_SIZE:
+				break
 
 	async def create_snapshot(self, ctx: Context) -> Optional[UUID]:
 		"""
@@ -107,25 +645,84 @@ class Snapshot(commands.Cog, name="Snapshots"):
 		`UUID`
 		        Code (`UUID`) if the snapshot was successful.
 		"""
-		payload = await self.save(ctx)
+		payload = await capture_guild(ctx.guild)
+		return await self.store_snapshot(
+			ctx.guild.id, await self.custom_response("snapshot.strings.server_snapshot", ctx), ctx.author.id, payload
+		)
 
-		code = uuid.uuid4()
-		row = await self.connection.fetchrow("SELECT * FROM snapshots WHERE code = $1", str(code))
-		while row:  # if the code already exists
+	async def store_snapshot(
+		self, guild_id: int, name: str, author_id: int, payload: dict, *, automatic: bool = False
+	) -> UUID:
+		"""
+		Stores a captured payload.
+
+		Icons go to ``snapshot_blobs`` once per content hash. The rest is stored as a delta against the guild's
+		latest snapshot, unless that one is already `SNAPSHOT_MAX_DEPTH` deltas away from a full snapshot.
+
+		Parameters
+		----------
+		guild_id: `int`
+		        The ID of the captured guild.
+		name: `str`
+		        The name of the snapshot.
+		author_id: `int`
+		        The ID of the user who created the snapshot.
+		payload: `dict`
+		        The payload returned by `capture_guild`.
+		automatic: `bool`
+		        Whether the snapshot was taken by the scheduler. Only automatic snapshots are pruned.
+
+		Returns
+		-------
+		`UUID`
+		        The code of the snapshot.
+		"""
+		assets: dict[str, bytes] = payload.pop("assets", {})
+		if assets:
+			await self.queries.executemany("snapshot_blobs.insert", assets.items())
+
+		stored, base_code, depth = payload, None, 0
+		base = await self.queries.fetchrow("snapshots.latest", guild_id)
+		if base and base["depth"] < SNAPSHOT_MAX_DEPTH:
+			base_payload = await self._load_payload(base["code"])
+			if base_payload is not None:
+				stored, base_code, depth = _delta(base_payload, payload), base["code"], base["depth"] + 1
+		# large guilds produce payloads of several megabytes, don't block the event loop while encoding them
+		encoded = await asyncio.to_thread(json.dumps, stored)
+
+		while True:
 			code = uuid.uuid4()
-			row = await self.connection.fetchrow("SELECT * FROM snapshots WHERE code = $1", str(code))
+			try:
+				await self.queries.execute(
+					"snapshots.insert",
+					guild_id,
+					name,
+					encoded,
+					author_id,
+					discord.utils.utcnow().replace(tzinfo=None),  # the column has no time zone, it holds UTC
+					str(code),
+					SNAPSHOT_FORMAT_VERSION,
+					base_code,
+					depth,
+					automatic,
+				)
+			except asyncpg.UniqueViolationError:  # the code is already taken
+				continue
+			return code
 
-		await self.connection.execute(
-			"INSERT INTO snapshots(guild_id, name, payload, author_id, date, code) VALUES($1, $2, $3, $4, $5, $6)",
-			ctx.guild.id,
-			await self.custom_response("snapshot.strings.server_snapshot", ctx),
-			json.dumps(payload),
-			ctx.author.id,
-			datetime.datetime.now(),
-			str(code),
-		)
+	async def _load_payload(self, code: Union[str, UUID]) -> Optional[dict]:
+		"""Reconstructs a payload from its chain of deltas, without the icons."""
+		chain = await self.queries.fetch("snapshots.chain", str(code))
+		if not chain:
+			return None
 
-		return code
+		payload = None
+		for row in chain:
+			stored = row["payload"]
+			if isinstance(stored, str):  # version 1 snapshots were JSON-encoded twice
+				stored = json.loads(stored)
+			payload = stored if payload is None else _apply_delta(payload, stored)
+		return payload
 
 	async def get_snapshot(self, code: Union[str, UUID]) -> Optional[dict]:
 		"""
@@ -139,192 +736,49 @@ class Snapshot(commands.Cog, name="Snapshots"):
 		Returns
 		-------
 		`dict`
-		        The snapshot's payload.
+		        The snapshot's payload, with its icons in ``assets``.
 		"""
-		payload = await self.connection.fetchval("SELECT payload FROM snapshots WHERE code = $1", code)
-		if payload:
-			return json.loads(payload)
-		else:
+		payload = await self._load_payload(code)
+		if payload is None:
 			return None
 
-	async def delete_all_channels(self, ctx: Context):
-		"""
-		Deletes all channels in the server.
-
-		Parameters
-		----------
-		ctx: `Context`
-		        The context to get the guild data from.
-		"""
-		for x in ctx.guild.channels:
-			try:
-				await x.delete(reason=await self.custom_response("snapshot.strings.save_load_reason", ctx))
-			except (discord.Forbidden, discord.NotFound, discord.HTTPException):
-				continue
-			await asyncio.sleep(0.5)
-
-	async def delete_all_roles(self, ctx: Context):
-		"""
-		Deletes all roles in the server.
+		assets = {key: base64.b64decode(value) for key, value in payload.pop("assets", {}).items()}
+		hashes = {role["icon_asset"] for role in payload["roles"].values() if role.get("icon_asset")} - assets.keys()
+		if hashes:
+			for row in await self.queries.fetch("snapshot_blobs.get", list(hashes)):
+				assets[row["hash"]] = row["data"]
+		payload["assets"] = assets
+		return payload
 
-		Parameters
-		----------
-		ctx: `Context`
-		        The context to get the guild data from.
-		"""
-		for x in ctx.guild.roles:
-			try:
-				await x.delete(reason=await self.custom_response("snapshot.strings.save_load_reason", ctx))
-			except (discord.Forbidden, discord.NotFound, discord.HTTPException):
-				continue
-			await asyncio.sleep(0.5)
-
-	async def load_snapshot(self, ctx: Context, payload: dict):
-		for x in sorted(
-			payload["roles"],
-			key=lambda r: payload["roles"][r]["position"],
-			reverse=True,
-		):
-			perms = discord.Permissions(permissions=int(payload["roles"][x]["perms"]))
-			if payload["roles"][x]["color"]:
-				color = discord.Colour(int(payload["roles"][x]["color"]))
-			else:
-				color = None
-			if not payload["roles"][x]["name"] == "@everyone":
-				try:
-					dicon = (
-						payload["roles"][x]["display_icon"].encode("latin1")
-						if payload["roles"][x]["display_icon"]
-						else None
-					)
-				except (AttributeError, TypeError):
-					dicon = payload["roles"][x]["display_icon"] if payload["roles"][x]["display_icon"] else None
-				role = await ctx.guild.create_role(
-					name=payload["roles"][x]["name"],
-					permissions=perms,
-					colour=color,
-					hoist=bool(payload["roles"][x]["hoist"]),
-					reason=await self.custom_response("snapshot.strings.save_load_reason", ctx),
-					display_icon=dicon if "ROLE_ICONS" in ctx.guild.features else None,
-				)
-				await asyncio.sleep(0.5)
-		for y in sorted(payload["channels"], key=lambda x: payload["channels"][x]["type"]):
-			x = payload["channels"][y]
-			if x["type"] == "text" or x["type"] == "news":
-				try:
-					cat = discord.utils.get(ctx.guild.categories, name=x["category"])
-					overwrites = {}
-					for z in x["overwrites"]:
-						role = discord.utils.get(ctx.guild.roles, name=x["overwrites"][z]["role"])
-						if role:
-							overwrites[role] = discord.PermissionOverwrite.from_pair(
-								discord.Permissions(x["overwrites"][z]["allow"]),
-								discord.Permissions(x["overwrites"][z]["deny"]),
-							)
-					await ctx.guild.create_text_channel(
-						name=x["name"],
-						category=cat if cat else None,
-						position=int(x["position"]),
-						reason=await self.custom_response("snapshot.strings.save_load_reason", ctx),
-						slowmode_delay=int(x["slowmode"]) if x["slowmode"] else None,
-						topic=x["topic"] if x["topic"] else None,
-						nsfw=bool(x["nsfw"]),
-						overwrites=overwrites,
-						news=x["type"] == "news",
-						default_auto_archive_duration=x["default_auto_archive_duration"],
-					)
-					await asyncio.sleep(0.5)
-				except (discord.Forbidden, discord.HTTPException):
-					continue
-			elif x["type"] == "voice":
-				try:
-					cat = discord.utils.get(ctx.guild.categories, name=x["category"])
-					overwrites = {}
-					for z in x["overwrites"]:
-						role = discord.utils.get(ctx.guild.roles, name=x["overwrites"][z]["role"])
-						if role:
-							overwrites[role] = discord.PermissionOverwrite.from_pair(
-								discord.Permissions(x["overwrites"][z]["allow"]),
-								discord.Permissions(x["overwrites"][z]["deny"]),
-							)
-					await ctx.guild.create_voice_channel(
-						name=x["name"],
-						category=cat if cat else None,
-						position=int(x["position"]),
-						reason=await self.custom_response("snapshot.strings.save_load_reason", ctx),
-						bitrate=int(x["bitrate"]) if x["bitrate"] else None,
-						user_limit=int(x["user_limit"]) if x["user_limit"] else None,
-						overwrites=overwrites,
-						rtc_region=x["rtc_region"],
-					)
-					await asyncio.sleep(0.5)
-				except (discord.Forbidden, discord.HTTPException):
-					continue
-			elif x["type"] == "stage_voice":
-				try:
-					cat = discord.utils.get(ctx.guild.categories, name=x["category"])
-					overwrites = {}
-					for z in x["overwrites"]:
-						role = discord.utils.get(ctx.guild.roles, name=x["overwrites"][z]["role"])
-						if role:
-							overwrites[role] = discord.PermissionOverwrite.from_pair(
-								discord.Permissions(x["overwrites"][z]["allow"]),
-								discord.Permissions(x["overwrites"][z]["deny"]),
-							)
-					await ctx.guild.create_stage_channel(
-						name=x["name"],
-						category=cat if cat else None,
-						position=int(x["position"]),
-						reason=await self.custom_response("snapshot.strings.save_load_reason", ctx),
-						overwrites=overwrites,
-					)
-					await asyncio.sleep(0.5)
-				except (discord.Forbidden, discord.HTTPException):
-					continue
-			elif x["type"] == "category":
-				try:
-					overwrites = {}
-					for z in x["overwrites"]:
-						role = discord.utils.get(ctx.guild.roles, name=x["overwrites"][z]["role"])
-						if role:
-							overwrites[role] = discord.PermissionOverwrite.from_pair(
-								discord.Permissions(x["overwrites"][z]["allow"]),
-								discord.Permissions(x["overwrites"][z]["deny"]),
-							)
-					await ctx.guild.create_category(
-						name=x["name"],
-						position=int(x["position"]),
-						reason=await self.custom_response("snapshot.strings.save_load_reason", ctx),
-						overwrites=overwrites,
-					)
-					await asyncio.sleep(0.5)
-				except (discord.Forbidden, discord.HTTPException):
-					continue
-			elif x["type"] == "forum":
-				try:
-					overwrites = {}
-					for z in x["overwrites"]:
-						role = discord.utils.get(ctx.guild.roles, name=x["overwrites"][z]["role"])
-						if role:
-							overwrites[role] = discord.PermissionOverwrite.from_pair(
-								discord.Permissions(x["overwrites"][z]["allow"]),
-								discord.Permissions(x["overwrites"][z]["deny"]),
-							)
-					cat = discord.utils.get(ctx.guild.categories, name=x["category"])
-					await ctx.guild.create_forum(
-						name=x["name"],
-						category=cat if cat else None,
-						position=int(x["position"]),
-						reason=await self.custom_response("snapshot.strings.save_load_reason", ctx),
-						nsfw=bool(x["nsfw"]),
-						topic=x["topic"] if x["topic"] else None,
-						default_thread_slowmode_delay=int(x["slowmode"]) if x["slowmode"] else None,
-						overwrites=overwrites,
-						default_auto_archive_duration=x["default_auto_archive_duration"],
-					)
-					await asyncio.sleep(0.5)
-				except (discord.Forbidden, discord.HTTPException):
-					continue
+	async def preview_message(self, ctx: Context, plan: RestorePlan, code: str) -> dict:
+		message: dict = await self.custom_response(
+			"snapshot.preview",
+			ctx,
+			convert_embeds=False,
+			code=code,
+			create=plan.count("create"),
+			update=plan.count("update"),
+			delete=plan.count("delete"),
+			reorder=plan.reorder_roles + plan.reorder_channels,
+		)
+		embeds: list[dict] = message.get("embeds", [])
+		if embeds:
+			template = embeds[0].get("fields", [None])[0]
+			if plan.steps and template:
+				embeds[0]["fields"] = [Localization.format_strings(template, step=step) for step in plan.steps[:25]]
+			elif not plan.steps:
+				embeds[0]["fields"] = embeds[0].get("fields", [])[1:]
+		return CustomResponse.convert_embeds(message)
+
+	async def partial_load_message(self, ctx: Context, failed: list[RestoreStep], code: str) -> dict:
+		message: dict = await self.custom_response(
+			"snapshot.load_partial", ctx, convert_embeds=False, code=code, failed=len(failed)
+		)
+		embeds: list[dict] = message.get("embeds", [])
+		if embeds and embeds[0].get("fields"):
+			template = embeds[0]["fields"][0]
+			embeds[0]["fields"] = [Localization.format_strings(template, step=step) for step in failed[:25]]
+		return CustomResponse.convert_embeds(message)
 
 	@commands.hybrid_group(
 		name="snapshot",
@@ -338,21 +792,43 @@ class Snapshot(commands.Cog, name="Snapshots"):
 
 		await ctx.send("snapshot.create", code=code)
 
-	@snapshot.command(name="load", description="ss_load_specs-description")
-	@app_commands.describe(code="ss_load_specs-args-code-description")
-	@app_commands.rename(code="ss_load_specs-args-code-name")
+	@snapshot.command(name="schedule", description="ss_sch_specs-description", usage="ss_sch_specs-usage")
+	@app_commands.describe(interval="ss_sch_specs-args-interval-description")
+	@app_commands.rename(interval="ss_sch_specs-args-interval-name")
+	@app_commands.checks.has_permissions(administrator=True)
+	@commands.has_permissions(administrator=True)
+	async def schedule(self, ctx: Context, interval: Literal["hourly", "daily", "weekly", "off"]):
+		if interval == "off":
+			await self.queries.execute("snapshot_schedules.delete", ctx.guild.id)
+			return await ctx.send("snapshot.schedule.off")
+
+		await self.queries.execute(
+			"snapshot_schedules.upsert",
+			ctx.guild.id,
+			interval,
+			_next_run(ctx.guild.id, interval, discord.utils.utcnow()),
+		)
+		await ctx.send("snapshot.schedule.on", interval=interval)
+
+	# the overwrites of members are restored for the cached members, and the owner is alerted
+	@snapshot.command(name="load", description="ss_load_specs-description", extras={"chunk_guild": True})
+	@app_commands.describe(code="ss_load_specs-args-code-description", dry_run="ss_load_specs-args-dry_run-description")
+	@app_commands.rename(code="ss_load_specs-args-code-name", dry_run="ss_load_specs-args-dry_run-name")
 	@app_commands.checks.has_permissions(administrator=True)
 	@commands.has_permissions(administrator=True)
-	async def load(self, ctx: Context, code: str):
+	async def load(self, ctx: Context, code: str, dry_run: bool = False):
 		payload = await self.get_snapshot(code)
 		if not payload:
 			return await ctx.send("snapshot.not_found")
 
+		plan = plan_restore(ctx.guild, payload)
+		if dry_run:
+			return await ctx.send(**await self.preview_message(ctx, plan, code))
+
 		old = await self.create_snapshot(ctx)
 
-		await self.delete_all_channels(ctx)
-		await self.delete_all_roles(ctx)
-		await self.load_snapshot(ctx, payload)
+		reason = await self.custom_response("snapshot.strings.save_load_reason", ctx)
+		failed = await RestoreExecutor(ctx.guild, plan, reason).run()
 
 		if not ctx.guild.owner_id == ctx.author.id:  # prevent griefs by sending the code to the owner
 			alert = await self.custom_response("snapshot.owner_alert", ctx, code=old)
@@ -361,6 +837,8 @@ class Snapshot(commands.Cog, name="Snapshots"):
 			alert.pop("delete_after", None)
 			await ctx.guild.owner.send(**alert)
 
+		if failed:
+			return await ctx.send(**await self.partial_load_message(ctx, failed, old))
 		await ctx.send("snapshot.load")
 
 
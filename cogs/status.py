@@ -6,6 +6,7 @@ import discord
 from discord.ext import commands, tasks
 
 from core import MyClient
+from core.cluster import ClusterUnavailable
 
 
 class Status(commands.Cog, command_attrs=dict(hidden=True)):
@@ -31,10 +32,19 @@ class Status(commands.Cog, command_attrs=dict(hidden=True)):
 	async def update_status(self):
 		asyncio.create_task(self.statusupdate())
 
+	async def guild_count(self) -> int:
+		"""Counts the guilds of every cluster, or of this process if it's the only one or the others can't be asked."""
+		if self.client.cluster:
+			try:
+				return sum((await self.client.cluster.broadcast("guild_count")).values())
+			except ClusterUnavailable:
+				pass
+		return len(self.client.guilds)
+
 	async def statusupdate(self) -> None:
 		await self.client.change_presence(
 			activity=discord.CustomActivity(
-				name=f"{len(self.client.guilds)} servers | ?!{random.choice([command.qualified_name for command in self.client.commands])}"
+				name=f"{await self.guild_count()} servers | ?!{random.choice([command.qualified_name for command in self.client.commands])}"
 			),
 			status=discord.Status.online,  # type: ignore
 		)
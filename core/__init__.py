@@ -2,4 +2,63 @@ from core.argument import Argument
 from core.command import Command
 from core.slash_localization import SlashCommandLocalizer, update_slash_localizations, slash_command_localization
 from core.context import Context
+from core.migrations import Migration, discover_migrations, migrate
+from core.deadline import DEFAULT_DEADLINE, DeadlineExceeded, DeadlineSession, current_deadline
+from core.queries import (
+	CONNECTION_ERRORS,
+	REPLICA_STATEMENTS,
+	STATEMENT_CACHE_SIZE,
+	STATEMENTS,
+	Queries,
+	Replica,
+	current_actor,
+)
+from core.database import CircuitBreaker, DatabaseUnavailable, InstrumentedPool, SlowQuery, StatementStats
+from core.error_reporter import ErrorReporter, fingerprint
+from core.invalidation import GuildCache, Invalidation, InvalidationBus
+from core.message_cache import CachedConnectionState, CachedMessage, MessageCache
+from core.startup import Phase, Startup
+from core.chunking import ChunkPriority, ChunkRequest, ChunkScheduler
 from core.bot import MyClient
+
+__all__ = (
+	"CONNECTION_ERRORS",
+	"DEFAULT_DEADLINE",
+	"REPLICA_STATEMENTS",
+	"STATEMENTS",
+	"STATEMENT_CACHE_SIZE",
+	"Argument",
+	"CachedConnectionState",
+	"CachedMessage",
+	"ChunkPriority",
+	"ChunkRequest",
+	"ChunkScheduler",
+	"CircuitBreaker",
+	"Command",
+	"Context",
+	"DatabaseUnavailable",
+	"DeadlineExceeded",
+	"DeadlineSession",
+	"ErrorReporter",
+	"GuildCache",
+	"InstrumentedPool",
+	"Invalidation",
+	"InvalidationBus",
+	"MessageCache",
+	"Migration",
+	"MyClient",
+	"Phase",
+	"Queries",
+	"Replica",
+	"SlashCommandLocalizer",
+	"SlowQuery",
+	"Startup",
+	"StatementStats",
+	"current_actor",
+	"current_deadline",
+	"discover_migrations",
+	"fingerprint",
+	"migrate",
+	"slash_command_localization",
+	"update_slash_localizations",
+)
@@ -3,35 +3,109 @@ import datetime
 import json
 import os
 import socket
-import traceback
 from logging import getLogger
 from pathlib import Path
-from time import perf_counter
+from time import monotonic, perf_counter, time
 from typing import Any, Optional, Union
 
 import aiohttp
 import asyncpg
 import discord
+import yarl
 from discord import app_commands
 from discord.ext import commands, localization
-from helpers.emojis import LOADING
+from discord.gateway import DiscordWebSocket
+from discord.shard import Shard
 
-from core import Command, Context, SlashCommandLocalizer, slash_command_localization, update_slash_localizations
-from helpers import custom_response, seconds_to_text
+from core import (
+	CONNECTION_ERRORS,
+	STATEMENT_CACHE_SIZE,
+	CachedConnectionState,
+	ChunkPriority,
+	ChunkScheduler,
+	CircuitBreaker,
+	Command,
+	Context,
+	DatabaseUnavailable,
+	DeadlineExceeded,
+	DeadlineSession,
+	ErrorReporter,
+	GuildCache,
+	InstrumentedPool,
+	InvalidationBus,
+	MessageCache,
+	Queries,
+	Replica,
+	SlashCommandLocalizer,
+	Startup,
+	current_actor,
+	deadline,
+	migrate,
+	slash_command_localization,
+	update_slash_localizations,
+)
+from core.cluster import ClusterClient, ClusterUnavailable
+from core.interactions import InteractionServer
+from core.metrics import Metrics, MetricsServer
+from core.profiles import (
+	DEFAULT_PROFILE,
+	PROFILES,
+	REQUIRED_INTENTS,
+	CacheProfile,
+	apply_profile,
+	describe_intents,
+	needed_intents,
+)
+from core.resume import RESUMABLE_CLOSE_CODE, ResumeState, ResumeStore, ShardSession, guild_payload
+from helpers import LazyModule, custom_response, seconds_to_text
+
+psutil = LazyModule("psutil")
 
 
 class MyClient(commands.AutoShardedBot):
 	"""Represents the bot client. Inherits from `commands.AutoShardedBot`."""
 
-	def __init__(self):
-		update_slash_localizations()
+	def __init__(
+		self,
+		message_cache: Optional[MessageCache] = None,
+		cluster: Optional[ClusterClient] = None,
+		interactions_only: bool = False,
+	):
 		self.logger = getLogger(__name__)
+		# set when this process runs a range of the shards next to other processes, see `core.cluster`
+		self.cluster = cluster
+		# set when this process only receives interactions over HTTP and never connects, see `core.interactions`
+		self.interactions_only = interactions_only
+		self.interactions: InteractionServer | None = None
 		self.uptime: Optional[datetime.datetime] = None
 		self.loop: asyncio.AbstractEventLoop = asyncio.get_event_loop()
-		intents: discord.Intents = discord.Intents.all()
-		self.db: asyncpg.Pool | None = None
-		self.session: aiohttp.ClientSession | None = None
+		# what the gateway sends and what of it is cached, widened to what the cogs need once they're loaded
+		profile = os.getenv("CACHE_PROFILE") or DEFAULT_PROFILE
+		if profile not in PROFILES:
+			raise ValueError(f"CACHE_PROFILE has to be one of {', '.join(PROFILES)}, not {profile!r}")
+		self.cache_profile: CacheProfile = PROFILES[profile]
+		intents, member_cache_flags = self.cache_profile.resolve(REQUIRED_INTENTS)
+		self.db: InstrumentedPool | None = None
+		# kept until the guild's row changes, see `core.invalidation`. Also used while the database is down
+		self.prefixes: GuildCache[tuple[str, bool]] = GuildCache(self.load_prefix, decode=tuple)
+		# the sessions, guilds and caches kept over a graceful restart, see `core.resume`
+		self.resume = ResumeStore(
+			Path(os.getenv("RESUME_DIR") or ".resume")
+			/ (f"cluster-{cluster.cluster_id}.json" if cluster else "bot.json")
+		)
+		self.resume.track("prefixes", "guilds", self.prefixes)
+		self.resume_state: ResumeState | None = None
+		self.resume_saving: asyncio.Task | None = None
+		self.invalidation: InvalidationBus | None = None
+		self.queries: Queries | None = None
+		self.session: DeadlineSession | None = None
+		self.error_reporter = ErrorReporter(self)
+		# recorded in the hooks, `dispatch` and the HTTP client, served with METRICS_PORT, see `core.metrics`
+		self.metrics = Metrics()
+		self.metrics_server: MetricsServer | None = None
 		self.ready_event = asyncio.Event()
+		# only guilds with logging turned on are cached, see `LogListeners.cog_load`
+		self.message_cache: MessageCache = message_cache or MessageCache()
 		self.owner_ids = {
 			648168353453572117,  # pearoo
 			657350415511322647,  # liba
@@ -46,14 +120,38 @@ class MyClient(commands.AutoShardedBot):
 			activity=discord.CustomActivity(name="Bot starting...", emoji="🟡"),
 			status=discord.Status.idle,
 			chunk_guilds_at_startup=False,
+			shard_ids=cluster.shard_ids if cluster else None,
+			shard_count=cluster.shard_count if cluster else None,
 			loop=self.loop,
-			member_cache_flags=discord.MemberCacheFlags.from_intents(intents),
-			max_messages=20000,
+			member_cache_flags=member_cache_flags,
 			allowed_contexts=app_commands.AppCommandContext(guild=True, dm_channel=True, private_channel=True),
 			allowed_installs=app_commands.AppInstallationType(guild=True, user=True),
 			allowed_mentions=discord.AllowedMentions(everyone=False, roles=False),
 		)
-		self.custom_response = custom_response.CustomResponse(self)
+		self.metrics.instrument(self.http)
+		# parsed in the "localization" startup phase
+		self.custom_response: custom_response.CustomResponse | None = None
+		# the guilds aren't chunked at startup, the features that need their members ask for them, see `core.chunking`
+		self.chunker = ChunkScheduler(self)
+		# the hooks are overridden as methods rather than registered with the decorators, so register them here
+		self._before_invoke = self.before_invoke
+		self._after_invoke = self.after_invoke
+
+	def _get_state(self, **options: Any) -> CachedConnectionState:
+		return CachedConnectionState(
+			dispatch=self.dispatch,
+			handlers=self._handlers,
+			hooks=self._hooks,
+			http=self.http,
+			message_cache=self.message_cache,
+			**options,
+		)
+
+	def dispatch(self, event_name: str, /, *args: Any, **kwargs: Any) -> None:
+		if event_name == "socket_event_type":
+			# counted here rather than in a listener, which would start a task for every event
+			self.metrics.event(args[0])
+		super().dispatch(event_name, *args, **kwargs)
 
 	async def request(self, url: str):
 		async with self.session.get(url) as response:
@@ -64,17 +162,31 @@ class MyClient(commands.AutoShardedBot):
 			return "?"
 		if not message.guild:
 			return "?!"
-		row = await self.db.fetchrow("SELECT prefix, mention FROM guilds WHERE guild_id = $1", message.guild.id)
-		prefix, mention = row.get("prefix", "?!"), row.get("mention", True)
+		try:
+			prefix, mention = await self.prefixes.get(message.guild.id)
+		except DatabaseUnavailable:
+			prefix, mention = "?!", True
 		if mention:
 			return commands.when_mentioned_or(prefix)(self, message)
 		else:
 			return prefix
 
-	async def on_guild_join(self, guild: discord.Guild):
-		row = await self.db.fetchrow("SELECT * FROM guilds WHERE guild_id = $1", guild.id)
+	async def load_prefix(self, guild_id: int) -> tuple[str, bool]:
+		# cached until the next change, so read from the primary, the replica may not have the change yet
+		row = await self.queries.fetchrow("guilds.prefix", guild_id, connection=self.db)
 		if not row:
-			await self.db.execute("INSERT INTO guilds (guild_id) VALUES ($1)", guild.id)
+			return "?!", True
+		return row.get("prefix", "?!"), row.get("mention", True)
+
+	@property
+	def is_primary_cluster(self) -> bool:
+		"""Whether this process runs the jobs that aren't tied to a guild, e.g. pruning old data. Only one does."""
+		if self.interactions_only:
+			return False
+		return self.cluster is None or self.cluster.cluster_id == 0
+
+	async def on_guild_join(self, guild: discord.Guild):
+		await self.queries.execute("guilds.ensure", guild.id)
 
 	async def get_context(
 		self,
@@ -89,71 +201,320 @@ class MyClient(commands.AutoShardedBot):
 		self.logger.info("Running initial setup hook...")
 		benchmark = perf_counter()
 
-		await self.database_initialization()
-		await self.first_time_database()
-		await self.load_cogs()
-		await self.tree.set_translator(SlashCommandLocalizer())
-		self.session = aiohttp.ClientSession(
-			connector=aiohttp.TCPConnector(resolver=aiohttp.AsyncResolver(), family=socket.AF_INET)
+		self.error_reporter.start()
+		# each phase starts once the phases it comes after are done, the others run concurrently
+		startup = Startup()
+		startup.add("database", self.database_initialization)
+		startup.add("migrations", self.migrate_database, after=["database"])
+		startup.add("localization", self.load_localizations)
+		startup.add("translator", lambda: self.tree.set_translator(SlashCommandLocalizer()), after=["localization"])
+		startup.add("session", self.create_session)
+		if os.getenv("METRICS_PORT"):
+			startup.add("metrics", self.serve_metrics)
+		if self.cluster:
+			startup.add("cluster", self.connect_cluster)
+		self.load_cogs(startup, after=["migrations", "localization"])
+		startup.add(
+			"intents", self.apply_cache_profile, after=[name for name in startup.phases if name.startswith("cog:")]
 		)
+		if not self.interactions_only:
+			# a session only resumes with the intents it identified with
+			startup.add("resume", self.load_resume_state, after=["intents"])
+		try:
+			await startup.run()
+		finally:
+			self.logger.info(startup.report())
+		if self.resume_state and self.resume_state.caches:
+			# the bus has to listen first, so it doesn't hold up the startup
+			asyncio.create_task(self.restore_caches(self.resume_state.caches))
 		end = perf_counter() - benchmark
 		self.logger.info(f"Initial setup hook complete in {end:.2f}s")
 
+	async def load_localizations(self):
+		# parsing the localization files doesn't need the event loop, so it doesn't hold up the other phases
+		await asyncio.to_thread(update_slash_localizations)
+		self.custom_response = await asyncio.to_thread(custom_response.CustomResponse, self)
+
+	async def apply_cache_profile(self):
+		intents, member_cache_flags = self.cache_profile.resolve(needed_intents(self.cogs.values()))
+		apply_profile(self._connection, intents, member_cache_flags)
+		self.logger.info(
+			f"Using the {self.cache_profile.name} cache profile, {describe_intents(intents, member_cache_flags)}"
+		)
+
+	async def serve_metrics(self):
+		# every process of the machine needs a port of its own
+		port = int(os.environ["METRICS_PORT"]) + (self.cluster.cluster_id if self.cluster else 0)
+		server = MetricsServer(self, self.metrics, host=os.getenv("METRICS_HOST") or "127.0.0.1", port=port)
+		try:
+			await server.start()
+		except OSError as e:
+			# e.g. another interactions worker took the port, the bot runs fine without
+			self.logger.warning(f"Failed to serve the metrics on port {port}: {e!r}")
+		else:
+			self.metrics_server = server
+
+	async def load_resume_state(self):
+		# waits until the previous process wrote the file, if it's still shutting down
+		if not await self.resume.lock():
+			return
+		state = await asyncio.to_thread(
+			self.resume.read,
+			self.http.token.encode(),
+			self.user.id,
+			self.shard_count,
+			self.shard_ids,
+			self.intents.value,
+		)
+		if state is None:
+			return
+		if self.shard_count is None:
+			# the recommended count when the sessions were started, asking again could give another one
+			self.shard_count = state.shard_count
+		for data in state.guilds:
+			self._connection._add_guild_from_data(data)
+		self.resume_state = state
+		self.logger.info(f"Restored {len(state.guilds)} guilds, resuming {len(state.sessions)} shard sessions")
+
+	async def restore_caches(self, caches: dict[str, dict[str, Any]]):
+		if not self.invalidation or not await self.invalidation.wait_connected(timeout=30):
+			return
+		await self.invalidation.drain()
+		try:
+			versions = await self.invalidation_versions()
+		except (DatabaseUnavailable, *CONNECTION_ERRORS, asyncpg.PostgresError) as e:
+			self.logger.warning(f"Failed to check the kept caches, they weren't restored: {e!r}")
+			return
+		restored = self.resume.restore_caches(caches, versions)
+		self.logger.info(f"Restored {len(restored)} of {len(caches)} kept caches: {', '.join(restored) or 'none'}")
+
+	async def invalidation_versions(self) -> dict[str, int]:
+		"""Returns how many times each cached table changed, to tell whether a kept cache missed a change."""
+		rows = await self.queries.fetch("invalidation_versions.all", connection=self.db)
+		return {row["topic"]: row["version"] for row in rows}
+
+	async def launch_shard(self, gateway: yarl.URL, shard_id: int, *, initial: bool = False) -> None:
+		session = self.resume_state.sessions.pop(shard_id, None) if self.resume_state else None
+		if session is None:
+			return await super().launch_shard(gateway, shard_id, initial=initial)
+		# if Discord doesn't resume the session, the shard identifies and gets a READY as usual
+		self._connection.resuming_shards.add(shard_id)
+		try:
+			ws = await asyncio.wait_for(
+				DiscordWebSocket.from_client(
+					self,
+					gateway=yarl.URL(session.resume_url),
+					shard_id=shard_id,
+					session=session.session_id,
+					sequence=session.sequence,
+					resume=True,
+				),
+				timeout=self.shard_connect_timeout,
+			)
+		except Exception:
+			self.logger.exception(f"Failed to resume shard {shard_id}, identifying instead")
+			return await super().launch_shard(gateway, shard_id, initial=initial)
+		# what `AutoShardedClient.launch_shard` does with the websocket, its shards and queue are private
+		shard = self._AutoShardedClient__shards[shard_id] = Shard(ws, self, self._AutoShardedClient__queue.put_nowait)
+		shard.launch()
+
+	async def save_resume_state(self):
+		"""Closes the shards so their sessions stay resumable, then writes them and the caches to the resume file."""
+		shards: dict[int, Shard] = self._AutoShardedClient__shards
+		if self.user is None or not shards:
+			return
+		caches = {}
+		if self.invalidation:
+			try:
+				# read before syncing: a change committed after this isn't counted and the cache is dropped
+				versions = await self.invalidation_versions()
+			except (DatabaseUnavailable, *CONNECTION_ERRORS, asyncpg.PostgresError) as e:
+				self.logger.warning(f"Failed to check the caches, they won't be kept: {e!r}")
+			else:
+				if await self.invalidation.sync():
+					caches = self.resume.dump_caches(versions)
+
+		for shard in shards.values():
+			shard._cancel_task()
+		await asyncio.gather(*(shard.ws.close(code=RESUMABLE_CLOSE_CODE) for shard in shards.values()))
+		sessions = {
+			shard_id: ShardSession(shard.ws.session_id, shard.ws.sequence, str(shard.ws.gateway))
+			for shard_id, shard in shards.items()
+			if shard.ws.session_id and shard.ws.sequence is not None
+		}
+		if not sessions:
+			return
+		state = ResumeState(
+			user_id=self.user.id,
+			shard_count=self.shard_count,
+			shard_ids=list(self.shard_ids or range(self.shard_count)),
+			intents=self.intents.value,
+			sessions=sessions,
+			guilds=[
+				guild_payload(guild) for guild in self.guilds if guild.shard_id in sessions and not guild.unavailable
+			],
+			caches=caches,
+		)
+		await asyncio.to_thread(self.resume.write, self.http.token.encode(), state)
+		self.logger.info(f"Kept {len(sessions)} shard sessions, {len(state.guilds)} guilds and {len(caches)} caches")
+
+	async def connect_cluster(self):
+		self.cluster.register("guild_count", lambda: len(self.guilds))
+		await self.cluster.connect()
+		self.logger.info(
+			f"Cluster {self.cluster.cluster_id} of {self.cluster.cluster_count} runs shards "
+			f"{self.cluster.shard_ids[0]}-{self.cluster.shard_ids[-1]} of {self.cluster.shard_count}"
+		)
+		asyncio.create_task(self.watch_cluster())
+
+	async def watch_cluster(self):
+		await self.cluster.wait_closed()
+		if not self.is_closed():
+			# the supervisor is gone and won't restart this process, don't keep running next to a new one
+			self.logger.error("Lost the connection to the cluster supervisor, shutting down")
+			await self.close()
+
+	async def before_identify_hook(self, shard_id: Optional[int], *, initial: bool = False):
+		if self.cluster:
+			# the clusters share the identify rate limit, the supervisor hands out the turns
+			try:
+				return await self.cluster.identify(shard_id or 0)
+			except ClusterUnavailable:
+				pass
+		await super().before_identify_hook(shard_id, initial=initial)
+
+	async def serve_interactions(self, token: str, public_key: str, port: int):
+		"""
+		Logs in and receives interactions over HTTP until closed, without connecting to the gateway.
+
+		Parameters
+		----------
+		token: `str`
+		        The bot token.
+		public_key: `str`
+		        The application's public key, to check the requests' signatures with.
+		port: `int`
+		        The port to serve the interactions endpoint on.
+		"""
+		self.interactions = InteractionServer(self, public_key, port=port)
+		async with self:
+			await self.login(token)
+			await self.interactions.start()
+			self.uptime = discord.utils.utcnow()
+			# there's no gateway connection to wait for, `close` stops the server
+			await self.interactions.wait_closed()
+
+	async def close(self):
+		if self.interactions:
+			await self.interactions.stop()
+		self.chunker.stop()
+		if self.metrics_server:
+			await self.metrics_server.stop()
+		if not self.is_closed() and not self.interactions_only:
+			# closing again, e.g. on a signal and when the supervisor goes away, waits for the first save
+			if self.resume_saving is None:
+				self.resume_saving = asyncio.create_task(self.save_resume_state())
+			try:
+				await self.resume_saving
+			except Exception:
+				self.logger.exception("Failed to keep the sessions, the next start identifies again")
+			finally:
+				# lets the next process read the file
+				self.resume.unlock()
+		await super().close()
+		if self.invalidation:
+			await self.invalidation.stop()
+		if self.cluster:
+			await self.cluster.close()
+
+	async def create_session(self):
+		self.session = DeadlineSession(
+			aiohttp.ClientSession(
+				connector=aiohttp.TCPConnector(resolver=aiohttp.AsyncResolver(), family=socket.AF_INET)
+			)
+		)
+
 	@staticmethod
-	async def db_connection_init(connection: asyncpg.connection.Connection):
-		await connection.set_type_codec("jsonb", encoder=json.dumps, decoder=json.loads, schema="pg_catalog")
+	async def db_connection_init(connection: asyncpg.Connection):
+		# jsonb uses the binary format (a version byte followed by the JSON text) so COPY can write it too
+		await connection.set_type_codec(
+			"jsonb",
+			encoder=lambda value: b"\x01" + json.dumps(value).encode(),
+			decoder=lambda data: json.loads(data[1:]),
+			schema="pg_catalog",
+			format="binary",
+		)
 		await connection.set_type_codec("json", encoder=json.dumps, decoder=json.loads, schema="pg_catalog")
 
 	async def database_initialization(self):
 		self.logger.info("Connecting to database...")
 		benchmark = perf_counter()
 		# Connects to database
-		self.db = await asyncpg.create_pool(
-			host=os.getenv("DB_HOST"),
-			database="lumin_beta",
-			# ! Replace with default database name when ran for the first time
-			# ! Any subsequent executions of this code must use `database="lumin"`
+		options = dict(
+			database=os.getenv("DB_NAME", "lumin_beta"),
 			user="lumin",
 			password=os.getenv("DB_PASSWORD"),
-			port=os.getenv("DB_PORT"),
 			timeout=None,
 			init=self.db_connection_init,
+			statement_cache_size=STATEMENT_CACHE_SIZE,
+			max_cached_statement_lifetime=0,  # the registered statements are a fixed set, keep them prepared
 			max_inactive_connection_lifetime=120,  # timeout is 2 mins
 		)
+		pool = await asyncpg.create_pool(host=os.getenv("DB_HOST"), port=os.getenv("DB_PORT"), **options)
+		# with timeout=None, queries would wait on the pool forever while the database is down
+		self.db = InstrumentedPool(pool, breaker=CircuitBreaker(), acquire_timeout=10)
+		self.invalidation = InvalidationBus(
+			lambda: asyncpg.connect(
+				host=os.getenv("DB_HOST"),
+				port=os.getenv("DB_PORT"),
+				database=options["database"],
+				user=options["user"],
+				password=options["password"],
+				timeout=10,
+			)
+		)
+		self.invalidation.subscribe("guilds", self.prefixes.handle)
+		self.invalidation.start()
+
+		replica = None
+		if os.getenv("DB_REPLICA_HOST"):
+			replica_pool = await asyncpg.create_pool(
+				host=os.getenv("DB_REPLICA_HOST"), port=os.getenv("DB_REPLICA_PORT", os.getenv("DB_PORT")), **options
+			)
+			replica = Replica(
+				InstrumentedPool(replica_pool, acquire_timeout=10), max_lag=float(os.getenv("DB_REPLICA_MAX_LAG", 5))
+			)
+			await replica.check()
+			replica.start()
+			self.logger.info(f"Connected to read replica, {replica.lag}s behind the primary")
+		self.queries = Queries(self.db, replica)
 		end = perf_counter() - benchmark
 		self.logger.info(f"Connected to database in {end:.2f}s")
 
-	async def first_time_database(self):
-		self.logger.info("Running first time database setup...")
+	async def migrate_database(self):
 		benchmark = perf_counter()
-		database_exists = await self.db.fetchval(
-			"SELECT 1 FROM information_schema.schemata WHERE schema_name = 'public'"
-		)
-		if not database_exists:
-			await self.db.execute("CREATE DATABASE lumin_beta OWNER lumin")
-			self.logger.info("Created database 'lumin'!")
-
-		with open("first_time.sql", encoding="utf-8") as f:
-			# "ok ok but pearoo how do i update this if i
-			# feel like updating the db structure for no
-			# particular reason"
-
-			# please just use pycharm its actually goated,
-			# if you add the db to the project and select
-			# lumin.public.tables then press Ctrl + Alt + G
-			# it will generate the SQL for you which is crazy
-			# tbh like wtf
-			await self.db.execute(f.read())
-
+		applied = await migrate(self.db)
 		end = perf_counter() - benchmark
-		self.logger.info(
-			f"First time database setup complete in {end:.2f}s, you may now comment out the execution of this method in setup_hook"
-		)
+		if applied:
+			# the open connections prepared their statements against the old schema
+			await self.db.expire_connections()
+			if self.queries.replica:
+				await self.queries.replica.pool.expire_connections()
+			self.logger.info(f"Applied {len(applied)} database migrations in {end:.2f}s")
+		else:
+			self.logger.info(f"Database schema is up to date, checked in {end:.2f}s")
 
-	async def load_cogs(self):
-		self.logger.info("Loading cogs...")
-		benchmark = perf_counter()
+	def load_cogs(self, startup: Startup, after: list[str]):
+		"""
+		Adds a startup phase for every cog to load, so the cogs load concurrently.
 
+		Parameters
+		----------
+		startup: `Startup`
+			The startup to add the phases to.
+		after: list[`str`]
+			The phases every cog has to wait for.
+		"""
 		# Load all cogs within the cogs folder
 		allowed: list[str] = [
 			"afk",
@@ -169,19 +530,22 @@ class MyClient(commands.AutoShardedBot):
 			"snapshot",
 			"status",
 		]
+		# the cogs that use another cog while loading, e.g. {"info": ["snapshot"]}, the others don't wait for each other
+		requires: dict[str, list[str]] = {}
 
 		cogs = Path("cogs").glob("*.py")
 		for cog in cogs:
 			if cog.stem in allowed:  # if you're having issues with cogs not loading, check this list
-				await self.load_extension(f"cogs.{cog.stem}")
-				self.logger.info(f"Loaded extension {cog.name}")
-		end = perf_counter() - benchmark
-		self.logger.info(f"Loaded cogs in {end:.2f}s")
+				startup.add(
+					f"cog:{cog.stem}",
+					lambda name=cog.stem: self.load_extension(f"cogs.{name}"),
+					after=[*after, *(f"cog:{name}" for name in requires.get(cog.stem, []))],
+				)
 
 	async def on_ready(self):
 		if not hasattr(self, "uptime"):
 			self.uptime = discord.utils.utcnow()
-		self.logger.info("Bot is ready!")
+		self.logger.info(f"Bot is ready, {time() - psutil.Process().create_time():.2f}s after the process started")
 		self.logger.info(f"Servers: {len(self.guilds)}, Commands: {len(self.commands)}, Shards: {self.shard_count}")
 		self.logger.info(f"Loaded cogs: {', '.join([cog for cog in self.cogs])}")
 		self.logger.info(f"discord-localization v{localization.__version__}")
@@ -199,6 +563,12 @@ class MyClient(commands.AutoShardedBot):
 
 		if isinstance(error, commands.HybridCommandError):
 			error = error.original  # type: ignore
+		if isinstance(error, (commands.CommandInvokeError, app_commands.CommandInvokeError)):
+			if isinstance(error.original, (DatabaseUnavailable, DeadlineExceeded)):
+				error = error.original
+			elif isinstance(error.original, TimeoutError) and deadline.expired():
+				# a query or request that was cut off by the deadline
+				error = DeadlineExceeded("The command ran out of time")
 
 		match error:
 			case commands.MissingRequiredArgument():
@@ -260,50 +630,32 @@ class MyClient(commands.AutoShardedBot):
 				await ctx.send("errors.forbidden", command=command)
 			case commands.NotOwner():
 				await ctx.send("errors.not_owner", command=command)
+			case DatabaseUnavailable():
+				await ctx.send("errors.database_unavailable", command=command)
+			case DeadlineExceeded():
+				await ctx.send("errors.deadline_exceeded", command=command)
 			case commands.CommandNotFound() | app_commands.CommandNotFound():
 				return
 			case discord.RateLimited():
-				channel: discord.TextChannel = await self.fetch_channel(1268260404677574697)
-				webhook: discord.Webhook | None = discord.utils.get(
-					await channel.webhooks(),
-					name=f"{self.user.display_name} Rate Limit",
-				)
-				if not webhook:
-					webhook = await channel.create_webhook(name=f"{self.user.display_name} Rate Limit")
-				await webhook.send(
-					content=f"# ⚠️ RATE LIMIT\n**Guild:** {ctx.guild.name} / {ctx.guild.id}\n**User:** {ctx.author} / {ctx.author.id}\n**Command:** {ctx.command} {'- failed' if ctx.command_failed else ''}\n**Error:** {error}"
+				self.error_reporter.report(
+					error,
+					f"# ⚠️ RATE LIMIT\n**Guild:** {ctx.guild.name} / {ctx.guild.id}\n**User:** {ctx.author} / {ctx.author.id}\n**Command:** {ctx.command} {'- failed' if ctx.command_failed else ''}\n**Error:** {error}",
+					webhook_name=f"{self.user.display_name} Rate Limit",
+					with_stack=False,
 				)
 				raise error
 			case _:
-				# if the error is unknown, log it
-				channel: discord.TextChannel = (
-					ctx.channel if __debug__ and ctx and ctx.channel else await self.fetch_channel(1268260404677574697)
-				)
-				stack = "".join(traceback.format_exception(type(error), error, error.__traceback__))
-				# if stack is more than 1700 characters, turn it into a .txt file and store it as an attachment
-				too_long = len(stack) > 1700
-				file: discord.File | None = None
-				if too_long:
-					with open("auto-report_stack-trace.txt", "w") as f:
-						f.write(stack)
-					file = discord.File(fp="auto-report_stack-trace.txt", filename="error.txt")
-					stack = "The stack trace was too long to send in a message, so it was saved as a file."
-				webhook: discord.Webhook = discord.utils.get(
-					await channel.webhooks(), name=f"{self.user.display_name} Errors"
-				)
-				if not webhook:
-					webhook = await channel.create_webhook(
-						name=f"{self.user.display_name} Errors",
-						avatar=await ctx.me.avatar.read(),
-					)
-				await webhook.send(
-					content=f"**ID:** {ctx.message.id}\n"
+				# if the error is unknown, report it. The report is sent in the background
+				self.error_reporter.report(
+					error,
+					f"**ID:** {ctx.message.id}\n"
 					f"**Guild:** {ctx.guild.name if ctx.guild else 'DMs'} / {ctx.guild.id if ctx.guild else 0}\n"
 					f"**User:** {ctx.author} / {ctx.author.id}\n"
-					f"**Command:** {ctx.command}\n"
-					f"```{stack}```",
-					file=file if too_long and file else discord.abc.MISSING,
-				)  # type: ignore
+					f"**Command:** {ctx.command}",
+					webhook_name=f"{self.user.display_name} Errors",
+					channel_id=ctx.channel.id if __debug__ and ctx and ctx.channel else None,
+					report_id=ctx.message.id,
+				)
 				await ctx.reply(
 					f"An error has occured and has been reported to the developers. Report ID: `{ctx.message.id}`",
 					mention_author=False,
@@ -311,27 +663,55 @@ class MyClient(commands.AutoShardedBot):
 				raise error
 
 	async def on_command_error(self, ctx: Context, error: discord.errors.DiscordException):
+		# a slash command that failed doesn't get to `after_invoke`, its deadline would expire after its error
+		if ctx.deadline_timer:
+			ctx.deadline_timer.cancel()
+		self.record_command(ctx)
 		await self.handle_error(ctx, error)
 
 	async def on_app_command_error(self, interaction: discord.Interaction, error: app_commands.AppCommandError):
 		await self.handle_error(await Context.from_interaction(interaction), error)
 
+	def _expire_command(self, ctx: Context, task: asyncio.Task) -> None:
+		# the queries and requests of the command time out by themselves, this only stops a command stuck elsewhere
+		ctx.deadline_expired = True
+		asyncio.create_task(self.handle_error(ctx, DeadlineExceeded("The command ran out of time")))
+		task.cancel()
+
+	def record_command(self, ctx: Context) -> None:
+		"""Records how long a command took in the metrics, once, if it got to `before_invoke`."""
+		if ctx.invoked_at is None:
+			return
+		self.metrics.command(ctx.command.qualified_name, perf_counter() - ctx.invoked_at, ctx.command_failed)
+		ctx.invoked_at = None
+
 	async def before_invoke(self, ctx: Context):
-		if ctx.guild:
-			is_set_up = await self.db.fetchrow("SELECT * FROM guilds WHERE guild_id = $1", ctx.guild.id)
-			if not is_set_up:
-				await self.db.execute("INSERT INTO guilds (guild_id) VALUES ($1)", ctx.guild.id)
+		ctx.invoked_at = perf_counter()
+		budget = ctx.command.extras.get("deadline", getattr(ctx.cog, "deadline", deadline.DEFAULT_DEADLINE))
+		deadline.current_deadline.set(monotonic() + budget)
+		ctx.deadline_timer = self.loop.call_later(
+			budget + deadline.GRACE_PERIOD, self._expire_command, ctx, asyncio.current_task()
+		)
 		try:
-			# Signals that the bot is still thinking / performing a task
-			if ctx.interaction and ctx.interaction.type == discord.InteractionType.application_command:
-				await ctx.interaction.response.defer(thinking=True)  # type: ignore
-			else:
-				await ctx.message.add_reaction(LOADING)
-		except discord.HTTPException:
-			pass
+			# Signals that the bot is still thinking / performing a task, if it takes long enough for anyone to notice
+			ctx.start_progress()
+			if ctx.guild:
+				await self.queries.execute("guilds.ensure", ctx.guild.id)
+				if ctx.command.extras.get("chunk_guild", getattr(ctx.cog, "chunk_guild", False)):
+					# the command needs the members cached, e.g. to look them up by ID
+					await self.chunker.chunk(ctx.guild, ChunkPriority.INTERACTIVE)
+		except BaseException:
+			# the command doesn't run and never gets to `after_invoke`, its error is reported instead
+			ctx.deadline_timer.cancel()
+			raise
+		# set after the guild row is ensured, which isn't a write of the author's own data
+		current_actor.set(ctx.author.id)
 
 	async def after_invoke(self, ctx: Context):
-		try:
-			await ctx.message.remove_reaction(LOADING, ctx.me)
-		except discord.HTTPException:
-			pass
+		if ctx.deadline_timer:
+			ctx.deadline_timer.cancel()
+		if ctx.deadline_expired:
+			# the command swallowed the cancellation, the rest of the task shouldn't be cancelled
+			asyncio.current_task().uncancel()
+		self.record_command(ctx)
+		await ctx.stop_progress()
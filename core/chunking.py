@@ -0,0 +1,171 @@
+"""Requests the members of guilds from the gateway when a feature needs them, one guild at a time per shard.
+
+The guilds aren't chunked at startup, as that would take the shards minutes and keep every member in memory. Instead a
+feature that needs a guild's members asks `ChunkScheduler.chunk` for them. Each guild is only requested once, however
+many ask at the same time, and every shard works through one request at a time, so chunking never holds up the
+events and heartbeats of the shard. Commands that wait for the members go before background jobs.
+
+A command asks for the members of its guild with ``chunk_guild``, as an attribute of its cog or in its ``extras``,
+like its ``deadline``.
+"""
+
+import asyncio
+import itertools
+from dataclasses import dataclass, field
+from enum import IntEnum
+from logging import getLogger
+from time import monotonic, time
+from typing import Optional
+
+import discord
+
+logger = getLogger(__name__)
+
+
+class ChunkPriority(IntEnum):
+	INTERACTIVE = 0
+	"""Someone waits for the members, e.g. a command."""
+	BACKGROUND = 1
+	"""A job that can wait, e.g. removing the expired cases."""
+
+
+@dataclass(slots=True)
+class ChunkRequest:
+	guild_id: int
+	priority: ChunkPriority
+	future: asyncio.Future[bool]
+	requested_at: float = field(default_factory=monotonic)
+	started_at: Optional[float] = None
+
+
+class ChunkScheduler:
+	def __init__(self, client: discord.AutoShardedClient, *, concurrency: int = 1, timeout: float = 120.0):
+		"""Chunks the guilds of a client on demand.
+
+		Parameters
+		----------
+		client: `discord.AutoShardedClient`
+			The client whose guilds to chunk. It needs the members intent.
+		concurrency: `int`
+			How many guilds every shard chunks at the same time.
+		timeout: `float`
+			How long to wait for the members of a guild, in seconds, before giving up on it.
+		"""
+		self.client = client
+		self.concurrency = concurrency
+		self.timeout = timeout
+		self.chunked_at: dict[int, float] = {}
+		"""When the guilds were chunked, as a UNIX timestamp. Their members are kept up to date by the events after."""
+		self.requested = 0
+		self.deduplicated = 0
+		self.completed = 0
+		self.failed = 0
+		self._requests: dict[int, ChunkRequest] = {}
+		self._queues: dict[int, asyncio.PriorityQueue[tuple[int, int, int]]] = {}
+		self._workers: list[asyncio.Task] = []
+		self._order = itertools.count()
+		# a guild created again, e.g. after identifying again, starts with the members Discord sent with it
+		for event in ("on_guild_join", "on_guild_available", "on_guild_remove"):
+			client.add_listener(self._forget, event)
+
+	@property
+	def queued(self) -> int:
+		return sum(1 for request in self._requests.values() if request.started_at is None)
+
+	@property
+	def running(self) -> int:
+		return len(self._requests) - self.queued
+
+	async def chunk(self, guild: discord.Guild, priority: ChunkPriority = ChunkPriority.BACKGROUND) -> bool:
+		"""
+		Waits until the members of a guild are cached, requesting them if they aren't.
+
+		Parameters
+		----------
+		guild: `discord.Guild`
+			The guild to chunk.
+		priority: `ChunkPriority`
+			Whether someone waits for it. A request made in the background is moved up if someone asks for it too.
+
+		Returns
+		-------
+		`bool`
+			Whether the members are cached, False if they can't be requested or didn't arrive in time.
+		"""
+		if guild.id in self.chunked_at:
+			return True
+		if guild.chunked:
+			self.chunked_at[guild.id] = time()
+			return True
+		if not self.client.intents.members or self.client.get_shard(guild.shard_id) is None:
+			return False  # e.g. a process that only receives interactions
+
+		request = self._requests.get(guild.id)
+		if request is None:
+			self.requested += 1
+			request = self._requests[guild.id] = ChunkRequest(
+				guild.id, priority, asyncio.get_running_loop().create_future()
+			)
+			self._queue(guild.shard_id).put_nowait((priority, next(self._order), guild.id))
+		else:
+			self.deduplicated += 1
+			if priority < request.priority and request.started_at is None:
+				# the queued entry of the lower priority is skipped once this one is done
+				request.priority = priority
+				self._queue(guild.shard_id).put_nowait((priority, next(self._order), guild.id))
+		# a waiter that gives up, e.g. a command that ran out of time, doesn't cancel it for the others
+		return await asyncio.shield(request.future)
+
+	def stop(self) -> None:
+		"""Stops chunking, the waiting requests get False."""
+		for worker in self._workers:
+			worker.cancel()
+		self._workers.clear()
+		self._queues.clear()
+		for request in self._requests.values():
+			if not request.future.done():
+				request.future.set_result(False)
+		self._requests.clear()
+
+	def _queue(self, shard_id: int) -> asyncio.PriorityQueue[tuple[int, int, int]]:
+		if shard_id not in self._queues:
+			queue = self._queues[shard_id] = asyncio.PriorityQueue()
+			for _ in range(self.concurrency):
+				self._workers.append(asyncio.create_task(self._work(queue)))
+		return self._queues[shard_id]
+
+	async def _work(self, queue: asyncio.PriorityQueue[tuple[int, int, int]]) -> None:
+		while True:
+			_, _, guild_id = await queue.get()
+			request = self._requests.get(guild_id)
+			if request is None or request.started_at is not None:
+				continue  # moved up and already chunked, or being chunked
+			request.started_at = monotonic()
+			try:
+				chunked = await self._chunk(guild_id)
+			except Exception:
+				logger.exception(f"Failed to chunk the guild {guild_id}")
+				self.failed += 1
+				chunked = False
+			finally:
+				self._requests.pop(guild_id, None)
+			if not request.future.done():
+				request.future.set_result(chunked)
+
+	async def _chunk(self, guild_id: int) -> bool:
+		guild = self.client.get_guild(guild_id)
+		if guild is None:
+			return False  # left in the meantime
+		if not guild.chunked:
+			try:
+				await asyncio.wait_for(guild.chunk(), timeout=self.timeout)
+			except (TimeoutError, discord.ClientException, discord.ConnectionClosed, OSError) as e:
+				self.failed += 1
+				logger.warning(f"Failed to chunk the guild {guild_id}: {e!r}")
+				return False
+		self.completed += 1
+		self.chunked_at[guild_id] = time()
+		return True
+
+	async def _forget(self, guild: discord.Guild) -> None:
+		self.chunked_at.pop(guild.id, None)
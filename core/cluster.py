@@ -0,0 +1,458 @@
+"""Runs the shards of the bot in several processes, so they don't all share one event loop and CPU core.
+
+Running ``main.py`` with ``CLUSTERS`` set above 1 starts a `ClusterSupervisor` instead of the bot. It splits the shards
+into contiguous ranges, starts a bot process ("cluster") for each range and restarts the ones that crash. The clusters
+talk to the supervisor over a local connection with `ClusterClient`, to take turns identifying with the gateway and to
+ask every cluster something, e.g. its guild count for the status. Background jobs only pick up the guilds of their
+own shards, and the jobs that aren't tied to a guild only run in `MyClient.is_primary_cluster`.
+
+The messages are JSON objects, one per line, with an ``op`` and, for the ones that expect a reply, an ``id``.
+"""
+
+import asyncio
+import itertools
+import json
+import os
+import secrets
+import sys
+from logging import getLogger
+from time import monotonic
+from typing import Any, Awaitable, Callable, Optional, Union
+
+import aiohttp
+from discord.utils import maybe_coroutine
+
+logger = getLogger(__name__)
+
+IDENTIFY_INTERVAL = 5.0
+"""The time between two identifies in the same rate limit bucket, in seconds."""
+
+Handler = Callable[..., Union[Any, Awaitable[Any]]]
+
+
+class ClusterUnavailable(Exception):
+	"""Raised when the supervisor can't be reached or doesn't reply in time."""
+
+
+def shard_ranges(shard_count: int, clusters: int) -> list[list[int]]:
+	"""
+	Splits the shards into contiguous ranges of about the same size, one per cluster.
+
+	Parameters
+	----------
+	shard_count: `int`
+		The total number of shards.
+	clusters: `int`
+		The number of clusters. There are never more clusters than shards.
+
+	Returns
+	-------
+	list[list[`int`]]
+		The shard IDs of each cluster.
+	"""
+	clusters = max(min(clusters, shard_count), 1)
+	size, extra = divmod(shard_count, clusters)
+	ranges: list[list[int]] = []
+	start = 0
+	for cluster_id in range(clusters):
+		end = start + size + (cluster_id < extra)
+		ranges.append(list(range(start, end)))
+		start = end
+	return ranges
+
+
+async def gateway_info(token: str) -> tuple[int, int]:
+	"""
+	Asks Discord how many shards the bot should run and how many of them can identify at the same time.
+
+	Parameters
+	----------
+	token: `str`
+		The token of the bot.
+
+	Returns
+	-------
+	tuple[`int`, `int`]
+		The recommended shard count and the identify concurrency.
+	"""
+	async with aiohttp.ClientSession() as session:
+		async with session.get(
+			"https://discord.com/api/v10/gateway/bot", headers={"Authorization": f"Bot {token}"}
+		) as response:
+			response.raise_for_status()
+			data = await response.json()
+	return data["shards"], data["session_start_limit"]["max_concurrency"]
+
+
+async def _send(writer: asyncio.StreamWriter, message: dict[str, Any]) -> None:
+	writer.write(json.dumps(message).encode() + b"\n")
+	await writer.drain()
+
+
+class ClusterSupervisor:
+	def __init__(
+		self,
+		token: str,
+		clusters: int,
+		*,
+		shard_count: Optional[int] = None,
+		max_concurrency: int = 1,
+		command: Optional[list[str]] = None,
+		query_timeout: float = 5.0,
+		restart_delay: float = 5.0,
+		max_restart_delay: float = 300.0,
+	):
+		"""Starts a bot process for each range of shards, restarts the ones that crash and relays their messages.
+
+		A cluster that exits with code 0 was stopped on purpose and isn't restarted. One that crashes is restarted
+		after ``restart_delay`` seconds, doubled after every crash up to ``max_restart_delay``, and reset once it ran
+		for longer than ``max_restart_delay``.
+
+		Parameters
+		----------
+		token: `str`
+			The token of the bot, used to get the recommended shard count.
+		clusters: `int`
+			The number of bot processes to run.
+		shard_count: Optional[`int`]
+			The total number of shards. Asked from Discord if not given.
+		max_concurrency: `int`
+			The number of shards that can identify at the same time. Asked from Discord with the shard count.
+		command: Optional[list[`str`]]
+			The command that starts a cluster. Defaults to the command this process was started with.
+		query_timeout: `float`
+			How long a broadcast waits for the answers of the clusters, in seconds.
+		restart_delay: `float`
+			How long to wait before restarting a crashed cluster the first time, in seconds.
+		max_restart_delay: `float`
+			The longest time to wait before restarting a crashed cluster, in seconds.
+		"""
+		self.token = token
+		self.clusters = clusters
+		self.shard_count = shard_count
+		self.max_concurrency = max_concurrency
+		self.command = command or [sys.executable, *sys.orig_argv[1:]]
+		self.query_timeout = query_timeout
+		self.restart_delay = restart_delay
+		self.max_restart_delay = max_restart_delay
+		self.secret = secrets.token_hex(16)
+		self.address: Optional[tuple[str, int]] = None
+		self.processes: dict[int, asyncio.subprocess.Process] = {}
+		self.connections: dict[int, asyncio.StreamWriter] = {}
+		self.restarts: dict[int, int] = {}
+		self._pending: dict[tuple[int, int], asyncio.Future] = {}
+		self._ids = itertools.count()
+		self._identify_locks: dict[int, asyncio.Lock] = {}
+		self._last_identify: dict[int, float] = {}
+		self._tasks: set[asyncio.Task] = set()
+
+	async def run(self) -> None:
+		"""Runs the clusters until they all stopped. Cancelling it terminates them."""
+		if self.shard_count is None:
+			self.shard_count, self.max_concurrency = await gateway_info(self.token)
+		ranges = shard_ranges(self.shard_count, self.clusters)
+		server = await asyncio.start_server(self._serve, "127.0.0.1", 0)
+		self.address = server.sockets[0].getsockname()[:2]
+		logger.info(f"Running {self.shard_count} shards in {len(ranges)} clusters")
+		try:
+			async with server:
+				await asyncio.gather(*(self._supervise(cluster_id, ranges) for cluster_id in range(len(ranges))))
+		finally:
+			await self._terminate()
+
+	async def _supervise(self, cluster_id: int, ranges: list[list[int]]) -> None:
+		shard_ids = ranges[cluster_id]
+		env = {
+			**os.environ,
+			"CLUSTER_ID": str(cluster_id),
+			"CLUSTER_COUNT": str(len(ranges)),
+			"CLUSTER_SHARDS": ",".join(map(str, shard_ids)),
+			"SHARD_COUNT": str(self.shard_count),
+			"CLUSTER_ADDRESS": f"{self.address[0]}:{self.address[1]}",
+			"CLUSTER_SECRET": self.secret,
+		}
+		delay = self.restart_delay
+		while True:
+			started = monotonic()
+			process = await asyncio.create_subprocess_exec(*self.command, env=env)
+			self.processes[cluster_id] = process
+			logger.info(f"Started cluster {cluster_id} (PID {process.pid}) with shards {shard_ids[0]}-{shard_ids[-1]}")
+			code = await process.wait()
+			del self.processes[cluster_id]
+			if code == 0:
+				logger.info(f"Cluster {cluster_id} stopped")
+				return
+			if monotonic() - started > self.max_restart_delay:
+				delay = self.restart_delay  # it ran fine for a while, this isn't a crash loop
+			self.restarts[cluster_id] = self.restarts.get(cluster_id, 0) + 1
+			logger.error(f"Cluster {cluster_id} exited with code {code}, restarting it in {delay:.0f}s")
+			await asyncio.sleep(delay)
+			delay = min(delay * 2, self.max_restart_delay)
+
+	async def _terminate(self) -> None:
+		processes = [process for process in self.processes.values() if process.returncode is None]
+		for process in processes:
+			process.terminate()
+		await asyncio.gather(*(process.wait() for process in processes), return_exceptions=True)
+
+	async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+		cluster_id = None
+		try:
+			hello = json.loads(await reader.readline() or "{}")
+			if hello.get("op") != "hello" or not secrets.compare_digest(str(hello.get("secret")), self.secret):
+				return
+			cluster_id = int(hello["cluster"])
+			self.connections[cluster_id] = writer
+			while line := await reader.readline():
+				# handled in the background, an identify waiting for its turn must not hold up the other messages
+				task = asyncio.create_task(self._handle(cluster_id, writer, json.loads(line)))
+				self._tasks.add(task)
+				task.add_done_callback(self._tasks.discard)
+		except (ConnectionError, ValueError) as e:
+			logger.warning(f"Lost the connection to cluster {cluster_id}: {e}")
+		finally:
+			if cluster_id is not None and self.connections.get(cluster_id) is writer:
+				del self.connections[cluster_id]
+			writer.close()
+
+	async def _handle(self, cluster_id: int, writer: asyncio.StreamWriter, message: dict[str, Any]) -> None:
+		match message.get("op"):
+			case "answer":
+				future = self._pending.pop((message["id"], cluster_id), None)
+				if future and not future.done():
+					future.set_result(message)
+				return
+			case "identify":
+				await self._identify(message["shard_id"])
+				result = None
+			case "broadcast":
+				result = await self._broadcast(message["name"], message.get("args", []))
+			case op:
+				logger.warning(f"Cluster {cluster_id} sent an unknown message: {op}")
+				return
+		try:
+			await _send(writer, {"op": "reply", "id": message["id"], "result": result})
+		except ConnectionError:
+			pass  # the cluster is gone, it will ask again after it's restarted
+
+	async def _identify(self, shard_id: int) -> None:
+		bucket = shard_id % self.max_concurrency
+		async with self._identify_locks.setdefault(bucket, asyncio.Lock()):
+			wait = self._last_identify.get(bucket, 0.0) + IDENTIFY_INTERVAL - monotonic()
+			if wait > 0:
+				await asyncio.sleep(wait)
+			self._last_identify[bucket] = monotonic()
+
+	async def _broadcast(self, name: str, args: list[Any]) -> dict[str, Any]:
+		request_id = next(self._ids)
+		futures: dict[int, asyncio.Future] = {}
+		for cluster_id, writer in list(self.connections.items()):
+			future = asyncio.get_running_loop().create_future()
+			self._pending[(request_id, cluster_id)] = future
+			try:
+				await _send(writer, {"op": "query", "id": request_id, "name": name, "args": args})
+			except ConnectionError:
+				del self._pending[(request_id, cluster_id)]
+				continue
+			futures[cluster_id] = future
+		if futures:
+			await asyncio.wait(futures.values(), timeout=self.query_timeout)
+		results = {}
+		for cluster_id, future in futures.items():
+			self._pending.pop((request_id, cluster_id), None)
+			if future.done() and "result" in future.result():
+				results[str(cluster_id)] = future.result()["result"]  # JSON keys are strings
+		return results
+
+
+class ClusterClient:
+	def __init__(
+		self,
+		cluster_id: int,
+		cluster_count: int,
+		shard_ids: list[int],
+		shard_count: int,
+		address: tuple[str, int],
+		secret: str,
+		*,
+		timeout: float = 10.0,
+	):
+		"""The connection of a cluster to its `ClusterSupervisor`.
+
+		Other clusters can call the functions given to `register` with `broadcast`, their results must be JSON
+		serializable.
+
+		Parameters
+		----------
+		cluster_id: `int`
+			The ID of this cluster.
+		cluster_count: `int`
+			The number of clusters.
+		shard_ids: list[`int`]
+			The shards this cluster runs.
+		shard_count: `int`
+			The total number of shards.
+		address: tuple[`str`, `int`]
+			The host and port of the supervisor.
+		secret: `str`
+			The secret the supervisor accepts connections with.
+		timeout: `float`
+			How long to wait for a reply of the supervisor to a broadcast, in seconds.
+		"""
+		self.cluster_id = cluster_id
+		self.cluster_count = cluster_count
+		self.shard_ids = shard_ids
+		self.shard_count = shard_count
+		self.address = address
+		self.secret = secret
+		self.timeout = timeout
+		self.handlers: dict[str, Handler] = {}
+		self._writer: Optional[asyncio.StreamWriter] = None
+		self._reader_task: Optional[asyncio.Task] = None
+		self._pending: dict[int, asyncio.Future] = {}
+		self._ids = itertools.count()
+		self._tasks: set[asyncio.Task] = set()
+
+	@classmethod
+	def from_env(cls) -> Optional["ClusterClient"]:
+		"""Creates the client from the environment the supervisor started this process with, if it did."""
+		if "CLUSTER_ID" not in os.environ:
+			return None
+		host, port = os.environ["CLUSTER_ADDRESS"].rsplit(":", 1)
+		return cls(
+			int(os.environ["CLUSTER_ID"]),
+			int(os.environ["CLUSTER_COUNT"]),
+			[int(shard_id) for shard_id in os.environ["CLUSTER_SHARDS"].split(",")],
+			int(os.environ["SHARD_COUNT"]),
+			(host, int(port)),
+			os.environ["CLUSTER_SECRET"],
+		)
+
+	@property
+	def connected(self) -> bool:
+		return self._reader_task is not None and not self._reader_task.done()
+
+	def register(self, name: str, handler: Handler) -> None:
+		"""
+		Lets the other clusters call a function with `broadcast`.
+
+		Parameters
+		----------
+		name: `str`
+			The name the other clusters call the function by.
+		handler: Callable[..., Any]
+			The function or coroutine function to call with the arguments of the broadcast.
+		"""
+		self.handlers[name] = handler
+
+	async def connect(self) -> None:
+		"""Connects to the supervisor and starts answering the queries of the other clusters."""
+		reader, self._writer = await asyncio.open_connection(*self.address)
+		await _send(self._writer, {"op": "hello", "cluster": self.cluster_id, "secret": self.secret})
+		self._reader_task = asyncio.create_task(self._read(reader))
+
+	async def close(self) -> None:
+		"""Disconnects from the supervisor."""
+		if self._writer:
+			self._writer.close()
+		if self._reader_task:
+			self._reader_task.cancel()
+			try:
+				await self._reader_task
+			except asyncio.CancelledError:
+				pass
+
+	async def wait_closed(self) -> None:
+		"""Waits until the connection to the supervisor is lost."""
+		if self._reader_task:
+			await asyncio.shield(self._reader_task)
+
+	async def _read(self, reader: asyncio.StreamReader) -> None:
+		try:
+			while line := await reader.readline():
+				message = json.loads(line)
+				if message["op"] == "reply":
+					future = self._pending.pop(message["id"], None)
+					if future and not future.done():
+						future.set_result(message.get("result"))
+				elif message["op"] == "query":
+					task = asyncio.create_task(self._answer(message))
+					self._tasks.add(task)
+					task.add_done_callback(self._tasks.discard)
+		except (ConnectionError, ValueError) as e:
+			logger.error(f"Lost the connection to the cluster supervisor: {e}")
+		finally:
+			for future in self._pending.values():
+				if not future.done():
+					future.set_exception(ClusterUnavailable("Lost the connection to the cluster supervisor"))
+			self._pending.clear()
+
+	async def _answer(self, message: dict[str, Any]) -> None:
+		answer: dict[str, Any] = {"op": "answer", "id": message["id"]}
+		handler = self.handlers.get(message["name"])
+		if handler is None:
+			answer["error"] = f"Unknown query {message['name']}"
+		else:
+			try:
+				answer["result"] = await maybe_coroutine(handler, *message.get("args", []))
+			except Exception as e:
+				logger.exception(f"Failed to answer the cluster query {message['name']}")
+				answer["error"] = str(e)
+		try:
+			await _send(self._writer, answer)
+		except ConnectionError:
+			pass
+
+	async def _request(self, op: str, timeout: Optional[float], **payload: Any) -> Any:
+		if not self.connected:
+			raise ClusterUnavailable("Not connected to the cluster supervisor")
+		request_id = next(self._ids)
+		future = asyncio.get_running_loop().create_future()
+		self._pending[request_id] = future
+		try:
+			await _send(self._writer, {"op": op, "id": request_id, **payload})
+			return await asyncio.wait_for(future, timeout)
+		except (ConnectionError, TimeoutError) as e:
+			raise ClusterUnavailable(f"The cluster supervisor didn't reply to {op}") from e
+		finally:
+			self._pending.pop(request_id, None)
+
+	async def identify(self, shard_id: int) -> None:
+		"""
+		Waits for the turn of a shard to identify, the clusters share the rate limit of identifies.
+
+		Parameters
+		----------
+		shard_id: `int`
+			The shard that is about to identify.
+
+		Raises
+		------
+		ClusterUnavailable
+			If the supervisor can't be reached.
+		"""
+		await self._request("identify", None, shard_id=shard_id)
+
+	async def broadcast(self, name: str, *args: Any) -> dict[int, Any]:
+		"""
+		Calls a registered function in every cluster, including this one.
+
+		Parameters
+		----------
+		name: `str`
+			The name the function was registered with.
+		*args: `Any`
+			The JSON serializable arguments to call it with.
+
+		Returns
+		-------
+		dict[`int`, `Any`]
+			The results, by cluster ID. The clusters that are down, failed or didn't answer in time are missing.
+
+		Raises
+		------
+		ClusterUnavailable
+			If the supervisor can't be reached.
+		"""
+		results = await self._request("broadcast", self.timeout, name=name, args=list(args))
+		return {int(cluster_id): result for cluster_id, result in results.items()}
@@ -1,10 +1,75 @@
+import asyncio
 from typing import Optional, Sequence, Union
 
 import discord
 from discord.ext import commands
 
+from helpers.emojis import LOADING, TICK
+
+PROGRESS_DELAY = 0.5
+"""How long a command runs before it shows that it's still working, in seconds. Most commands are done by then."""
+
 
 class Context(commands.Context):
+	deadline_timer: Optional[asyncio.TimerHandle] = None
+	deadline_expired: bool = False
+	invoked_at: Optional[float] = None
+	progress: Optional[asyncio.Task] = None
+	progress_shown: bool = False
+
+	def start_progress(self, delay: float = PROGRESS_DELAY) -> None:
+		"""
+		Shows that the command is still running if it takes longer than ``delay``: interactions are deferred and
+		messages get the `LOADING` reaction. Commands that respond sooner respond directly, without either.
+
+		Parameters
+		----------
+		delay: `float`
+		        The time to wait before showing the indicator, in seconds.
+		"""
+		self.progress = asyncio.create_task(self._show_progress(delay))
+
+	async def _show_progress(self, delay: float) -> None:
+		await asyncio.sleep(delay)
+		self.progress_shown = True
+		try:
+			if self.interaction and self.interaction.type == discord.InteractionType.application_command:
+				if not self.interaction.response.is_done():
+					await self.interaction.response.defer(thinking=True)
+			else:
+				await self.message.add_reaction(LOADING)
+		except discord.HTTPException:
+			pass
+
+	async def settle_progress(self) -> None:
+		"""
+		Cancels the indicator if it isn't shown yet, or waits until it is. Called before responding, so a response
+		never races the deferral of the interaction.
+		"""
+		if self.progress is None or self.progress.done():
+			return
+		if self.progress_shown:
+			await asyncio.shield(self.progress)
+		else:
+			self.progress.cancel()
+
+	async def stop_progress(self) -> None:
+		"""
+		Cancels the indicator, and removes the `LOADING` reaction if it was added. Acknowledges an interaction the
+		command didn't respond to, e.g. one that only sent a message elsewhere, so it doesn't show as failed.
+		"""
+		await self.settle_progress()
+		if self.interaction and not self.interaction.response.is_done():
+			try:
+				await self.interaction.response.send_message(TICK, ephemeral=True)
+			except discord.HTTPException:
+				pass
+		if self.progress_shown and not self.interaction:
+			try:
+				await self.message.remove_reaction(LOADING, self.me)
+			except discord.HTTPException:
+				pass
+
 	async def send(  # type: ignore
 		self,
 		key: Optional[str] = None,
@@ -72,6 +137,8 @@ class Context(commands.Context):
 
 		merged_args = {k: v for k, v in base_args.items() if v is not None}
 
+		# responds to the interaction directly if the command was fast enough not to defer it
+		await self.settle_progress()
 		msg = await super().send(**merged_args)
 		if delete_after is not None:
 			await msg.delete(delay=delete_after)
@@ -0,0 +1,352 @@
+"""A connection pool that times every query, so latency spikes can be traced back to a statement."""
+
+import asyncio
+import contextlib
+import datetime
+import re
+from bisect import bisect_left
+from collections import deque
+from dataclasses import dataclass, field
+from logging import getLogger
+from time import monotonic, perf_counter
+from typing import Any, Iterable, Iterator, Literal, Optional
+
+import asyncpg
+from discord.ext import commands
+
+from core import deadline
+from core.queries import CONNECTION_ERRORS, STATEMENTS
+
+logger = getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+"""The upper bounds of the latency histogram buckets, in seconds. The last bucket holds everything slower."""
+_STATEMENT_NAMES = {query: name for name, query in STATEMENTS.items()}
+_EXPLAINABLE = re.compile(r"\s*(SELECT|WITH|INSERT|UPDATE|DELETE|VALUES)\b", re.IGNORECASE)
+_WRITES = re.compile(r"\b(INSERT|UPDATE|DELETE|MERGE)\b", re.IGNORECASE)
+# a full connection slot or a statement timeout mean the server is overloaded, even though it answered
+_OUTAGE_ERRORS = (*CONNECTION_ERRORS, asyncpg.InsufficientResourcesError, asyncpg.QueryCanceledError)
+_TIMEOUT_ERRORS = (asyncio.TimeoutError, asyncpg.QueryCanceledError)
+
+
+@dataclass(slots=True)
+class StatementStats:
+	"""The latency, row and pool wait statistics of one statement."""
+
+	name: str
+	calls: int = 0
+	total_time: float = 0.0
+	max_time: float = 0.0
+	total_wait: float = 0.0
+	rows: int = 0
+	histogram: list[int] = field(default_factory=lambda: [0] * (len(LATENCY_BUCKETS) + 1))
+
+	@property
+	def mean_time(self) -> float:
+		return self.total_time / self.calls if self.calls else 0.0
+
+	def percentile(self, fraction: float) -> float:
+		"""Estimates a latency percentile from the histogram, as the upper bound of the bucket it falls into."""
+		target = fraction * self.calls
+		seen = 0
+		for bound, count in zip(LATENCY_BUCKETS, self.histogram):
+			seen += count
+			if seen >= target:
+				return bound
+		return self.max_time
+
+
+@dataclass(slots=True, frozen=True)
+class SlowQuery:
+	"""A query that took longer than the threshold, with the plan of running it again."""
+
+	name: str
+	query: str
+	duration: float
+	captured_at: datetime.datetime
+	plan: str
+
+
+class DatabaseUnavailable(commands.CommandError):
+	"""Raised instead of running a query while the database is considered down, see `CircuitBreaker`."""
+
+
+class CircuitBreaker:
+	def __init__(
+		self,
+		*,
+		failure_threshold: int = 5,
+		latency_threshold: float = 5.0,
+		reset_timeout: float = 10.0,
+		half_open_probes: int = 1,
+	):
+		"""Stops sending queries to a database that keeps failing, so they fail fast instead of piling up.
+
+		The breaker is closed while the database is healthy. After ``failure_threshold`` queries in a row failed to
+		reach it or took longer than ``latency_threshold``, it opens and every query raises `DatabaseUnavailable`
+		right away. After ``reset_timeout``, it is half-open: up to ``half_open_probes`` queries at a time are let
+		through to probe the database. It closes again if one of them succeeds, and opens again if one fails. A query that
+		timed out because its command ran out of time isn't counted, see `core.deadline`.
+
+		Parameters
+		----------
+		failure_threshold: `int`
+			The number of failed queries in a row that opens the breaker.
+		latency_threshold: `float`
+			The duration above which a query counts as failed, in seconds, even if it returned.
+		reset_timeout: `float`
+			The time the breaker stays open before probing the database, in seconds.
+		half_open_probes: `int`
+			The number of queries let through at a time while half-open.
+		"""
+		self.failure_threshold = failure_threshold
+		self.latency_threshold = latency_threshold
+		self.reset_timeout = reset_timeout
+		self.half_open_probes = half_open_probes
+		self.state: Literal["closed", "open", "half-open"] = "closed"
+		self.failures = 0
+		self.trips = 0
+		self.opened_at = 0.0
+		self._probing = 0
+
+	@property
+	def available(self) -> bool:
+		"""Whether a query would be let through right now, without letting one through."""
+		if self.state == "open":
+			return monotonic() - self.opened_at >= self.reset_timeout
+		return self.state == "closed" or self._probing < self.half_open_probes
+
+	def _admit(self) -> bool:
+		if self.state == "open":
+			if monotonic() - self.opened_at < self.reset_timeout:
+				raise DatabaseUnavailable("The database is unavailable")
+			self.state = "half-open"
+		if self.state == "half-open":
+			if self._probing >= self.half_open_probes:
+				raise DatabaseUnavailable("The database is unavailable")
+			self._probing += 1
+			return True
+		return False
+
+	def _record(self, healthy: bool) -> None:
+		if healthy:
+			if self.state == "half-open":
+				logger.info(
+					f"Database recovered after {monotonic() - self.opened_at:.0f}s, closing the circuit breaker"
+				)
+				self.state = "closed"
+			if self.state == "closed":
+				self.failures = 0
+			return
+		self.failures += 1
+		if self.state == "half-open" or (self.state == "closed" and self.failures >= self.failure_threshold):
+			if self.state == "closed":
+				self.trips += 1
+				logger.error(f"Database failed {self.failures} times in a row, opening the circuit breaker")
+			self.state = "open"
+			self.opened_at = monotonic()
+
+	@contextlib.contextmanager
+	def guard(self) -> Iterator[None]:
+		"""
+		Wraps a query, raising `DatabaseUnavailable` before it starts if the breaker doesn't let it through.
+
+		Raises
+		------
+		DatabaseUnavailable
+			If the breaker is open, or half-open with enough probes running already.
+		"""
+		probe = self._admit()
+		start = monotonic()
+		healthy: Optional[bool] = None
+		try:
+			yield
+			healthy = monotonic() - start < self.latency_threshold
+		except _TIMEOUT_ERRORS:
+			# a query cut off by the command's deadline rather than its own timeout says nothing about the database
+			healthy = None if deadline.expired() else False
+			raise
+		except _OUTAGE_ERRORS:
+			healthy = False
+			raise
+		except asyncpg.PostgresError:
+			healthy = True  # the server answered, the query was wrong
+			raise
+		finally:
+			if probe:
+				self._probing -= 1
+			# a cancelled query says nothing about the database
+			if healthy is not None:
+				self._record(healthy)
+
+
+class InstrumentedPool:
+	def __init__(
+		self,
+		pool: asyncpg.Pool,
+		*,
+		slow_query_threshold: float = 0.25,
+		explain_interval: float = 60.0,
+		slow_query_capacity: int = 50,
+		breaker: Optional[CircuitBreaker] = None,
+		acquire_timeout: Optional[float] = None,
+	):
+		"""Wraps an `asyncpg.Pool` and records the latency, rows and pool wait time of every query.
+
+		Queries are grouped by their name in `STATEMENTS`, or by their text if they aren't registered. Recording a
+		query costs a few counter updates, the histogram lookup is a binary search over `LATENCY_BUCKETS`.
+
+		Queries slower than ``slow_query_threshold`` are explained in the background and kept in `slow_queries`.
+		Read-only queries are explained with ``ANALYZE, BUFFERS`` in a transaction that is rolled back, the others
+		only get their estimated plan so they don't run twice.
+
+		Inside a command, queries and waits for a connection time out at its deadline, see `core.deadline`.
+
+		With a ``breaker``, queries fail fast with `DatabaseUnavailable` while the database is down. Together with an
+		``acquire_timeout``, this keeps callers from queueing up on the pool without bound during an outage.
+
+		Everything this class doesn't define, like `acquire`, goes straight to the pool.
+
+		Parameters
+		----------
+		pool: `asyncpg.Pool`
+			The pool to wrap.
+		slow_query_threshold: `float`
+			The duration above which a query is explained, in seconds.
+		explain_interval: `float`
+			The minimum time between two explanations of the same statement, in seconds.
+		slow_query_capacity: `int`
+			The number of slow queries to keep, the oldest ones are dropped first.
+		breaker: Optional[`CircuitBreaker`]
+			The circuit breaker guarding the queries.
+		acquire_timeout: Optional[`float`]
+			The longest a query waits for a free connection, in seconds.
+		"""
+		self.pool = pool
+		self.breaker = breaker
+		self.acquire_timeout = acquire_timeout
+		self.slow_query_threshold = slow_query_threshold
+		self.explain_interval = explain_interval
+		self.stats: dict[str, StatementStats] = {}
+		self.slow_queries: deque[SlowQuery] = deque(maxlen=slow_query_capacity)
+		self._last_explained: dict[str, float] = {}
+		self._explaining: set[asyncio.Task] = set()
+
+	def __getattr__(self, name: str) -> Any:
+		return getattr(self.pool, name)
+
+	def _record(self, query: str, wait: float, duration: float, rows: int, args: Optional[tuple]) -> None:
+		name = _STATEMENT_NAMES.get(query) or " ".join(query.split())[:100]
+		stats = self.stats.get(name)
+		if stats is None:
+			stats = self.stats[name] = StatementStats(name)
+		stats.calls += 1
+		stats.total_time += duration
+		stats.total_wait += wait
+		stats.rows += rows
+		stats.histogram[bisect_left(LATENCY_BUCKETS, duration)] += 1
+		if duration > stats.max_time:
+			stats.max_time = duration
+
+		if duration >= self.slow_query_threshold and args is not None and _EXPLAINABLE.match(query):
+			now = monotonic()
+			if now - self._last_explained.get(name, -self.explain_interval) >= self.explain_interval:
+				self._last_explained[name] = now
+				task = asyncio.create_task(self._explain(name, query, duration, args))
+				self._explaining.add(task)
+				task.add_done_callback(self._explaining.discard)
+
+	async def _explain(self, name: str, query: str, duration: float, args: tuple) -> None:
+		# running a write again would apply it twice, even though the transaction is read-only as a safeguard
+		options = "COSTS" if _WRITES.search(query) else "ANALYZE, BUFFERS"
+		try:
+			async with self.pool.acquire() as connection:
+				transaction = connection.transaction(readonly=True)
+				await transaction.start()
+				try:
+					rows = await connection.fetch(f"EXPLAIN ({options}) {query}", *args)
+				finally:
+					await transaction.rollback()
+		except Exception as e:  # an explanation is best effort, it must never break the query it explains
+			logger.warning(f"Couldn't explain slow query {name}: {e}")
+			return
+		plan = "\n".join(row[0] for row in rows)
+		self.slow_queries.append(SlowQuery(name, query, duration, datetime.datetime.now(datetime.UTC), plan))
+		logger.warning(f"Slow query {name} took {duration * 1000:.0f}ms")
+
+	def _guard(self) -> contextlib.AbstractContextManager:
+		return self.breaker.guard() if self.breaker else contextlib.nullcontext()
+
+	async def _run(self, method: str, query: str, args: tuple, timeout: Optional[float]) -> Any:
+		with self._guard():
+			start = perf_counter()
+			async with self.pool.acquire(timeout=deadline.timeout(self.acquire_timeout)) as connection:
+				acquired = perf_counter()
+				result = await getattr(connection, method)(query, *args, timeout=deadline.timeout(timeout))
+				end = perf_counter()
+
+		if method == "fetch":
+			rows = len(result)
+		elif method == "execute":
+			count = result.rpartition(" ")[2]
+			rows = int(count) if count.isdigit() else 0
+		else:
+			rows = int(result is not None)
+		self._record(query, acquired - start, end - acquired, rows, args)
+		return result
+
+	async def fetch(self, query: str, *args: Any, timeout: Optional[float] = None) -> list[asyncpg.Record]:
+		return await self._run("fetch", query, args, timeout)
+
+	async def fetchrow(self, query: str, *args: Any, timeout: Optional[float] = None) -> Optional[asyncpg.Record]:
+		return await self._run("fetchrow", query, args, timeout)
+
+	async def fetchval(self, query: str, *args: Any, timeout: Optional[float] = None) -> Any:
+		return await self._run("fetchval", query, args, timeout)
+
+	async def execute(self, query: str, *args: Any, timeout: Optional[float] = None) -> str:
+		return await self._run("execute", query, args, timeout)
+
+	async def executemany(self, query: str, args: Iterable[Iterable[Any]], *, timeout: Optional[float] = None) -> None:
+		with self._guard():
+			start = perf_counter()
+			async with self.pool.acquire(timeout=deadline.timeout(self.acquire_timeout)) as connection:
+				acquired = perf_counter()
+				await connection.executemany(query, args, timeout=deadline.timeout(timeout))
+				end = perf_counter()
+		# the parameters may be an exhausted iterator by now, so a slow executemany isn't explained
+		self._record(query, acquired - start, end - acquired, 0, None)
+
+	async def copy_records_to_table(self, table_name: str, *, records: Iterable[tuple], **kwargs: Any) -> str:
+		records = list(records)
+		with self._guard():
+			start = perf_counter()
+			async with self.pool.acquire(timeout=deadline.timeout(self.acquire_timeout)) as connection:
+				acquired = perf_counter()
+				kwargs.setdefault("timeout", deadline.timeout())
+				result = await connection.copy_records_to_table(table_name, records=records, **kwargs)
+				end = perf_counter()
+		self._record(f"COPY {table_name}", acquired - start, end - acquired, len(records), None)
+		return result
+
+	def top(self, limit: int = 10) -> list[StatementStats]:
+		"""
+		Returns the statements that took the most time in total.
+
+		Parameters
+		----------
+		limit: `int`
+			The number of statements to return.
+
+		Returns
+		-------
+		list[`StatementStats`]
+			The statements, slowest first.
+		"""
+		return sorted(self.stats.values(), key=lambda stats: stats.total_time, reverse=True)[:limit]
+
+	def reset(self) -> None:
+		"""Forgets the recorded statistics and slow queries."""
+		self.stats.clear()
+		self.slow_queries.clear()
+		self._last_explained.clear()
@@ -0,0 +1,103 @@
+"""Time budgets for commands, so a hung query or request can't hold a command and its interaction forever.
+
+`MyClient.before_invoke` sets the deadline of every command in `current_deadline`. The database pool and
+`MyClient.session` read it to time their calls out when the budget runs out, and tasks the command starts inherit it.
+A command gets `DEFAULT_DEADLINE` seconds, unless its cog sets a ``deadline`` attribute or the command sets one in its
+``extras``, e.g. ``@commands.hybrid_command(extras={"deadline": 120})``.
+"""
+
+from contextvars import ContextVar
+from time import monotonic
+from typing import Any, Optional
+
+import aiohttp
+from discord.ext import commands
+
+DEFAULT_DEADLINE = 30.0
+GRACE_PERIOD = 1.0
+"""How long after its deadline a command that hasn't timed out by itself is cancelled, in seconds."""
+
+current_deadline: ContextVar[Optional[float]] = ContextVar("current_deadline", default=None)
+"""The `time.monotonic` time by which the running command has to be done, or None outside of commands."""
+
+
+class DeadlineExceeded(commands.CommandError):
+	"""Raised when a command ran out of time."""
+
+
+def remaining() -> Optional[float]:
+	"""Returns the seconds left until the running command's deadline, or None if there is no deadline."""
+	deadline = current_deadline.get()
+	return None if deadline is None else deadline - monotonic()
+
+
+def expired() -> bool:
+	"""Returns whether the running command's deadline has passed."""
+	left = remaining()
+	return left is not None and left <= 0
+
+
+def timeout(default: Optional[float] = None) -> Optional[float]:
+	"""
+	Returns the timeout to use for a call: the time left until the deadline, or ``default`` if it is shorter.
+
+	Parameters
+	----------
+	default: Optional[`float`]
+		The timeout to use outside of commands, in seconds. None means no timeout.
+
+	Returns
+	-------
+	Optional[`float`]
+		The timeout, in seconds.
+
+	Raises
+	------
+	DeadlineExceeded
+		If the deadline has passed already, so the call isn't started at all.
+	"""
+	left = remaining()
+	if left is None:
+		return default
+	if left <= 0:
+		raise DeadlineExceeded("The command ran out of time")
+	return left if default is None else min(left, default)
+
+
+class DeadlineSession:
+	def __init__(self, session: aiohttp.ClientSession):
+		"""Wraps an `aiohttp.ClientSession` so its requests time out at the running command's deadline.
+
+		A request that passes its own ``timeout`` keeps it. Everything else goes straight to the session.
+
+		Parameters
+		----------
+		session: `aiohttp.ClientSession`
+			The session to wrap.
+		"""
+		self.session = session
+
+	def __getattr__(self, name: str) -> Any:
+		return getattr(self.session, name)
+
+	def request(self, method: str, url: Any, **kwargs: Any) -> Any:
+		if "timeout" not in kwargs:
+			left = timeout()
+			if left is not None:
+				kwargs["timeout"] = aiohttp.ClientTimeout(total=left)
+		return self.session.request(method, url, **kwargs)
+
+	def get(self, url: Any, **kwargs: Any) -> Any:
+		return self.request("GET", url, **kwargs)
+
+	def post(self, url: Any, **kwargs: Any) -> Any:
+		return self.request("POST", url, **kwargs)
+
+	def put(self, url: Any, **kwargs: Any) -> Any:
+		return self.request("PUT", url, **kwargs)
+
+	def patch(self, url: Any, **kwargs: Any) -> Any:
+		return self.request("PATCH", url, **kwargs)
+
+	def delete(self, url: Any, **kwargs: Any) -> Any:
+		return self.request("DELETE", url, **kwargs)
@@ -0,0 +1,241 @@
+"""Reports unknown errors and rate limits to the developers, without letting an error storm turn into a REST storm."""
+
+import asyncio
+import hashlib
+import io
+import traceback
+from collections import Counter
+from dataclasses import dataclass, field
+from logging import getLogger
+from time import monotonic
+from typing import Optional
+
+import discord
+from discord.ext import commands
+
+logger = getLogger(__name__)
+
+REPORT_CHANNEL_ID = 1268260404677574697
+MAX_INLINE_STACK = 1700
+"""Stack traces longer than this are attached as a file instead of being sent in the message."""
+
+
+def fingerprint(error: BaseException) -> str:
+	"""
+	Identifies an error by its type and where it was raised, so the same bug with different values groups together.
+
+	Parameters
+	----------
+	error: `BaseException`
+		The error to fingerprint.
+
+	Returns
+	-------
+	`str`
+		A short hash of the error type and the frames of its traceback.
+	"""
+	frames = traceback.extract_tb(error.__traceback__)
+	key = f"{type(error).__module__}.{type(error).__qualname__}|" + "|".join(
+		f"{frame.filename}:{frame.name}:{frame.lineno}" for frame in frames
+	)
+	return hashlib.sha1(key.encode(), usedforsecurity=False).hexdigest()[:12]
+
+
+@dataclass(slots=True)
+class Report:
+	"""An error waiting to be sent."""
+
+	channel_id: int
+	webhook_name: str
+	fingerprint: str
+	content: str
+	stack: Optional[str] = None
+
+
+@dataclass(slots=True)
+class DigestEntry:
+	"""The repeats of a reported error since the last digest."""
+
+	summary: str
+	first_report: str
+	count: int = 0
+
+
+@dataclass(slots=True)
+class Digest:
+	"""The repeated errors of one webhook since the last digest."""
+
+	entries: dict[str, DigestEntry] = field(default_factory=dict)
+	dropped: int = 0
+
+
+class ErrorReporter:
+	def __init__(
+		self,
+		client: commands.Bot,
+		channel_id: int = REPORT_CHANNEL_ID,
+		*,
+		digest_interval: float = 60.0,
+		queue_size: int = 100,
+	):
+		"""Sends error reports to webhooks from a background task.
+
+		`report` only puts the report in a bounded queue, so the failing command never waits on Discord. The first
+		occurrence of an error is sent right away with its stack trace. Its repeats, identified by `fingerprint`, are
+		only counted, and sent as one digest every ``digest_interval`` seconds. The webhooks are looked up or created
+		once and cached, and long stack traces are attached from memory.
+
+		Parameters
+		----------
+		client: `commands.Bot`
+			The bot the errors happen in.
+		channel_id: `int`
+			The channel the reports are sent to, unless a report names another one.
+		digest_interval: `float`
+			The time between two digests of repeated errors, in seconds.
+		queue_size: `int`
+			The number of reports that can wait to be sent. Reports beyond that are only counted in the digest.
+		"""
+		self.client = client
+		self.channel_id = channel_id
+		self.digest_interval = digest_interval
+		self.queue: asyncio.Queue[Report] = asyncio.Queue(maxsize=queue_size)
+		self.reported: Counter[str] = Counter()
+		self._first_reports: dict[str, str] = {}
+		self._digests: dict[tuple[int, str], Digest] = {}
+		self._webhooks: dict[tuple[int, str], discord.Webhook] = {}
+		self._avatar: Optional[bytes] = None
+		self._task: Optional[asyncio.Task] = None
+
+	def start(self) -> None:
+		"""Starts sending the queued reports in the background."""
+		if self._task is None or self._task.done():
+			self._task = asyncio.create_task(self._worker())
+
+	async def stop(self) -> None:
+		"""Stops the background task, sending the pending digests first."""
+		if self._task:
+			self._task.cancel()
+			try:
+				await self._task
+			except asyncio.CancelledError:
+				pass
+			self._task = None
+		await self._send_digests()
+
+	def report(
+		self,
+		error: BaseException,
+		content: str,
+		*,
+		webhook_name: str,
+		channel_id: Optional[int] = None,
+		report_id: Optional[int] = None,
+		with_stack: bool = True,
+	) -> None:
+		"""
+		Queues an error report. Never blocks and never raises.
+
+		Parameters
+		----------
+		error: `BaseException`
+			The error to report.
+		content: `str`
+			The message describing where the error happened, e.g. the guild, user and command.
+		webhook_name: `str`
+			The name of the webhook to send the report with, reports are grouped by it.
+		channel_id: Optional[`int`]
+			The channel to send the report to, instead of the default one.
+		report_id: Optional[`int`]
+			The ID users can refer to the report with, shown in the digest.
+		with_stack: `bool`
+			Whether to include the stack trace.
+		"""
+		key = fingerprint(error)
+		channel_id = channel_id or self.channel_id
+		summary = f"{type(error).__name__}: {error}"[:200]
+		self.reported[key] += 1
+
+		digest = self._digests.setdefault((channel_id, webhook_name), Digest())
+		if key in self._first_reports:
+			# reported already, the digest is enough
+			entry = digest.entries.setdefault(key, DigestEntry(summary, self._first_reports[key]))
+			entry.count += 1
+			entry.summary = summary
+			return
+		self._first_reports[key] = str(report_id) if report_id else key
+
+		stack = "".join(traceback.format_exception(type(error), error, error.__traceback__)) if with_stack else None
+		try:
+			self.queue.put_nowait(Report(channel_id, webhook_name, key, content, stack))
+		except asyncio.QueueFull:
+			digest.dropped += 1
+
+	async def _worker(self) -> None:
+		next_digest = monotonic() + self.digest_interval
+		while True:
+			try:
+				report = await asyncio.wait_for(self.queue.get(), timeout=max(next_digest - monotonic(), 0))
+			except asyncio.TimeoutError:
+				await self._send_digests()
+				next_digest = monotonic() + self.digest_interval
+				continue
+			try:
+				await self._send(report)
+			except Exception as e:  # the reporter must keep running, even if Discord doesn't take the report
+				logger.error(f"Failed to send error report {report.fingerprint}: {e}")
+
+	async def _webhook(self, channel_id: int, name: str) -> discord.Webhook:
+		webhook = self._webhooks.get((channel_id, name))
+		if webhook is not None:
+			return webhook
+		channel = self.client.get_channel(channel_id) or await self.client.fetch_channel(channel_id)
+		webhook = discord.utils.get(await channel.webhooks(), name=name)  # type: ignore
+		if not webhook:
+			if self._avatar is None and self.client.user:
+				self._avatar = await self.client.user.display_avatar.read()
+			webhook = await channel.create_webhook(name=name, avatar=self._avatar)  # type: ignore
+		self._webhooks[(channel_id, name)] = webhook
+		return webhook
+
+	async def _post(self, channel_id: int, name: str, content: str, file: Optional[discord.File] = None) -> None:
+		webhook = await self._webhook(channel_id, name)
+		try:
+			await webhook.send(content=content, file=file or discord.utils.MISSING)
+		except discord.NotFound:
+			# the webhook was deleted since it was cached
+			del self._webhooks[(channel_id, name)]
+			if file:
+				file.reset()
+			await (await self._webhook(channel_id, name)).send(content=content, file=file or discord.utils.MISSING)
+
+	async def _send(self, report: Report) -> None:
+		file = None
+		content = report.content
+		if report.stack is not None:
+			if len(report.stack) > MAX_INLINE_STACK:
+				file = discord.File(io.BytesIO(report.stack.encode()), filename="error.txt")
+				content += "\n```The stack trace was too long to send in a message, so it was attached as a file.```"
+			else:
+				content += f"\n```{report.stack}```"
+		await self._post(report.channel_id, report.webhook_name, content, file)
+
+	async def _send_digests(self) -> None:
+		digests, self._digests = self._digests, {}
+		for (channel_id, name), digest in digests.items():
+			if not digest.entries and not digest.dropped:
+				continue
+			lines = [f"# Error digest\nRepeated errors in the last {self.digest_interval:.0f}s:"]
+			for key, entry in sorted(digest.entries.items(), key=lambda item: item[1].count, reverse=True):
+				lines.append(f"**{entry.count}x** `{key}` {entry.summary} (first report: `{entry.first_report}`)")
+			if digest.dropped:
+				lines.append(f"**{digest.dropped}** reports were dropped because the queue was full.")
+			content = "\n".join(lines)
+			file = None
+			if len(content) > 2000:
+				file = discord.File(io.BytesIO(content.encode()), filename="digest.txt")
+				content = lines[0]
+			try:
+				await self._post(channel_id, name, content, file)
+			except Exception as e:
+				logger.error(f"Failed to send error digest: {e}")
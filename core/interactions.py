@@ -0,0 +1,406 @@
+"""Receives slash commands over HTTP, so they don't depend on a gateway connection.
+
+When an interactions endpoint URL is set in the developer portal, Discord POSTs every interaction to it instead of
+sending it over the gateway. Running ``main.py`` with ``INTERACTIONS_PORT`` set starts a worker that logs in over REST,
+loads the cogs and serves that endpoint with an `InteractionServer`, without connecting to the gateway. The workers
+keep nothing between requests, so any number of them can run behind a load balancer, next to the gateway processes
+that handle the messages and events.
+
+Every request is signed with the application's Ed25519 key and checked against its public key (``DISCORD_PUBLIC_KEY``).
+The interaction is then dispatched like one from the gateway, so the hybrid commands, `Context` and the custom responses
+work unchanged, and they respond through the interaction callback like they always do. The request is held open until
+the interaction was responded to, or for `InteractionServer.response_timeout` seconds.
+
+`InteractionStandIn` signs and posts interactions to a worker and plays the Discord API the worker responds to, to try
+the worker out without an application.
+"""
+
+import asyncio
+import itertools
+import json
+import time
+from logging import getLogger
+from typing import TYPE_CHECKING, Any, Optional
+
+import discord
+from aiohttp import ClientSession
+
+from helpers import LazyModule
+
+if TYPE_CHECKING:
+	from core.bot import MyClient
+
+logger = getLogger(__name__)
+
+web = LazyModule("aiohttp.web")  # only the interaction workers serve HTTP
+# PyNaCl is an optional dependency, only the interaction workers need it
+nacl_signing = LazyModule("nacl.signing")
+nacl_exceptions = LazyModule("nacl.exceptions")
+
+PING = 1
+PONG = 1
+
+
+def verify_signature(public_key: str, signature: str, timestamp: str, body: bytes) -> bool:
+	"""
+	Checks that an interaction request was signed by Discord.
+
+	Parameters
+	----------
+	public_key: `str`
+		The application's public key, in hex.
+	signature: `str`
+		The ``X-Signature-Ed25519`` header, in hex.
+	timestamp: `str`
+		The ``X-Signature-Timestamp`` header, signed together with the body.
+	body: `bytes`
+		The raw request body.
+
+	Returns
+	-------
+	`bool`
+		Whether the signature is valid.
+	"""
+	try:
+		nacl_signing.VerifyKey(bytes.fromhex(public_key)).verify(timestamp.encode() + body, bytes.fromhex(signature))
+	except (ValueError, nacl_exceptions.BadSignatureError):
+		return False
+	return True
+
+
+def use_api(base: str) -> None:
+	"""Sends every REST request to another API, e.g. an `InteractionStandIn`, instead of Discord's."""
+	discord.http.Route.BASE = base
+	discord.webhook.async_.Route.BASE = base
+
+
+class InteractionServer:
+	def __init__(
+		self,
+		client: "MyClient",
+		public_key: str,
+		*,
+		host: str = "0.0.0.0",
+		port: int = 8080,
+		path: str = "/interactions",
+		response_timeout: float = 2.5,
+	):
+		"""Serves the interactions endpoint and dispatches the interactions to the client.
+
+		Parameters
+		----------
+		client: `MyClient`
+			The client, logged in and set up but not necessarily connected to the gateway.
+		public_key: `str`
+			The application's public key, in hex.
+		host: `str`
+			The address to listen on.
+		port: `int`
+			The port to listen on. Several workers on the same machine can share it.
+		path: `str`
+			The path of the endpoint.
+		response_timeout: `float`
+			How long to hold a request open for the response, in seconds. Discord waits 3 seconds at most.
+		"""
+		try:
+			nacl_signing.VerifyKey
+		except ImportError as e:
+			raise RuntimeError("Receiving interactions over HTTP requires PyNaCl: pip install pynacl") from e
+		self.client = client
+		self.public_key = public_key
+		self.host = host
+		self.port = port
+		self.path = path
+		self.response_timeout = response_timeout
+		self.received = 0
+		self.rejected = 0
+		self.unanswered = 0
+		self._pending: dict[int, asyncio.Future[discord.Interaction]] = {}
+		self._runner: Optional[web.AppRunner] = None
+		self._closed = asyncio.Event()
+
+	async def start(self) -> None:
+		"""Starts listening for interactions."""
+		self.client.add_listener(self.on_interaction)
+		app = web.Application()
+		app.router.add_post(self.path, self.handle)
+		self._runner = web.AppRunner(app, access_log=None)
+		await self._runner.setup()
+		site = web.TCPSite(self._runner, self.host, self.port, reuse_port=True)
+		await site.start()
+		logger.info(f"Receiving interactions on http://{self.host}:{self.port}{self.path}")
+
+	async def stop(self) -> None:
+		"""Stops listening, after answering the requests in progress."""
+		if self._runner:
+			await self._runner.cleanup()
+			self._runner = None
+		self.client.remove_listener(self.on_interaction)
+		self._closed.set()
+
+	async def wait_closed(self) -> None:
+		"""Waits until the server is stopped."""
+		await self._closed.wait()
+
+	async def handle(self, request: "web.Request") -> "web.StreamResponse":
+		body = await request.read()
+		signature = request.headers.get("X-Signature-Ed25519")
+		timestamp = request.headers.get("X-Signature-Timestamp")
+		if not signature or not timestamp or not verify_signature(self.public_key, signature, timestamp, body):
+			# Discord sends requests with invalid signatures to check that they're rejected
+			self.rejected += 1
+			return web.Response(status=401, text="invalid request signature")
+		try:
+			data = json.loads(body)
+		except ValueError:
+			return web.Response(status=400, text="invalid JSON")
+		self.received += 1
+		if data.get("type") == PING:
+			return web.json_response({"type": PONG})
+		interaction = await self.dispatch(data)
+		if interaction is None or not interaction.response.is_done():
+			self.unanswered += 1
+		# the response was sent through the interaction callback, there's nothing left to respond with
+		return web.Response(status=202)
+
+	async def dispatch(self, data: dict[str, Any]) -> Optional[discord.Interaction]:
+		"""
+		Dispatches an interaction like the gateway would, then waits until it's responded to.
+
+		Parameters
+		----------
+		data: dict[`str`, Any]
+			The interaction, as Discord sent it.
+
+		Returns
+		-------
+		Optional[`discord.Interaction`]
+			The interaction, or None if it wasn't dispatched in time.
+		"""
+		interaction_id = int(data["id"])
+		future = asyncio.get_running_loop().create_future()
+		self._pending[interaction_id] = future
+		deadline = time.monotonic() + self.response_timeout
+		try:
+			self.client._connection.parse_interaction_create(data)
+			interaction = await asyncio.wait_for(future, timeout=self.response_timeout)
+		except TimeoutError:
+			return None
+		finally:
+			self._pending.pop(interaction_id, None)
+		while not interaction.response.is_done() and time.monotonic() < deadline:
+			await asyncio.sleep(0.02)
+		return interaction
+
+	async def on_interaction(self, interaction: discord.Interaction) -> None:
+		future = self._pending.get(interaction.id)
+		if future and not future.done():
+			future.set_result(interaction)
+
+
+class InteractionStandIn:
+	def __init__(self, *, host: str = "127.0.0.1", port: int = 8090):
+		"""Stands in for Discord in front of an interactions worker, to try it out without an application.
+
+		It signs interactions with a key of its own and serves the few API routes a worker uses: logging in and
+		responding to interactions. Start it, run the worker with ``DISCORD_PUBLIC_KEY`` set to `public_key` and
+		``DISCORD_API_BASE`` set to `api_base`, then `send` it commands and look at what it responded.
+
+		Parameters
+		----------
+		host: `str`
+			The address to serve the API on.
+		port: `int`
+			The port to serve the API on.
+		"""
+		self.host = host
+		self.port = port
+		self.signing_key = nacl_signing.SigningKey.generate()
+		self.application_id = 1
+		self.responses: dict[int, list[dict[str, Any]]] = {}
+		self._ids = itertools.count(int(time.time() * 1000 - discord.utils.DISCORD_EPOCH) << 22)
+		self._runner: Optional[web.AppRunner] = None
+
+	@property
+	def public_key(self) -> str:
+		return self.signing_key.verify_key.encode().hex()
+
+	@property
+	def api_base(self) -> str:
+		return f"http://{self.host}:{self.port}/api/v10"
+
+	async def start(self) -> None:
+		"""Starts serving the API."""
+		app = web.Application()
+		app.router.add_get("/api/v10/users/@me", self._user)
+		app.router.add_get("/api/v10/oauth2/applications/@me", self._application)
+		app.router.add_post("/api/v10/interactions/{id}/{token}/callback", self._respond)
+		app.router.add_route("*", "/api/v10/webhooks/{application_id}/{token}{tail:.*}", self._respond)
+		self._runner = web.AppRunner(app, access_log=None)
+		await self._runner.setup()
+		await web.TCPSite(self._runner, self.host, self.port).start()
+
+	async def stop(self) -> None:
+		if self._runner:
+			await self._runner.cleanup()
+			self._runner = None
+
+	@staticmethod
+	def _json(data: dict[str, Any]) -> "web.Response":
+		# discord.py only parses the body if the content type is exactly this, without a charset
+		return web.Response(body=json.dumps(data).encode(), content_type="application/json")
+
+	def _user_data(self, user_id: int) -> dict[str, Any]:
+		return {"id": str(user_id), "username": f"user{user_id}", "discriminator": "0", "avatar": None}
+
+	async def _user(self, request: "web.Request") -> "web.Response":
+		return self._json({**self._user_data(self.application_id), "bot": True})
+
+	async def _application(self, request: "web.Request") -> "web.Response":
+		return self._json(
+			{
+				"id": str(self.application_id),
+				"name": "Stand-in",
+				"description": "",
+				"icon": None,
+				"bot_public": False,
+				"bot_require_code_grant": False,
+				"owner": self._user_data(self.application_id + 1),
+				"verify_key": self.public_key,
+			}
+		)
+
+	def _message(self, content: Optional[str]) -> dict[str, Any]:
+		return {
+			"id": str(next(self._ids)),
+			"channel_id": "0",
+			"type": 0,
+			"content": content or "",
+			"author": {**self._user_data(self.application_id), "bot": True},
+			"attachments": [],
+			"embeds": [],
+			"mentions": [],
+			"mention_roles": [],
+			"pinned": False,
+			"mention_everyone": False,
+			"tts": False,
+			"timestamp": discord.utils.utcnow().isoformat(),
+			"edited_timestamp": None,
+			"flags": 0,
+		}
+
+	async def _respond(self, request: "web.Request") -> "web.Response":
+		# the interaction ID is the start of the token, see `send`
+		interaction_id = int(request.match_info["token"].split(".")[0])
+		body = await request.json() if request.can_read_body else {}
+		self.responses.setdefault(interaction_id, []).append(
+			{"method": request.method, "path": request.path, "body": body}
+		)
+		message = self._message(body.get("content") or body.get("data", {}).get("content"))
+		if not request.path.endswith("/callback"):
+			return self._json(message)
+		data = body.get("data", {})
+		return self._json(
+			{
+				"interaction": {
+					"id": str(interaction_id),
+					"type": 2,
+					"response_message_id": message["id"],
+					"response_message_loading": body["type"] == 5,
+					"response_message_ephemeral": bool(data.get("flags", 0) & 64),
+				},
+				"resource": {"type": body["type"], "message": message},
+			}
+		)
+
+	async def send(
+		self,
+		url: str,
+		command: str,
+		options: Optional[list[dict[str, Any]]] = None,
+		*,
+		user_id: int = 2,
+		guild_id: Optional[int] = None,
+		channel_id: int = 3,
+		locale: str = "en-US",
+	) -> tuple[int, list[dict[str, Any]]]:
+		"""
+		Signs a slash command and posts it to a worker.
+
+		Parameters
+		----------
+		url: `str`
+			The worker's interactions endpoint.
+		command: `str`
+			The name of the command.
+		options: Optional[list[dict[`str`, Any]]]
+			The command's options, as Discord sends them, e.g. ``[{"name": "user", "type": 6, "value": "2"}]``.
+		user_id: `int`
+			The ID of the user running the command.
+		guild_id: Optional[`int`]
+			The ID of the guild it's run in, or None to run it in DMs.
+		channel_id: `int`
+			The ID of the channel it's run in.
+		locale: `str`
+			The user's locale.
+
+		Returns
+		-------
+		tuple[`int`, list[dict[`str`, Any]]]
+			The status the worker answered with and the requests it made to respond, in order.
+		"""
+		interaction_id = next(self._ids)
+		user = self._user_data(user_id)
+		data: dict[str, Any] = {
+			"id": str(interaction_id),
+			"application_id": str(self.application_id),
+			"type": 2,
+			"token": f"{interaction_id}.stand-in",
+			"version": 1,
+			"locale": locale,
+			"channel_id": str(channel_id),
+			"app_permissions": str(discord.Permissions.all().value),
+			"attachment_size_limit": 10 * 1024 * 1024,
+			"entitlements": [],
+			"authorizing_integration_owners": {"0": str(guild_id)} if guild_id else {"1": str(user_id)},
+			"context": 0 if guild_id else 1,
+			"data": {"id": str(next(self._ids)), "name": command, "type": 1, "options": options or []},
+		}
+		if guild_id:
+			data["channel"] = {
+				"id": str(channel_id),
+				"type": 0,
+				"name": "general",
+				"guild_id": str(guild_id),
+				"position": 0,
+				"permission_overwrites": [],
+				"nsfw": False,
+				"parent_id": None,
+				"permissions": data["app_permissions"],
+			}
+			data["guild_id"] = str(guild_id)
+			data["guild_locale"] = locale
+			data["member"] = {
+				"user": user,
+				"roles": [],
+				"joined_at": discord.utils.utcnow().isoformat(),
+				"deaf": False,
+				"mute": False,
+				"flags": 0,
+				"permissions": data["app_permissions"],
+			}
+		else:
+			data["channel"] = {"id": str(channel_id), "type": 1, "recipients": [user], "last_message_id": None}
+			data["user"] = user
+		body = json.dumps(data).encode()
+		timestamp = str(int(time.time()))
+		signature = self.signing_key.sign(timestamp.encode() + body).signature.hex()
+		headers = {
+			"X-Signature-Ed25519": signature,
+			"X-Signature-Timestamp": timestamp,
+			"Content-Type": "application/json",
+		}
+		async with ClientSession() as session:
+			async with session.post(url, data=body, headers=headers) as response:
+				status = response.status
+		return status, self.responses.get(interaction_id, [])
@@ -0,0 +1,336 @@
+"""Keeps the settings cached in memory in sync with the database, across every bot process.
+
+Triggers on the cached tables (see ``migrations/0007_invalidation.sql``) send a Postgres notification for every changed
+row, whether the bot or something else changed it. `InvalidationBus` listens for them on a dedicated connection and
+calls the handlers subscribed to the topic, the name of the table. Handlers evict or refresh what they cached, usually
+a `GuildCache`.
+
+Notifications sent while the bus is disconnected are lost, so after reconnecting, every handler is called with an
+`Invalidation` without a guild ID, meaning that everything of the topic has to go.
+
+The triggers also count the changes to each table and guild in ``invalidation_versions``, so a cache kept over a restart
+can tell whether it missed a change, see `core.resume`.
+"""
+
+import asyncio
+import json
+import secrets
+from dataclasses import dataclass
+from logging import getLogger
+from typing import Any, Awaitable, Callable, Generic, Optional, TypeVar, Union
+
+import asyncpg
+from discord.utils import maybe_coroutine
+
+from core.queries import CONNECTION_ERRORS
+
+logger = getLogger(__name__)
+
+CHANNEL = "invalidation"
+T = TypeVar("T")
+
+
+@dataclass(slots=True, frozen=True)
+class Invalidation:
+	"""A change to cached data."""
+
+	topic: str
+	guild_id: Optional[int] = None
+	"""The guild whose data changed, or None if all of the topic's data has to be dropped."""
+	key: Optional[str] = None
+	"""What changed in the guild, e.g. the user ID of an AFK row, or None if it isn't narrowed down."""
+
+
+Handler = Callable[[Invalidation], Union[Any, Awaitable[Any]]]
+
+
+class InvalidationBus:
+	def __init__(
+		self,
+		connect: Callable[[], Awaitable[asyncpg.Connection]],
+		*,
+		channel: str = CHANNEL,
+		keepalive: float = 30.0,
+		reconnect_delay: float = 1.0,
+		max_reconnect_delay: float = 30.0,
+	):
+		"""Listens for invalidations on a connection of its own and passes them to the subscribed handlers.
+
+		A pool connection can't be used, its listeners would be removed when it's released. The connection is checked
+		every ``keepalive`` seconds, and replaced after a backoff when it's lost.
+
+		Parameters
+		----------
+		connect: Callable[[], Awaitable[`asyncpg.Connection`]]
+			Opens a new connection to the primary database.
+		channel: `str`
+			The notification channel the triggers send to.
+		keepalive: `float`
+			The time between two checks of the connection, in seconds.
+		reconnect_delay: `float`
+			How long to wait before reconnecting the first time, in seconds. Doubled after every failed attempt.
+		max_reconnect_delay: `float`
+			The longest time to wait before reconnecting, in seconds.
+		"""
+		self.connect = connect
+		self.channel = channel
+		self.keepalive = keepalive
+		self.reconnect_delay = reconnect_delay
+		self.max_reconnect_delay = max_reconnect_delay
+		self.handlers: dict[str, list[Handler]] = {}
+		self.received = 0
+		self.resyncs = 0
+		self._connection: Optional[asyncpg.Connection] = None
+		self._connected = asyncio.Event()
+		self._fences: dict[str, asyncio.Future[None]] = {}
+		self._task: Optional[asyncio.Task] = None
+		self._tasks: set[asyncio.Task] = set()
+
+	@property
+	def connected(self) -> bool:
+		return self._connection is not None and not self._connection.is_closed()
+
+	def subscribe(self, topic: str, handler: Handler) -> None:
+		"""
+		Calls a handler for every invalidation of a topic.
+
+		Parameters
+		----------
+		topic: `str`
+			The topic, the name of the table whose rows are cached.
+		handler: Callable[[`Invalidation`], Any]
+			The function or coroutine function that evicts or refreshes the cached data.
+		"""
+		self.handlers.setdefault(topic, []).append(handler)
+
+	def unsubscribe(self, topic: str, handler: Handler) -> None:
+		"""Stops calling a handler, e.g. when its cog is unloaded."""
+		if handler in self.handlers.get(topic, []):
+			self.handlers[topic].remove(handler)
+
+	def start(self) -> None:
+		"""Starts listening in the background."""
+		if self._task is None or self._task.done():
+			self._task = asyncio.create_task(self._listen())
+
+	async def stop(self) -> None:
+		"""Stops listening and closes the connection."""
+		if self._task:
+			self._task.cancel()
+			try:
+				await self._task
+			except asyncio.CancelledError:
+				pass
+			self._task = None
+
+	async def wait_connected(self, timeout: Optional[float] = None) -> bool:
+		"""Waits until the bus listens and has resynced the handlers, returns whether it did within the timeout."""
+		try:
+			await asyncio.wait_for(self._connected.wait(), timeout=timeout)
+		except TimeoutError:
+			return False
+		return True
+
+	async def drain(self) -> None:
+		"""Waits for the handlers that are still running."""
+		while self._tasks:
+			await asyncio.wait(list(self._tasks))
+
+	async def sync(self, timeout: float = 5.0) -> bool:
+		"""
+		Waits until every change committed so far was handled.
+
+		Notifications arrive in the order their transactions committed, so once a notification sent now comes back,
+		the ones before it have been dispatched.
+
+		Parameters
+		----------
+		timeout: `float`
+			How long to wait for the notification, in seconds.
+
+		Returns
+		-------
+		`bool`
+			Whether the handlers caught up, False if the bus isn't connected or the notification didn't come back.
+		"""
+		if not self.connected:
+			return False
+		token = secrets.token_hex(8)
+		future = self._fences[token] = asyncio.get_running_loop().create_future()
+		try:
+			await self._connection.execute("SELECT pg_notify($1, $2)", self.channel, json.dumps({"fence": token}))
+			await asyncio.wait_for(future, timeout=timeout)
+		except (*CONNECTION_ERRORS, asyncpg.PostgresError, TimeoutError) as e:
+			logger.warning(f"Failed to sync the invalidations: {e!r}")
+			return False
+		finally:
+			self._fences.pop(token, None)
+		await self.drain()
+		return True
+
+	def dispatch(self, invalidation: Invalidation) -> None:
+		"""Calls the handlers of an invalidation's topic in the background."""
+		for handler in self.handlers.get(invalidation.topic, []):
+			task = asyncio.create_task(self._call(handler, invalidation))
+			self._tasks.add(task)
+			task.add_done_callback(self._tasks.discard)
+
+	@staticmethod
+	async def _call(handler: Handler, invalidation: Invalidation) -> None:
+		try:
+			await maybe_coroutine(handler, invalidation)
+		except Exception:
+			logger.exception(f"Failed to handle {invalidation}")
+
+	def _notify(self, connection: asyncpg.Connection, pid: int, channel: str, payload: str) -> None:
+		try:
+			data = json.loads(payload)
+			if "fence" in data:  # sent by `sync`
+				if (future := self._fences.get(data["fence"])) and not future.done():
+					future.set_result(None)
+				return
+			invalidation = Invalidation(data["topic"], data.get("guild_id"), data.get("key"))
+		except (ValueError, KeyError, TypeError):
+			logger.warning(f"Ignored a malformed invalidation: {payload}")
+			return
+		self.received += 1
+		self.dispatch(invalidation)
+
+	def _resync(self) -> None:
+		self.resyncs += 1
+		for topic in self.handlers:
+			self.dispatch(Invalidation(topic))
+
+	async def _listen(self) -> None:
+		delay = self.reconnect_delay
+		while True:
+			try:
+				self._connection = await self.connect()
+				lost = asyncio.Event()
+				self._connection.add_termination_listener(lambda connection: lost.set())
+				await self._connection.add_listener(self.channel, self._notify)
+			except (*CONNECTION_ERRORS, asyncpg.PostgresError) as e:
+				logger.warning(f"Failed to listen for invalidations, retrying in {delay:.0f}s: {e}")
+				await self._close()
+				await asyncio.sleep(delay)
+				delay = min(delay * 2, self.max_reconnect_delay)
+				continue
+
+			# whatever was cached before listening may have changed without a notification
+			self._resync()
+			self._connected.set()
+			logger.info("Listening for invalidations")
+			delay = self.reconnect_delay
+			try:
+				while not lost.is_set():
+					try:
+						await asyncio.wait_for(lost.wait(), timeout=self.keepalive)
+					except TimeoutError:
+						# a connection that died without closing its socket doesn't tell the termination listener
+						await self._connection.execute("SELECT 1", timeout=self.keepalive)
+			except (*CONNECTION_ERRORS, asyncpg.PostgresError) as e:
+				logger.warning(f"Lost the invalidation connection: {e}")
+			finally:
+				await self._close()
+			logger.warning("Stopped listening for invalidations, reconnecting")
+
+	async def _close(self) -> None:
+		self._connected.clear()
+		if self._connection is None:
+			return
+		connection, self._connection = self._connection, None
+		try:
+			await asyncio.wait_for(connection.close(), timeout=5)
+		except (*CONNECTION_ERRORS, asyncpg.PostgresError):
+			connection.terminate()
+
+
+class GuildCache(Generic[T]):
+	def __init__(
+		self,
+		load: Callable[[int], Awaitable[T]],
+		*,
+		encode: Optional[Callable[[T], Any]] = None,
+		decode: Optional[Callable[[Any], T]] = None,
+	):
+		"""Caches a value per guild until it's invalidated.
+
+		A value loaded while the cache was invalidated isn't kept, as it may have been read before the change.
+
+		Parameters
+		----------
+		load: Callable[[`int`], Awaitable[T]]
+			Loads the value of a guild, given its ID.
+		encode: Optional[Callable[[T], Any]]
+			Turns a value into JSON to `dump` it, if it isn't JSON already.
+		decode: Optional[Callable[[Any], T]]
+			Turns what `encode` returned back into the value, to `restore` it.
+		"""
+		self.load = load
+		self.encode = encode
+		self.decode = decode
+		self.values: dict[int, T] = {}
+		self.hits = 0
+		self.misses = 0
+		self._generation = 0
+
+	def __len__(self) -> int:
+		return len(self.values)
+
+	def __contains__(self, guild_id: int) -> bool:
+		return guild_id in self.values
+
+	async def get(self, guild_id: int) -> T:
+		"""
+		Returns the value of a guild, loading it if it isn't cached.
+
+		Parameters
+		----------
+		guild_id: `int`
+			The ID of the guild.
+
+		Returns
+		-------
+		T
+			The cached or loaded value.
+		"""
+		if guild_id in self.values:
+			self.hits += 1
+			return self.values[guild_id]
+		self.misses += 1
+		generation = self._generation
+		value = await self.load(guild_id)
+		if generation == self._generation:
+			self.values[guild_id] = value
+		return value
+
+	def invalidate(self, guild_id: Optional[int] = None) -> None:
+		"""
+		Drops the value of a guild, or every value.
+
+		Parameters
+		----------
+		guild_id: Optional[`int`]
+			The ID of the guild, or None to drop everything.
+		"""
+		self._generation += 1
+		if guild_id is None:
+			self.values.clear()
+		else:
+			self.values.pop(guild_id, None)
+
+	def handle(self, invalidation: Invalidation) -> None:
+		"""Drops what an invalidation changed, to subscribe the cache to a topic of the `InvalidationBus` with."""
+		self.invalidate(invalidation.guild_id)
+
+	def dump(self) -> list[tuple[int, Any]]:
+		"""Returns the cached values as JSON, to keep them over a restart."""
+		if self.encode is None:
+			return list(self.values.items())
+		return [(guild_id, self.encode(value)) for guild_id, value in self.values.items()]
+
+	def restore(self, values: list[tuple[int, Any]]) -> None:
+		"""Caches what `dump` returned again, without replacing what was loaded in the meantime."""
+		for guild_id, value in values:
+			if guild_id not in self.values:
+				self.values[guild_id] = self.decode(value) if self.decode else value
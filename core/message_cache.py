@@ -0,0 +1,403 @@
+"""A per-guild message cache that keeps compact records instead of full `discord.Message` objects."""
+
+import asyncio
+from collections import OrderedDict
+from typing import Any, Iterable, Iterator, Optional
+
+import discord
+from discord.shard import AutoShardedConnectionState
+
+_RECORD_OVERHEAD = 240
+"""Rough size of an empty `CachedMessage` and its bookkeeping, in bytes."""
+_ATTACHMENT_OVERHEAD = 160
+_EMBED_OVERHEAD = 400
+
+
+class CachedAttachment:
+	"""The metadata of a cached message's attachment."""
+
+	__slots__ = ("id", "filename", "size", "url", "proxy_url", "content_type")
+
+	def __init__(self, data: dict):
+		self.id: int = int(data["id"])
+		self.filename: str = data["filename"]
+		self.size: int = data["size"]
+		self.url: str = data["url"]
+		self.proxy_url: str = data["proxy_url"]
+		self.content_type: Optional[str] = data.get("content_type")
+
+	def to_dict(self) -> dict:
+		return {
+			"id": self.id,
+			"filename": self.filename,
+			"size": self.size,
+			"url": self.url,
+			"proxy_url": self.proxy_url,
+			"content_type": self.content_type,
+		}
+
+
+class CachedMessage:
+	"""A compact record of a message, holding only what the log listeners need."""
+
+	__slots__ = (
+		"id",
+		"channel_id",
+		"guild_id",
+		"author_id",
+		"author_name",
+		"author_avatar",
+		"author_bot",
+		"webhook_id",
+		"type",
+		"content",
+		"attachments",
+		"embeds",
+		"pinned",
+		"flags",
+		"edited_at",
+		"size",
+	)
+
+	def __init__(self, message: discord.Message):
+		self.id: int = message.id
+		self.channel_id: int = message.channel.id
+		self.guild_id: int = message.guild.id  # type: ignore
+		self.author_id: int = message.author.id
+		self.author_name: str = message.author.name
+		self.author_avatar: Optional[str] = message.author.avatar.key if message.author.avatar else None
+		self.author_bot: bool = message.author.bot
+		self.webhook_id: Optional[int] = message.webhook_id
+		self.type: int = message.type.value
+		self.content: str = ""
+		self.attachments: tuple[CachedAttachment, ...] = ()
+		self.embeds: tuple[dict, ...] = ()
+		self.pinned: bool = False
+		self.flags: int = 0
+		self.edited_at: Optional[str] = None
+		self.size: int = 0
+		self.update(
+			{
+				"content": message.content,
+				"attachments": [attachment.to_dict() for attachment in message.attachments],
+				"embeds": [embed.to_dict() for embed in message.embeds],
+				"pinned": message.pinned,
+				"flags": message.flags.value,
+				"edited_timestamp": message.edited_at.isoformat() if message.edited_at else None,
+			}
+		)
+
+	def update(self, data: dict[str, Any]) -> None:
+		"""Applies a (partial) message payload, as received in ``MESSAGE_UPDATE``."""
+		if "content" in data:
+			self.content = data["content"]
+		if "attachments" in data:
+			self.attachments = tuple(CachedAttachment(attachment) for attachment in data["attachments"])
+		if "embeds" in data:
+			self.embeds = tuple(data["embeds"])
+		if "pinned" in data:
+			self.pinned = data["pinned"]
+		if "flags" in data:
+			self.flags = data["flags"]
+		if "edited_timestamp" in data:
+			self.edited_at = data["edited_timestamp"]
+		self.size = (
+			_RECORD_OVERHEAD
+			+ len(self.content)
+			+ sum(_ATTACHMENT_OVERHEAD + len(a.url) + len(a.proxy_url) for a in self.attachments)
+			+ _EMBED_OVERHEAD * len(self.embeds)
+		)
+
+	def to_message(self, state: Any) -> Optional[discord.Message]:
+		"""Rebuilds a `discord.Message` from this record.
+
+		Returns ``None`` if the guild or the channel isn't cached anymore.
+		"""
+		guild: Optional[discord.Guild] = state._get_guild(self.guild_id)
+		channel = guild.get_channel_or_thread(self.channel_id) if guild else None
+		if channel is None:
+			return None
+
+		message = discord.Message(
+			state=state,
+			channel=channel,  # type: ignore
+			data={  # type: ignore
+				"id": self.id,
+				"channel_id": self.channel_id,
+				"webhook_id": self.webhook_id,
+				"type": self.type,
+				"content": self.content,
+				"attachments": [attachment.to_dict() for attachment in self.attachments],
+				"embeds": list(self.embeds),
+				"pinned": self.pinned,
+				"flags": self.flags,
+				"edited_timestamp": self.edited_at,
+				"mentions": [],
+				"mention_roles": [],
+				"components": [],
+			},
+		)
+		message.author = (
+			guild.get_member(self.author_id)
+			or state.get_user(self.author_id)
+			or discord.User(
+				state=state,
+				data={  # type: ignore
+					"id": self.author_id,
+					"username": self.author_name,
+					"discriminator": "0",
+					"avatar": self.author_avatar,
+					"global_name": None,
+					"bot": self.author_bot,
+				},
+			)
+		)
+		return message
+
+
+class GuildMessages:
+	"""The cached messages of one guild, oldest first, plus its statistics."""
+
+	__slots__ = ("messages", "size", "hits", "misses")
+
+	def __init__(self):
+		self.messages: OrderedDict[int, CachedMessage] = OrderedDict()
+		self.size = 0
+		self.hits = 0
+		self.misses = 0
+
+	@property
+	def hit_rate(self) -> float:
+		lookups = self.hits + self.misses
+		return self.hits / lookups if lookups else 0.0
+
+
+class MessageCache:
+	def __init__(self, per_guild: int = 1000, max_size: int = 64 * 1024 * 1024):
+		"""A message cache with a capacity per guild and a global memory ceiling.
+
+		Only guilds that were enabled with `enable` are cached. When the ceiling is reached, the oldest messages
+		of the largest guild are evicted first, so a busy guild can't push quiet guilds out of the cache.
+
+		Subclass this and pass it to `MyClient` to plug in a different storage or eviction policy.
+
+		Parameters
+		----------
+		per_guild: `int`
+			The maximum number of messages cached per guild.
+		max_size: `int`
+			The approximate maximum memory used by all cached messages, in bytes.
+		"""
+		self.per_guild = per_guild
+		self.max_size = max_size
+		self.size = 0
+		self.guilds: dict[int, GuildMessages] = {}
+		self._enabled: set[int] = set()
+		self._index: dict[int, int] = {}  # message ID -> guild ID
+
+	def enable(self, guild_id: int) -> None:
+		"""Starts caching the messages of a guild."""
+		self._enabled.add(guild_id)
+
+	def disable(self, guild_id: int) -> None:
+		"""Stops caching the messages of a guild and drops the ones already cached."""
+		self._enabled.discard(guild_id)
+		self.clear_guild(guild_id)
+
+	def set_enabled(self, guild_ids: Iterable[int]) -> None:
+		"""Caches the messages of exactly these guilds, dropping the ones of the guilds that aren't among them."""
+		guild_ids = set(guild_ids)
+		for guild_id in self._enabled - guild_ids:
+			self.disable(guild_id)
+		self._enabled = guild_ids
+
+	def is_enabled(self, guild_id: int) -> bool:
+		return guild_id in self._enabled
+
+	def __len__(self) -> int:
+		return len(self._index)
+
+	def __contains__(self, message_id: int) -> bool:
+		return message_id in self._index
+
+	def __iter__(self) -> Iterator[CachedMessage]:
+		for bucket in self.guilds.values():
+			yield from bucket.messages.values()
+
+	def append(self, message: discord.Message) -> None:
+		"""Caches a message if its guild is enabled."""
+		if message.guild is None or message.guild.id not in self._enabled:
+			return
+		bucket = self.guilds.get(message.guild.id)
+		if bucket is None:
+			bucket = self.guilds[message.guild.id] = GuildMessages()
+
+		record = CachedMessage(message)
+		bucket.messages[record.id] = record
+		bucket.size += record.size
+		self.size += record.size
+		self._index[record.id] = record.guild_id
+
+		if len(bucket.messages) > self.per_guild:
+			self._evict(bucket, 1)
+		if self.size > self.max_size:
+			self._shrink()
+
+	def get(self, message_id: int, guild_id: Optional[int] = None) -> Optional[CachedMessage]:
+		"""Looks up a cached message.
+
+		Parameters
+		----------
+		message_id: `int`
+			The ID of the message.
+		guild_id: `Optional[int]`
+			The ID of the message's guild, if known. Used to count misses for the guild's hit rate.
+		"""
+		cached_guild_id = self._index.get(message_id)
+		if cached_guild_id is None:
+			if guild_id in self.guilds:
+				self.guilds[guild_id].misses += 1
+			return None
+		bucket = self.guilds[cached_guild_id]
+		bucket.hits += 1
+		return bucket.messages[message_id]
+
+	def update(self, message_id: int, data: dict[str, Any]) -> None:
+		guild_id = self._index.get(message_id)
+		if guild_id is None:
+			return
+		bucket = self.guilds[guild_id]
+		record = bucket.messages[message_id]
+		before = record.size
+		record.update(data)
+		bucket.size += record.size - before
+		self.size += record.size - before
+
+	def remove(self, message_id: int) -> None:
+		guild_id = self._index.pop(message_id, None)
+		if guild_id is None:
+			return
+		bucket = self.guilds[guild_id]
+		record = bucket.messages.pop(message_id)
+		bucket.size -= record.size
+		self.size -= record.size
+
+	def clear_guild(self, guild_id: int) -> None:
+		bucket = self.guilds.pop(guild_id, None)
+		if bucket is None:
+			return
+		for message_id in bucket.messages:
+			self._index.pop(message_id, None)
+		self.size -= bucket.size
+
+	def clear(self) -> None:
+		self.guilds.clear()
+		self._index.clear()
+		self.size = 0
+
+	def _evict(self, bucket: GuildMessages, count: int) -> None:
+		for _ in range(min(count, len(bucket.messages))):
+			message_id, record = bucket.messages.popitem(last=False)
+			self._index.pop(message_id, None)
+			bucket.size -= record.size
+			self.size -= record.size
+
+	def _shrink(self) -> None:
+		# evict in chunks down to 95% of the ceiling so we don't search for the largest guild on every message
+		target = self.max_size * 0.95
+		while self.size > target and self._index:
+			largest = max(self.guilds.values(), key=lambda bucket: bucket.size)
+			self._evict(largest, max(len(largest.messages) // 10, 1))
+
+	def stats(self) -> list[tuple[int, GuildMessages]]:
+		"""Returns the per-guild statistics, largest guild first."""
+		return sorted(self.guilds.items(), key=lambda item: item[1].size, reverse=True)
+
+
+class CachedConnectionState(AutoShardedConnectionState):
+	"""A connection state that stores messages in a `MessageCache` instead of a single global deque."""
+
+	def __init__(self, *args: Any, message_cache: MessageCache, **kwargs: Any) -> None:
+		self.message_cache = message_cache
+		# the shards resuming the session of the previous process, their guilds were restored, see `core.resume`
+		self.resuming_shards: set[int] = set()
+		kwargs["max_messages"] = None
+		super().__init__(*args, **kwargs)
+
+	def clear(self, *, views: bool = True) -> None:
+		super().clear(views=views)
+		self.message_cache.clear()
+		self._messages = self.message_cache  # type: ignore
+
+	def parse_ready(self, data: Any) -> None:
+		shard_id = data["shard"][0]
+		if shard_id in self.resuming_shards:
+			# the session couldn't be resumed, forget the restored guilds the shard isn't in anymore
+			self.resuming_shards.discard(shard_id)
+			current = {int(guild["id"]) for guild in data["guilds"]}
+			for guild in [guild for guild in self._guilds.values() if guild.shard_id == shard_id]:
+				if guild.id not in current:
+					self._remove_guild(guild)
+		super().parse_ready(data)
+
+	def parse_resumed(self, data: Any) -> None:
+		super().parse_resumed(data)
+		shard_id = data["__shard_id__"]
+		if shard_id not in self.resuming_shards:
+			return
+		# there won't be a READY with the guilds, they're cached already, so the shard is ready now
+		self.resuming_shards.discard(shard_id)
+		self._ready_tasks[shard_id] = asyncio.create_task(asyncio.sleep(0))
+		self.dispatch("shard_ready", shard_id)
+		if len(self._ready_tasks) == len(self.shard_ids) and self._ready_task is None:
+			self._ready_task = asyncio.create_task(self._delay_ready())
+
+	def _get_message(self, msg_id: Optional[int]) -> Optional[discord.Message]:
+		record = self.message_cache.get(msg_id) if msg_id else None
+		return record.to_message(self) if record else None
+
+	def _update_message_references(self) -> None:
+		# records only hold IDs and are resolved against the current guild when they are rebuilt
+		pass
+
+	def parse_message_delete(self, data: Any) -> None:
+		raw = discord.RawMessageDeleteEvent(data)
+		record = self.message_cache.get(raw.message_id, raw.guild_id)
+		found = record.to_message(self) if record else None
+		raw.cached_message = found
+		self.dispatch("raw_message_delete", raw)
+		if found is not None:
+			self.dispatch("message_delete", found)
+		self.message_cache.remove(raw.message_id)
+
+	def parse_message_delete_bulk(self, data: Any) -> None:
+		raw = discord.RawBulkMessageDeleteEvent(data)
+		found = [
+			message
+			for message_id in raw.message_ids
+			if (record := self.message_cache.get(message_id, raw.guild_id)) and (message := record.to_message(self))
+		]
+		raw.cached_messages = found
+		self.dispatch("raw_bulk_message_delete", raw)
+		if found:
+			self.dispatch("bulk_message_delete", found)
+		for message_id in raw.message_ids:
+			self.message_cache.remove(message_id)
+
+	def parse_message_update(self, data: Any) -> None:
+		message_id = int(data["id"])
+		if message_id not in self.message_cache:
+			# discord.py's lookup doesn't know the guild, so count the miss here
+			self.message_cache.get(message_id, int(data["guild_id"]) if data.get("guild_id") else None)
+		super().parse_message_update(data)
+		self.message_cache.update(message_id, data)
+
+	def parse_guild_delete(self, data: Any) -> None:
+		if not data.get("unavailable", False):
+			self.message_cache.clear_guild(int(data["id"]))
+		# skip discord.py's own cleanup, which would rebuild the whole cache as a deque
+		messages, self._messages = self._messages, None
+		try:
+			super().parse_guild_delete(data)
+		finally:
+			self._messages = messages
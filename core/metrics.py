@@ -0,0 +1,344 @@
+"""Counts what the bot does while it runs, so slow commands, busy shards and hot routes show up without reading logs.
+
+`Metrics` records every command from `MyClient.before_invoke` to `MyClient.after_invoke`, every gateway event by type
+and every REST request by route. Recording one is a dict lookup and a few counter updates on objects created the first
+time, like the queries of `InstrumentedPool`, whose statistics are exported with them. Everything else, the shards,
+caches and pools, is only read when the metrics are collected.
+
+With ``METRICS_PORT`` set, a `MetricsServer` serves them in the Prometheus text format on
+``http://127.0.0.1:<port>/metrics``, with several clusters on that port plus the cluster ID. The owner-only ``stats``
+command shows them in Discord.
+"""
+
+import math
+from bisect import bisect_left
+from dataclasses import dataclass, field
+from logging import getLogger
+from time import monotonic, perf_counter
+from typing import TYPE_CHECKING, Any, Optional
+
+import discord
+
+from core.database import LATENCY_BUCKETS
+from helpers import LazyModule
+
+if TYPE_CHECKING:
+	from core.bot import MyClient
+
+logger = getLogger(__name__)
+psutil = LazyModule("psutil")
+web = LazyModule("aiohttp.web")  # only needed when the metrics are served
+
+COMMAND_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+"""The upper bounds of the command latency buckets, in seconds. Commands take longer than queries, up to a deadline."""
+PREFIX = "lumin"
+
+
+@dataclass(slots=True)
+class LatencyStats:
+	"""The calls, failures and latency histogram of a command or a route."""
+
+	name: str
+	buckets: tuple[float, ...] = LATENCY_BUCKETS
+	calls: int = 0
+	failures: int = 0
+	total_time: float = 0.0
+	max_time: float = 0.0
+	histogram: list[int] = field(default_factory=list)
+
+	def __post_init__(self):
+		self.histogram = [0] * (len(self.buckets) + 1)
+
+	@property
+	def mean_time(self) -> float:
+		return self.total_time / self.calls if self.calls else 0.0
+
+	def observe(self, duration: float, failed: bool) -> None:
+		self.calls += 1
+		self.total_time += duration
+		self.histogram[bisect_left(self.buckets, duration)] += 1
+		if duration > self.max_time:
+			self.max_time = duration
+		if failed:
+			self.failures += 1
+
+	def percentile(self, fraction: float) -> float:
+		"""Estimates a latency percentile from the histogram, as the upper bound of the bucket it falls into."""
+		target = fraction * self.calls
+		seen = 0
+		for bound, count in zip(self.buckets, self.histogram):
+			seen += count
+			if seen >= target:
+				return bound
+		return self.max_time
+
+
+@dataclass(slots=True)
+class MetricFamily:
+	"""A metric and its samples, as `render_metrics` writes them."""
+
+	name: str
+	kind: str
+	"""``counter``, ``gauge`` or ``histogram``."""
+	help: str
+	samples: list[tuple[str, dict[str, str], float]] = field(default_factory=list)
+	"""The suffix of the sample's name, e.g. ``_bucket``, its labels and its value."""
+
+	def add(self, value: float, **labels: Any) -> None:
+		self.samples.append(("", {name: str(label) for name, label in labels.items()}, value))
+
+	def add_histogram(
+		self, buckets: tuple[float, ...], histogram: list[int], total: float, count: int, **labels: Any
+	) -> None:
+		labels = {name: str(label) for name, label in labels.items()}
+		seen = 0
+		for bound, observed in zip((*buckets, math.inf), histogram):
+			seen += observed
+			self.samples.append(("_bucket", {**labels, "le": _number(bound)}, seen))
+		self.samples.append(("_sum", labels, total))
+		self.samples.append(("_count", labels, count))
+
+
+def _number(value: float) -> str:
+	if math.isinf(value):
+		return "+Inf" if value > 0 else "-Inf"
+	if math.isnan(value):
+		return "NaN"
+	return repr(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _escape(value: str) -> str:
+	return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render_metrics(families: list[MetricFamily]) -> str:
+	"""Writes metrics in the Prometheus text format."""
+	lines = []
+	for family in families:
+		name = f"{PREFIX}_{family.name}"
+		lines.append(f"# HELP {name} {family.help}")
+		lines.append(f"# TYPE {name} {family.kind}")
+		for suffix, labels, value in family.samples:
+			if labels:
+				label_text = ",".join(f'{label}="{_escape(text)}"' for label, text in labels.items())
+				lines.append(f"{name}{suffix}{{{label_text}}} {_number(value)}")
+			else:
+				lines.append(f"{name}{suffix} {_number(value)}")
+	return "\n".join(lines) + "\n"
+
+
+class Metrics:
+	def __init__(self):
+		"""Records the commands, gateway events and REST requests of a client. See `collect` for the rest."""
+		self.started_at = monotonic()
+		self.commands: dict[str, LatencyStats] = {}
+		self.events: dict[str, int] = {}
+		self.routes: dict[str, dict[str, LatencyStats]] = {}
+		"""The REST requests by method, then by the path of their route, e.g. ``/channels/{channel_id}/messages``."""
+
+	@property
+	def uptime(self) -> float:
+		return monotonic() - self.started_at
+
+	def command(self, name: str, duration: float, failed: bool) -> None:
+		"""Records a command that ran for ``duration`` seconds."""
+		stats = self.commands.get(name)
+		if stats is None:
+			stats = self.commands[name] = LatencyStats(name, COMMAND_BUCKETS)
+		stats.observe(duration, failed)
+
+	def event(self, name: str) -> None:
+		"""Records a gateway event, e.g. ``MESSAGE_CREATE``."""
+		self.events[name] = self.events.get(name, 0) + 1
+
+	def request(self, method: str, path: str, duration: float, failed: bool) -> None:
+		"""Records a REST request to a route."""
+		paths = self.routes.get(method)
+		if paths is None:
+			paths = self.routes[method] = {}
+		stats = paths.get(path)
+		if stats is None:
+			stats = paths[path] = LatencyStats(f"{method} {path}")
+		stats.observe(duration, failed)
+
+	def instrument(self, http: discord.http.HTTPClient) -> None:
+		"""Records the requests of a client's HTTP client, including the time spent waiting for its rate limits."""
+		request = http.request
+
+		async def timed(route: discord.http.Route, **kwargs: Any) -> Any:
+			start = perf_counter()
+			failed = True
+			try:
+				response = await request(route, **kwargs)
+				failed = False
+				return response
+			finally:
+				self.request(route.method, route.path, perf_counter() - start, failed)
+
+		http.request = timed
+
+	def collect(self, client: "MyClient") -> list[MetricFamily]:
+		"""
+		Collects the recorded metrics and reads the state of the shards, caches and pools.
+
+		Parameters
+		----------
+		client: `MyClient`
+			The client to read the state of.
+
+		Returns
+		-------
+		list[`MetricFamily`]
+			The metrics, ready to `render_metrics`.
+		"""
+		families = []
+
+		def family(name: str, kind: str, description: str) -> MetricFamily:
+			families.append(MetricFamily(name, kind, description))
+			return families[-1]
+
+		family("uptime_seconds", "gauge", "Seconds since the metrics started recording.").add(self.uptime)
+		family("resident_memory_bytes", "gauge", "Resident memory of the process.").add(
+			psutil.Process().memory_info().rss
+		)
+
+		calls = family("command_calls_total", "counter", "Commands invoked.")
+		failures = family("command_failures_total", "counter", "Commands that raised an error.")
+		latency = family("command_duration_seconds", "histogram", "How long commands took, hooks included.")
+		for name, stats in self.commands.items():
+			calls.add(stats.calls, command=name)
+			failures.add(stats.failures, command=name)
+			latency.add_histogram(stats.buckets, stats.histogram, stats.total_time, stats.calls, command=name)
+
+		events = family("gateway_events_total", "counter", "Gateway events received, by type.")
+		for name, count in self.events.items():
+			events.add(count, event=name)
+		shard_latency = family("shard_latency_seconds", "gauge", "Time between a heartbeat and its acknowledgement.")
+		shard_open = family("shard_connected", "gauge", "Whether the shard is connected.")
+		for shard_id, shard in client.shards.items():
+			shard_latency.add(shard.latency, shard=shard_id)
+			shard_open.add(0 if shard.is_closed() else 1, shard=shard_id)
+
+		state = client._connection
+		objects = family("cache_objects", "gauge", "Objects held in a cache.")
+		objects.add(len(state._guilds), cache="guilds")
+		objects.add(len(state._users), cache="users")
+		objects.add(sum(len(guild._members) for guild in state._guilds.values()), cache="members")
+		objects.add(len(client.message_cache), cache="messages")
+		hits = family("cache_hits_total", "counter", "Lookups a cache answered.")
+		misses = family("cache_misses_total", "counter", "Lookups a cache had to load or couldn't answer.")
+		buckets = client.message_cache.guilds.values()
+		hits.add(sum(bucket.hits for bucket in buckets), cache="messages")
+		misses.add(sum(bucket.misses for bucket in buckets), cache="messages")
+		for name, (_, cache) in client.resume.caches.items():
+			objects.add(len(cache), cache=name)
+			hits.add(cache.hits, cache=name)
+			misses.add(cache.misses, cache=name)
+		family("message_cache_bytes", "gauge", "Approximate memory used by the cached messages.").add(
+			client.message_cache.size
+		)
+
+		chunker = client.chunker
+		family("chunk_requests_total", "counter", "Guilds whose members were requested.").add(chunker.requested)
+		family("chunk_requests_deduplicated_total", "counter", "Requests for a guild already requested.").add(
+			chunker.deduplicated
+		)
+		family("chunks_completed_total", "counter", "Guilds whose members were cached.").add(chunker.completed)
+		family("chunks_failed_total", "counter", "Guilds whose members didn't arrive.").add(chunker.failed)
+		family("chunks_queued", "gauge", "Guilds waiting to be chunked.").add(chunker.queued)
+
+		pools = [("primary", client.db)] if client.db else []
+		if client.queries and client.queries.replica:
+			pools.append(("replica", client.queries.replica.pool))
+		connections = family("db_pool_connections", "gauge", "Open connections of the pool.")
+		max_connections = family("db_pool_max_connections", "gauge", "Connections the pool opens at most.")
+		queries = family("db_query_duration_seconds", "histogram", "How long queries took, by statement.")
+		for name, pool in pools:
+			idle = pool.get_idle_size()
+			connections.add(pool.get_size() - idle, pool=name, state="in_use")
+			connections.add(idle, pool=name, state="idle")
+			max_connections.add(pool.get_max_size(), pool=name)
+			for stats in pool.stats.values():
+				queries.add_histogram(
+					LATENCY_BUCKETS, stats.histogram, stats.total_time, stats.calls, pool=name, statement=stats.name
+				)
+		if client.db and client.db.breaker:
+			family("db_circuit_open", "gauge", "Whether the circuit breaker is open or half-open.").add(
+				0 if client.db.breaker.state == "closed" else 1
+			)
+		if client.queries and client.queries.replica and client.queries.replica.lag is not None:
+			family("db_replica_lag_seconds", "gauge", "How far the read replica is behind.").add(
+				client.queries.replica.lag
+			)
+
+		requests = family("http_requests_total", "counter", "REST requests, by route.")
+		request_failures = family("http_request_failures_total", "counter", "REST requests that raised an error.")
+		request_latency = family(
+			"http_request_duration_seconds", "histogram", "How long REST requests took, rate limits included."
+		)
+		for method, paths in self.routes.items():
+			for path, stats in paths.items():
+				requests.add(stats.calls, method=method, route=path)
+				request_failures.add(stats.failures, method=method, route=path)
+				request_latency.add_histogram(
+					stats.buckets, stats.histogram, stats.total_time, stats.calls, method=method, route=path
+				)
+
+		if client.interactions:
+			server = client.interactions
+			interactions = family("interactions_total", "counter", "Interactions received over HTTP, by outcome.")
+			interactions.add(server.received, outcome="received")
+			interactions.add(server.rejected, outcome="rejected")
+			interactions.add(server.unanswered, outcome="unanswered")
+		return families
+
+
+class MetricsServer:
+	def __init__(
+		self, client: "MyClient", metrics: Metrics, *, host: str = "127.0.0.1", port: int = 9100, path: str = "/metrics"
+	):
+		"""Serves the metrics of a client to Prometheus.
+
+		Parameters
+		----------
+		client: `MyClient`
+			The client whose metrics to serve.
+		metrics: `Metrics`
+			The recorded metrics.
+		host: `str`
+			The address to listen on. Only local by default, the metrics aren't meant for the public.
+		port: `int`
+			The port to listen on.
+		path: `str`
+			The path of the endpoint.
+		"""
+		self.client = client
+		self.metrics = metrics
+		self.host = host
+		self.port = port
+		self.path = path
+		self._runner: Optional[web.AppRunner] = None
+
+	async def start(self) -> None:
+		"""Starts serving the metrics."""
+		app = web.Application()
+		app.router.add_get(self.path, self.handle)
+		self._runner = web.AppRunner(app, access_log=None)
+		await self._runner.setup()
+		try:
+			await web.TCPSite(self._runner, self.host, self.port).start()
+		except OSError:
+			await self._runner.cleanup()
+			self._runner = None
+			raise
+		logger.info(f"Serving the metrics on http://{self.host}:{self.port}{self.path}")
+
+	async def stop(self) -> None:
+		"""Stops serving the metrics."""
+		if self._runner:
+			await self._runner.cleanup()
+			self._runner = None
+
+	async def handle(self, request: "web.Request") -> "web.Response":
+		text = render_metrics(self.metrics.collect(self.client))
+		return web.Response(body=text.encode(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
@@ -0,0 +1,157 @@
+import asyncio
+import contextlib
+import hashlib
+import importlib.util
+import re
+from dataclasses import dataclass
+from logging import getLogger
+from pathlib import Path
+from typing import Optional
+
+import asyncpg
+
+logger = getLogger(__name__)
+
+MIGRATIONS_PATH = Path(__file__).parent.parent / "migrations"
+MIGRATION_LOCK_ID = 0x6C756D696E
+"""The key of the advisory lock held while migrating, so only one process migrates at a time."""
+LOCK_POLL_INTERVAL = 0.5
+"""How often a process waiting for another one to migrate checks whether it's done, in seconds."""
+_FILE_NAME = re.compile(r"(?P<version>\d+)_(?P<name>\w+)\.(?:sql|py)")
+
+
+@dataclass(slots=True, frozen=True)
+class Migration:
+	version: int
+	name: str
+	path: Path
+	source: str
+
+	@property
+	def checksum(self) -> str:
+		return hashlib.sha256(self.source.encode()).hexdigest()
+
+	@property
+	def transactional(self) -> bool:
+		"""Whether the migration runs in a transaction.
+
+		SQL migrations do. Python migrations define ``async def upgrade(connection)`` and manage their own transactions,
+		so they can work in batches or build indexes concurrently on a live database.
+		"""
+		return self.path.suffix == ".sql"
+
+	async def apply(self, connection: asyncpg.Connection) -> None:
+		if self.transactional:
+			await connection.execute(self.source)
+			return
+
+		spec = importlib.util.spec_from_file_location(f"migrations.{self.path.stem}", self.path)
+		module = importlib.util.module_from_spec(spec)  # type: ignore
+		spec.loader.exec_module(module)  # type: ignore
+		await module.upgrade(connection)
+
+
+def discover_migrations(path: Path = MIGRATIONS_PATH) -> list[Migration]:
+	"""
+	Reads the migrations of a directory.
+
+	Migrations are SQL or Python files named ``<version>_<name>.sql`` or ``<version>_<name>.py``, like
+	``0002_log_events.sql``. They are applied in order of their version, see `Migration.transactional`. An applied migration
+	must never be edited, add a new one instead.
+
+	Parameters
+	----------
+	path: `Path`
+	        The directory of the migrations.
+
+	Returns
+	-------
+	`list[Migration]`
+	        The migrations, sorted by version.
+	"""
+	migrations = []
+	for file in path.iterdir():
+		if file.suffix not in (".sql", ".py"):
+			continue
+		match = _FILE_NAME.fullmatch(file.name)
+		if match is None:
+			raise ValueError(f"Invalid migration file name: {file.name}")
+		migrations.append(Migration(int(match["version"]), match["name"], file, file.read_text(encoding="utf-8")))
+
+	migrations.sort(key=lambda migration: migration.version)
+	for previous, current in zip(migrations, migrations[1:]):
+		if previous.version == current.version:
+			raise ValueError(f"Migrations {previous.name} and {current.name} have the same version")
+	return migrations
+
+
+async def migrate(pool: asyncpg.Pool, migrations: Optional[list[Migration]] = None) -> list[Migration]:
+	"""
+	Applies the migrations that weren't applied yet.
+
+	When the schema is current, this costs a single query. Otherwise, an advisory lock is taken so processes starting
+	at the same time don't apply the same migration twice. The others poll it until the migrating one is done.
+
+	Parameters
+	----------
+	pool: `asyncpg.Pool`
+	        The pool to migrate the database of.
+	migrations: Optional[`list[Migration]`]
+	        The migrations to apply. Defaults to the ones in `MIGRATIONS_PATH`.
+
+	Returns
+	-------
+	`list[Migration]`
+	        The migrations that were applied.
+	"""
+	migrations = migrations if migrations is not None else discover_migrations()
+	if not migrations:
+		return []
+
+	try:
+		current = await pool.fetchval("SELECT max(version) FROM schema_migrations")
+	except asyncpg.UndefinedTableError:
+		current = None
+	if current is not None and current >= migrations[-1].version:
+		return []
+
+	applied_now = []
+	async with pool.acquire() as connection:
+		# polled rather than waited for: a query blocked on the lock holds a snapshot, which a CREATE INDEX CONCURRENTLY
+		# of the migrating process waits for, so the two would deadlock
+		if not await connection.fetchval("SELECT pg_try_advisory_lock($1)", MIGRATION_LOCK_ID):
+			logger.info("Waiting for another process to finish migrating")
+			while not await connection.fetchval("SELECT pg_try_advisory_lock($1)", MIGRATION_LOCK_ID):
+				await asyncio.sleep(LOCK_POLL_INTERVAL)
+		try:
+			await connection.execute(
+				"CREATE TABLE IF NOT EXISTS schema_migrations ("
+				" version integer NOT NULL PRIMARY KEY,"
+				" name text NOT NULL,"
+				" checksum text NOT NULL,"
+				" applied_at timestamptz NOT NULL DEFAULT now()"
+				")"
+			)
+			# another process might have migrated while we were waiting for the lock
+			applied = {
+				row["version"]: row["checksum"]
+				for row in await connection.fetch("SELECT version, checksum FROM schema_migrations")
+			}
+			for migration in migrations:
+				if migration.version in applied:
+					if applied[migration.version] != migration.checksum:
+						logger.warning(f"Migration {migration.version}_{migration.name} was edited after being applied")
+					continue
+				async with connection.transaction() if migration.transactional else contextlib.nullcontext():
+					await migration.apply(connection)
+					await connection.execute(
+						"INSERT INTO schema_migrations (version, name, checksum) VALUES ($1, $2, $3)",
+						migration.version,
+						migration.name,
+						migration.checksum,
+					)
+				logger.info(f"Applied migration {migration.version}_{migration.name}")
+				applied_now.append(migration)
+		finally:
+			await connection.execute("SELECT pg_advisory_unlock($1)", MIGRATION_LOCK_ID)
+	return applied_now
@@ -0,0 +1,255 @@
+"""Chooses what the gateway sends the bot and what it keeps of it, and measures what the caches take up.
+
+With every intent, Discord sends every presence update and discord.py caches every member it's told about, which takes
+most of the bandwidth and memory while hardly any feature needs them. A `CacheProfile` names a trade-off:
+
+- ``minimal`` only asks for what the loaded cogs need and caches no member they don't,
+- ``standard`` also asks for the intents that aren't privileged, e.g. reactions and voice states, and caches the members
+  in voice channels,
+- ``full`` asks for everything, presences included, and caches every member, as the bot did before.
+
+A cog declares the intents it needs with an ``intents`` class attribute, e.g. ``discord.Intents(members=True)`` to keep
+the members it chunks. `MyClient` takes the profile from ``CACHE_PROFILE`` and applies it once the cogs are loaded,
+before the shards connect, so a cog loaded later only gets what was asked for by then.
+"""
+
+import random
+import sys
+import types
+from dataclasses import dataclass
+from typing import Any, Iterable, Optional
+
+import discord
+from discord.state import ConnectionState
+
+REQUIRED_INTENTS = discord.Intents(guilds=True, guild_messages=True, dm_messages=True, message_content=True)
+"""What the bot needs without any cog: the guilds for its state, and the messages for the prefix commands."""
+
+
+@dataclass(slots=True, frozen=True)
+class CacheProfile:
+	name: str
+	intents: discord.Intents
+	"""What is asked for on top of what the cogs need."""
+	member_cache_flags: discord.MemberCacheFlags
+	"""The members cached on top of those the intents the cogs need imply."""
+
+	def resolve(self, needed: discord.Intents) -> tuple[discord.Intents, discord.MemberCacheFlags]:
+		"""
+		Returns what to ask for and cache with the intents the bot needs.
+
+		Parameters
+		----------
+		needed: `discord.Intents`
+			The intents the bot and its cogs need, see `needed_intents`.
+
+		Returns
+		-------
+		tuple[`discord.Intents`, `discord.MemberCacheFlags`]
+			The intents to identify with and the members to cache.
+		"""
+		return needed | self.intents, discord.MemberCacheFlags.from_intents(needed) | self.member_cache_flags
+
+
+PROFILES: dict[str, CacheProfile] = {
+	profile.name: profile
+	for profile in (
+		CacheProfile("minimal", discord.Intents.none(), discord.MemberCacheFlags.none()),
+		CacheProfile(
+			"standard",
+			discord.Intents.default(),
+			discord.MemberCacheFlags.from_intents(discord.Intents.default()),
+		),
+		CacheProfile("full", discord.Intents.all(), discord.MemberCacheFlags.all()),
+	)
+}
+DEFAULT_PROFILE = "standard"
+
+
+def needed_intents(cogs: Iterable[Any]) -> discord.Intents:
+	"""Returns the intents the bot needs with the given cogs loaded."""
+	intents = discord.Intents(**dict(REQUIRED_INTENTS))
+	for cog in cogs:
+		if isinstance(getattr(cog, "intents", None), discord.Intents):
+			intents |= cog.intents
+	return intents
+
+
+def apply_profile(state: ConnectionState, intents: discord.Intents, member_cache_flags: discord.MemberCacheFlags):
+	"""
+	Changes what a connection state identifies with and caches, before its shards connect.
+
+	discord.py only takes them when the client is created, before the cogs that need them are loaded, so this sets what
+	``ConnectionState.__init__`` derives from them again.
+
+	Parameters
+	----------
+	state: `ConnectionState`
+		The connection state of the client.
+	intents: `discord.Intents`
+		The intents to identify with.
+	member_cache_flags: `discord.MemberCacheFlags`
+		The members to cache.
+
+	Raises
+	------
+	ValueError
+		If the members to cache need an intent that isn't asked for.
+	"""
+	member_cache_flags._verify_intents(intents)
+	state._intents = intents
+	state.member_cache_flags = member_cache_flags
+	if not intents.members or member_cache_flags._empty:
+		state.store_user = state.store_user_no_intents
+	else:
+		# drops the instance attribute a previous call may have set, falling back to the method
+		state.__dict__.pop("store_user", None)
+	state.raw_presence_flag = not intents.members and intents.presences
+
+
+def describe_intents(intents: discord.Intents, member_cache_flags: discord.MemberCacheFlags) -> str:
+	"""Returns the privileged intents and the cached members, e.g. for the logs."""
+	privileged = [name for name in ("members", "presences", "message_content") if getattr(intents, name)]
+	cached = [name for name, enabled in member_cache_flags if enabled]
+	return f"privileged intents: {', '.join(privileged) or 'none'}, caching the members: {', '.join(cached) or 'only the bot'}"
+
+
+@dataclass(slots=True)
+class CacheUsage:
+	"""How much memory a cache takes up, estimated from a sample of its objects."""
+
+	name: str
+	count: int
+	size: int
+	"""The estimated size in bytes."""
+
+	@property
+	def per_object(self) -> float:
+		return self.size / self.count if self.count else 0.0
+
+
+# shared by everything, counted with what owns them
+_SHARED = (
+	type,
+	types.ModuleType,
+	types.FunctionType,
+	types.MethodType,
+	types.BuiltinFunctionType,
+	ConnectionState,
+	discord.Client,
+	discord.Guild,
+)
+
+
+def deep_size(obj: Any, *, exclude: tuple[type, ...] = (), seen: Optional[set[int]] = None) -> int:
+	"""
+	Returns the size of an object and everything it references, in bytes.
+
+	Parameters
+	----------
+	obj: Any
+		The object to measure.
+	exclude: tuple[`type`, ...]
+		The types of the referenced objects that are counted elsewhere, e.g. the users of members.
+	seen: Optional[set[`int`]]
+		The IDs of the objects already counted, shared between calls to count shared objects once.
+
+	Returns
+	-------
+	`int`
+		The size in bytes.
+	"""
+	seen = set() if seen is None else seen
+	exclude = _SHARED + exclude
+	root = obj
+	size = 0
+	stack = [obj]
+	while stack:
+		obj = stack.pop()
+		if obj is None or obj is True or obj is False or id(obj) in seen:
+			continue
+		if obj is not root and isinstance(obj, exclude):
+			continue
+		seen.add(id(obj))
+		size += sys.getsizeof(obj)
+		if isinstance(obj, (str, bytes, int, float)):
+			continue
+		if isinstance(obj, dict):
+			stack.extend(obj.keys())
+			stack.extend(obj.values())
+		elif isinstance(obj, (list, tuple, set, frozenset)):
+			stack.extend(obj)
+		else:
+			if hasattr(obj, "__dict__"):
+				stack.append(vars(obj))
+			for cls in type(obj).__mro__:
+				for name in getattr(cls, "__slots__", ()):
+					if name not in ("__dict__", "__weakref__"):
+						stack.append(getattr(obj, name, None))
+	return size
+
+
+def _estimate(
+	name: str,
+	objects: list[Any],
+	sample: int,
+	exclude: tuple[type, ...] = (),
+	*,
+	overhead: int = 0,
+	counted: Iterable[Any] = (),
+) -> CacheUsage:
+	picked = random.sample(objects, sample) if len(objects) > sample else objects
+	# strings and the like that the sampled objects share are counted once per sample, as they would be overall
+	seen = {id(obj) for obj in counted}
+	size = sum(deep_size(obj, exclude=exclude, seen=seen) for obj in picked)
+	return CacheUsage(name, len(objects), overhead + (size * len(objects) // len(picked) if picked else 0))
+
+
+def cache_usage(client: discord.Client, *, sample: int = 1000) -> list[CacheUsage]:
+	"""
+	Estimates how much memory the caches of discord.py and the message cache take up.
+
+	Only a sample of each cache is measured, so it's cheap enough to run on a live bot.
+
+	Parameters
+	----------
+	client: `discord.Client`
+		The client whose caches to measure.
+	sample: `int`
+		The number of objects to measure per cache.
+
+	Returns
+	-------
+	list[`CacheUsage`]
+		The members, users, messages, emojis and stickers, and the guilds with their channels and roles.
+	"""
+	state = client._connection
+	guilds = list(state._guilds.values())
+	members = [member for guild in guilds for member in guild._members.values()]
+	users = list(state._users.values())
+	usage = [
+		_estimate(
+			"members",
+			members,
+			sample,
+			(discord.User, discord.ClientUser),
+			overhead=sum(sys.getsizeof(guild._members) for guild in guilds),
+		),
+		_estimate("users", users, sample, overhead=sys.getsizeof(state._users)),
+	]
+	message_cache = getattr(client, "message_cache", None)
+	if message_cache is not None:
+		usage.append(CacheUsage("messages", len(message_cache), message_cache.size))
+	usage.append(_estimate("emojis", list(state._emojis.values()), sample))
+	usage.append(_estimate("stickers", list(state._stickers.values()), sample))
+	# a guild without what's counted above: its channels, threads and roles
+	usage.append(
+		_estimate(
+			"guilds",
+			guilds,
+			max(sample // 100, 1),
+			(discord.Member, discord.User, discord.ClientUser, discord.Emoji, discord.GuildSticker),
+			counted=[guild._members for guild in guilds],
+		)
+	)
+	return usage
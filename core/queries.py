@@ -0,0 +1,329 @@
+"""Every SQL statement the bot runs, by name.
+
+A statement is prepared on a pool connection the first time it runs there and stays in the connection's statement cache
+(see `STATEMENT_CACHE_SIZE`), so later calls only send the parameters and reuse the plan. Keep one statement per query
+shape here instead of writing SQL in the cogs: optional filters are written as ``($n IS NULL OR column = $n)`` rather
+than building the query string.
+"""
+
+import asyncio
+import re
+from collections import Counter
+from contextvars import ContextVar
+from logging import getLogger
+from time import monotonic
+from typing import Any, Iterable, Optional, Union
+
+import asyncpg
+
+from core import deadline
+
+logger = getLogger(__name__)
+
+STATEMENTS: dict[str, str] = {
+	"ping": "SELECT 1",
+	# the replay delay of a standby, 0 when it replayed everything it received, NULL if it doesn't receive anything
+	"replica.lag": "SELECT CASE WHEN NOT EXISTS (SELECT FROM pg_stat_wal_receiver) THEN NULL"
+	" WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0"
+	" ELSE extract(epoch FROM now() - pg_last_xact_replay_timestamp()) END::float8",
+	# guilds
+	"guilds.ensure": "INSERT INTO guilds (guild_id) VALUES ($1) ON CONFLICT (guild_id) DO NOTHING",
+	"guilds.prefix": "SELECT prefix, mention FROM guilds WHERE guild_id = $1",
+	"guilds.set_prefix": "UPDATE guilds SET prefix = $2, mention = $3 WHERE guild_id = $1",
+	# afk
+	"afk.get": "SELECT * FROM afk WHERE guild_id = $1 AND user_id = $2",
+	"afk.get_active": "SELECT * FROM afk WHERE guild_id = $1 AND user_id = $2 AND state = TRUE",
+	"afk.active_users": "SELECT user_id FROM afk WHERE guild_id = $1 AND state = TRUE",
+	"afk.insert": "INSERT INTO afk (guild_id, user_id, message, state, previous_nick) VALUES ($1, $2, $3, TRUE, $4)",
+	"afk.activate": "UPDATE afk SET state = TRUE, message = $3, previous_nick = $4 WHERE guild_id = $1 AND user_id = $2",
+	"afk.deactivate": "UPDATE afk SET state = FALSE WHERE guild_id = $1 AND user_id = $2",
+	# economy
+	"economy.get": "SELECT * FROM economy WHERE guild_id = $1 AND user_id = $2",
+	"economy.cash": "SELECT cash FROM economy WHERE guild_id = $1 AND user_id = $2",
+	"economy.bank": "SELECT bank FROM economy WHERE guild_id = $1 AND user_id = $2",
+	"economy.insert": "INSERT INTO economy (guild_id, user_id, cash, bank) VALUES ($1, $2, $3, $4)",
+	"economy.set_cash": "UPDATE economy SET cash = $3 WHERE guild_id = $1 AND user_id = $2",
+	"economy.set_bank": "UPDATE economy SET bank = $3 WHERE guild_id = $1 AND user_id = $2",
+	"economy.leaderboard": "SELECT * FROM economy WHERE guild_id = $1 ORDER BY cash + bank DESC LIMIT 10",
+	# shop
+	"shop.list": "SELECT * FROM shop WHERE guild_id = $1",
+	"shop.get": "SELECT * FROM shop WHERE guild_id = $1 AND lower(item_name) = lower($2)",
+	"shop.insert": "INSERT INTO shop (guild_id, item_name, item_description, item_price, role, creator_id)"
+	" VALUES ($1, $2, $3, $4, $5, $6)",
+	"shop.delete": "DELETE FROM shop WHERE guild_id = $1 AND lower(item_name) = lower($2)",
+	# cases
+	"cases.get": "SELECT * FROM cases WHERE guild_id = $1 AND case_id = $2",
+	# the guild isn't optional so the lookup can always use the index on it, even in a generic plan
+	"cases.search": "SELECT * FROM cases"
+	" WHERE guild_id = $1"
+	" AND ($2::bigint IS NULL OR user_id = $2)"
+	" AND ($3::bigint IS NULL OR moderator_id = $3)"
+	" AND ($4::timestamp IS NULL OR expires = $4)"
+	" LIMIT $5",
+	"cases.expired": "SELECT * FROM cases WHERE expires IS NOT NULL AND expires <= $1",
+	"cases.expired_for_shards": "SELECT * FROM cases WHERE expires IS NOT NULL AND expires <= $1"
+	" AND (guild_id >> 22) % $2 = ANY($3::int[])",
+	"cases.insert": "INSERT INTO cases (type, guild_id, case_id, user_id, moderator_id, reason, expires, message)"
+	" VALUES ($1, $2, $3, $4, $5, $6, $7, $8)",
+	"cases.update": "UPDATE cases SET user_id = $2, reason = $3, expires = $4, message = $5 WHERE case_id = $1",
+	"cases.delete": "DELETE FROM cases WHERE case_id = $1",
+	# giveaways
+	"giveaways.active": "SELECT * FROM giveaways WHERE ended = FALSE",
+	"giveaways.active_for_shards": "SELECT * FROM giveaways WHERE ended = FALSE"
+	" AND (guild_id >> 22) % $1 = ANY($2::int[])",
+	"giveaways.insert": "INSERT INTO giveaways"
+	" (guild_id, channel_id, message_id, author_id, prize, winners, ends_at, ended, won_by)"
+	" VALUES ($1, $2, $3, $4, $5, $6, $7, FALSE, NULL)",
+	"giveaways.end": "UPDATE giveaways SET ended = TRUE, won_by = $2 WHERE message_id = $1",
+	"giveaways.delete": "DELETE FROM giveaways WHERE message_id = $1",
+	# log
+	"log.is_on": "SELECT is_on FROM log WHERE guild_id = $1",
+	"log.enabled_guilds": "SELECT guild_id FROM log WHERE is_on = TRUE",
+	"log.webhook": "SELECT webhook FROM log WHERE guild_id = $1",
+	"log.settings": "SELECT is_on, webhook FROM log WHERE guild_id = $1",
+	"log.enable": "INSERT INTO log (guild_id, webhook, channel, is_on) VALUES ($1, $2, $3, TRUE)"
+	" ON CONFLICT (guild_id) DO UPDATE"
+	" SET webhook = excluded.webhook, channel = excluded.channel, is_on = excluded.is_on",
+	"log.disable": "UPDATE log SET is_on = FALSE WHERE guild_id = $1",
+	"log.add_module": "UPDATE log SET modules = array_append(modules, $2) WHERE guild_id = $1",
+	"log.add_all_modules": "UPDATE log SET modules = DEFAULT WHERE guild_id = $1",
+	"log.remove_module": "UPDATE log SET modules = array_remove(modules, $2) WHERE guild_id = $1",
+	"log.remove_all_modules": "UPDATE log SET modules = '{}' WHERE guild_id = $1",
+	"log_events.partitions": "SELECT child.relname FROM pg_inherits"
+	" JOIN pg_class parent ON parent.oid = pg_inherits.inhparent"
+	" JOIN pg_class child ON child.oid = pg_inherits.inhrelid"
+	" WHERE parent.relname = 'log_events'",
+	# the first page has no cursor, coalescing it keeps the cursor usable as an index condition in a generic plan
+	"log_events.search": "SELECT id, event, action, actor_id, target_id, ts, data FROM log_events"
+	" WHERE guild_id = $1"
+	" AND ($2::text IS NULL OR event = $2)"
+	" AND ($3::bigint IS NULL OR actor_id = $3)"
+	" AND ($4::timestamptz IS NULL OR ts >= $4)"
+	" AND (ts, id) < (coalesce($5::timestamptz, 'infinity'), coalesce($6::bigint, 9223372036854775807))"
+	" ORDER BY ts DESC, id DESC LIMIT $7",
+	# snapshots
+	"snapshots.get": "SELECT guild_id, name, author_id, date, code FROM snapshots WHERE code = $1",
+	"snapshots.latest": "SELECT code, depth FROM snapshots WHERE guild_id = $1 ORDER BY date DESC LIMIT 1",
+	"snapshots.insert": "INSERT INTO snapshots"
+	" (guild_id, name, payload, author_id, date, code, version, base_code, depth, automatic)"
+	" VALUES ($1, $2, $3::text::jsonb, $4, $5, $6, $7, $8, $9, $10)",
+	"snapshots.chain": "WITH RECURSIVE chain AS ("
+	" SELECT payload, base_code, 0 AS depth FROM snapshots WHERE code = $1"
+	" UNION ALL"
+	" SELECT s.payload, s.base_code, chain.depth + 1 FROM snapshots s JOIN chain ON s.code = chain.base_code"
+	") SELECT payload FROM chain ORDER BY depth DESC",
+	# the dates are UTC, and manual snapshots are ranked apart so they don't take the place of an automatic one
+	"snapshots.prune": "WITH RECURSIVE ranked AS ("
+	" SELECT code, base_code, automatic, date,"
+	" row_number() OVER (PARTITION BY guild_id, automatic, date_trunc('day', date) ORDER BY date DESC) AS daily,"
+	" row_number() OVER (PARTITION BY guild_id, automatic, date_trunc('week', date) ORDER BY date DESC) AS weekly"
+	" FROM snapshots"
+	"), kept AS ("
+	" SELECT code, base_code FROM ranked"
+	" WHERE NOT automatic OR date > (now() AT TIME ZONE 'UTC') - interval '1 day'"
+	" OR (daily = 1 AND date > (now() AT TIME ZONE 'UTC') - interval '7 days')"
+	" OR (weekly = 1 AND date > (now() AT TIME ZONE 'UTC') - interval '8 weeks')"
+	" UNION"
+	" SELECT s.code, s.base_code FROM snapshots s JOIN kept ON s.code = kept.base_code"
+	") DELETE FROM snapshots WHERE id IN ("
+	" SELECT id FROM snapshots WHERE automatic AND code NOT IN (SELECT code FROM kept) LIMIT $1"
+	")",
+	"snapshot_blobs.insert": "INSERT INTO snapshot_blobs (hash, data) VALUES ($1, $2) ON CONFLICT (hash) DO NOTHING",
+	"snapshot_blobs.get": "SELECT hash, data FROM snapshot_blobs WHERE hash = ANY($1::text[])",
+	"snapshot_schedules.due": "SELECT guild_id, interval, structure_hash FROM snapshot_schedules"
+	" WHERE next_run <= now() ORDER BY next_run LIMIT $1",
+	"snapshot_schedules.due_for_shards": "SELECT guild_id, interval, structure_hash FROM snapshot_schedules"
+	" WHERE next_run <= now() AND (guild_id >> 22) % $1 = ANY($2::int[]) ORDER BY next_run LIMIT $3",
+	"snapshot_schedules.upsert": "INSERT INTO snapshot_schedules (guild_id, interval, next_run) VALUES ($1, $2, $3)"
+	" ON CONFLICT (guild_id) DO UPDATE SET interval = excluded.interval, next_run = excluded.next_run",
+	"snapshot_schedules.reschedule": "UPDATE snapshot_schedules SET next_run = $2 WHERE guild_id = $1",
+	"snapshot_schedules.complete": "UPDATE snapshot_schedules SET next_run = $2, structure_hash = $3"
+	" WHERE guild_id = $1",
+	"snapshot_schedules.delete": "DELETE FROM snapshot_schedules WHERE guild_id = $1",
+	# invalidation
+	# every change adds one to the count of its guild, so the sum only stays the same if nothing changed
+	"invalidation_versions.all": "SELECT topic, sum(version)::bigint AS version FROM invalidation_versions"
+	" GROUP BY topic",
+}
+"""The registered statements, by name. Names are ``<table>.<action>``."""
+
+STATEMENT_CACHE_SIZE = len(STATEMENTS) + 100
+"""The size of the statement cache of the pool connections.
+
+Statements are prepared on first use rather than when a connection opens, as the pool keeps closing idle connections
+and opening new ones. The cache holds every registered statement with room to spare, so ad-hoc SQL like an ``EXPLAIN``
+or a migration doesn't evict them.
+"""
+
+REPLICA_STATEMENTS: frozenset[str] = frozenset(
+	name for name, query in STATEMENTS.items() if not re.search(r"\b(INSERT|UPDATE|DELETE|MERGE)\b", query)
+) - {
+	# these pick up work the bot is about to do, a stale copy would make it do the work twice
+	"cases.expired",
+	"cases.expired_for_shards",
+	"giveaways.active",
+	"giveaways.active_for_shards",
+	"log_events.partitions",
+	"snapshot_schedules.due",
+	"snapshot_schedules.due_for_shards",
+	# compared with the counts a cache was kept at, a stale copy would keep a cache that missed a change
+	"invalidation_versions.all",
+}
+"""The read-only statements that can run on a read replica."""
+
+current_actor: ContextVar[Optional[int]] = ContextVar("current_actor", default=None)
+"""The ID of the user whose command is running, to route their reads to the primary right after they wrote."""
+
+Executor = Union[asyncpg.Pool, asyncpg.Connection, asyncpg.pool.PoolConnectionProxy]
+
+
+class Replica:
+	def __init__(self, pool: asyncpg.Pool, *, max_lag: float = 5.0, check_interval: float = 1.0):
+		"""Keeps track of how far a read replica is behind the primary.
+
+		Parameters
+		----------
+		pool: `asyncpg.Pool`
+			The pool connected to the replica.
+		max_lag: `float`
+			The replay delay above which the replica isn't used, in seconds.
+		check_interval: `float`
+			The time between two lag checks, in seconds.
+		"""
+		self.pool = pool
+		self.max_lag = max_lag
+		self.check_interval = check_interval
+		self.lag: Optional[float] = None
+		self._task: Optional[asyncio.Task] = None
+
+	@property
+	def available(self) -> bool:
+		"""Whether the replica answered the last check and was at most `max_lag` seconds behind."""
+		return self.lag is not None and self.lag <= self.max_lag
+
+	async def check(self) -> None:
+		"""Measures the replay delay of the replica. It is marked as unavailable if it can't be reached."""
+		was_available = self.available
+		try:
+			self.lag = await self.pool.fetchval(STATEMENTS["replica.lag"], timeout=self.check_interval * 5)
+		except (OSError, asyncio.TimeoutError, asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+			self.lag = None
+			if was_available:
+				logger.warning(f"Read replica is unreachable, reading from the primary: {e}")
+			return
+		if self.lag is None:
+			if was_available:
+				logger.warning("Read replica isn't streaming from the primary, reading from the primary")
+		elif was_available and not self.available:
+			logger.warning(f"Read replica is {self.lag:.1f}s behind, reading from the primary")
+		elif not was_available and self.available:
+			logger.info(f"Read replica caught up ({self.lag:.1f}s behind), reading from it again")
+
+	async def _monitor(self) -> None:
+		while True:
+			await self.check()
+			await asyncio.sleep(self.check_interval)
+
+	def start(self) -> None:
+		"""Starts checking the lag in the background."""
+		if self._task is None or self._task.done():
+			self._task = asyncio.create_task(self._monitor())
+
+	def mark_unavailable(self) -> None:
+		"""Stops using the replica until the next check succeeds, e.g. after a query on it failed."""
+		self.lag = None
+
+
+CONNECTION_ERRORS = (
+	OSError,
+	asyncio.TimeoutError,
+	asyncpg.InterfaceError,
+	asyncpg.InternalClientError,  # raised when reusing a connection the server terminated while it was idle
+	asyncpg.PostgresConnectionError,
+	asyncpg.OperatorInterventionError,
+)
+"""The errors raised when the database can't be reached, as opposed to a query being wrong."""
+# a query on a replica is cancelled with a serialization failure when it conflicts with the replay
+_REPLICA_ERRORS = (*CONNECTION_ERRORS, asyncpg.SerializationError)
+
+
+class Queries:
+	def __init__(self, pool: asyncpg.Pool, replica: Optional[Replica] = None):
+		"""Runs the registered statements by name and counts how often each of them is called.
+
+		Every method takes the name of a statement in `STATEMENTS` and its parameters, like the `asyncpg.Pool`
+		method of the same name. Pass ``connection`` to run the statement on an acquired connection, e.g. inside
+		a transaction.
+
+		With a ``replica``, the statements in `REPLICA_STATEMENTS` run on it while it is available. After a user
+		writes (see `current_actor`), their reads go to the primary for ``max_lag + check_interval`` seconds, the
+		longest the replica can take to show the write, so they never see their own data go back in time.
+		A read that fails on the replica, because of the connection or a conflict with the replay, is retried on the
+		primary.
+
+		Parameters
+		----------
+		pool: `asyncpg.Pool`
+			The pool to run the statements on. Its connections should cache `STATEMENT_CACHE_SIZE` statements.
+		replica: Optional[`Replica`]
+			The read replica to offload reads to.
+		"""
+		self.pool = pool
+		self.replica = replica
+		self.calls: Counter[str] = Counter()
+		self._writers: dict[int, float] = {}
+
+	def _executor(self, name: str, connection: Optional[Executor]) -> tuple[Executor, str]:
+		query = STATEMENTS[name]
+		self.calls[name] += 1
+		if connection is not None or self.replica is None:
+			return connection or self.pool, query
+
+		actor = current_actor.get()
+		if name not in REPLICA_STATEMENTS:
+			if actor is not None:
+				now = monotonic()
+				if len(self._writers) > 10000:
+					self._writers = {user: until for user, until in self._writers.items() if until > now}
+				self._writers[actor] = now + self.replica.max_lag + self.replica.check_interval
+			return self.pool, query
+		if not self.replica.available or (actor is not None and self._writers.get(actor, 0) > monotonic()):
+			return self.pool, query
+		return self.replica.pool, query
+
+	async def _run(self, method: str, name: str, args: tuple, connection: Optional[Executor]) -> Any:
+		executor, query = self._executor(name, connection)
+		if self.replica is None or executor is not self.replica.pool:
+			return await getattr(executor, method)(query, *args)
+		try:
+			return await getattr(executor, method)(query, *args)
+		except _REPLICA_ERRORS as e:
+			if deadline.expired():
+				raise  # the command ran out of time, the replica may be fine
+			logger.warning(f"Statement {name} failed on the read replica, retrying on the primary: {e}")
+			self.replica.mark_unavailable()
+			return await getattr(self.pool, method)(query, *args)
+
+	async def fetch(self, name: str, *args: Any, connection: Optional[Executor] = None) -> list[asyncpg.Record]:
+		return await self._run("fetch", name, args, connection)
+
+	async def fetchrow(self, name: str, *args: Any, connection: Optional[Executor] = None) -> Optional[asyncpg.Record]:
+		return await self._run("fetchrow", name, args, connection)
+
+	async def fetchval(self, name: str, *args: Any, connection: Optional[Executor] = None) -> Any:
+		return await self._run("fetchval", name, args, connection)
+
+	async def execute(self, name: str, *args: Any, connection: Optional[Executor] = None) -> str:
+		"""Runs a statement and returns its status, e.g. ``DELETE 3``."""
+		return await self._run("execute", name, args, connection)
+
+	async def executemany(
+		self, name: str, args: Iterable[Iterable[Any]], *, connection: Optional[Executor] = None
+	) -> None:
+		"""Runs a statement once for each set of parameters, in a single round trip."""
+		executor, query = self._executor(name, connection)
+		await executor.executemany(query, args)
+
+	def most_called(self, limit: Optional[int] = None) -> list[tuple[str, int]]:
+		"""Returns the names of the statements with their number of calls, most called first."""
+		return self.calls.most_common(limit)
@@ -0,0 +1,422 @@
+"""Carries the gateway sessions and the caches over a restart, so a deploy resumes instead of identifying again.
+
+Identifying makes Discord send every guild again, which takes minutes for the shards of a large bot, and every cache
+starts empty. So on a graceful shutdown `MyClient.close` closes the shards in a way that keeps their sessions alive and
+writes a resume file with a `ResumeState`: each shard's session, the guilds, channels, roles and members discord.py
+cached, and the caches tracked with `ResumeStore.track`.
+
+The next start reads it back if it's valid: signed with the token, from the same bot, for the same shards and recent
+enough. The guilds are put back in the cache and the shards RESUME, so Discord only replays what they missed. A shard
+whose session expired identifies as usual and its guilds are replaced. The file is deleted once read, so it's never used
+twice.
+
+A cache is only restored if its table didn't change in between, see ``invalidation_versions``. A process holds a lock on
+its resume file while it runs, so the next one waits until it's written.
+"""
+
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import time
+from dataclasses import asdict, dataclass, field
+from logging import getLogger
+from pathlib import Path
+from typing import Any, Optional
+
+import discord
+
+from core.invalidation import GuildCache
+
+try:
+	import fcntl
+except ImportError:  # Windows, where the files aren't locked
+	fcntl = None
+
+logger = getLogger(__name__)
+
+VERSION = 2
+RESUMABLE_CLOSE_CODE = 4000
+"""The close code that keeps a session resumable. 1000 and 1001 end it."""
+
+
+@dataclass(slots=True)
+class ShardSession:
+	session_id: str
+	sequence: int
+	resume_url: str
+
+
+@dataclass(slots=True)
+class ResumeState:
+	user_id: int
+	shard_count: int
+	shard_ids: list[int]
+	intents: int
+	sessions: dict[int, ShardSession]
+	guilds: list[dict[str, Any]]
+	caches: dict[str, dict[str, Any]] = field(default_factory=dict)
+	"""The dumped caches by name, with the topic and version of their table."""
+	saved_at: float = field(default_factory=time.time)
+
+
+class ResumeStore:
+	def __init__(self, path: Path, *, max_age: float = 300.0, lock_timeout: float = 60.0):
+		"""Reads and writes the resume file of a process.
+
+		Parameters
+		----------
+		path: `Path`
+			The resume file. Every process needs its own, e.g. one per cluster.
+		max_age: `float`
+			How old a resume file can be to be used, in seconds. Discord drops sessions that aren't resumed soon.
+		lock_timeout: `float`
+			How long to wait for the previous process to write the file, in seconds.
+		"""
+		self.path = path
+		self.max_age = max_age
+		self.lock_timeout = lock_timeout
+		self.caches: dict[str, tuple[str, GuildCache]] = {}
+		self._lock: Optional[int] = None
+
+	def track(self, name: str, topic: str, cache: GuildCache) -> None:
+		"""
+		Keeps a cache over restarts.
+
+		Parameters
+		----------
+		name: `str`
+			A name for the cache, unique in the process.
+		topic: `str`
+			The table whose changes invalidate it.
+		cache: `GuildCache`
+			The cache. Its values have to be JSON, or it needs an ``encode`` and a ``decode``.
+		"""
+		self.caches[name] = (topic, cache)
+
+	def untrack(self, name: str) -> None:
+		"""Stops keeping a cache, e.g. when its cog is unloaded."""
+		self.caches.pop(name, None)
+
+	async def lock(self) -> bool:
+		"""Takes the lock on the resume file, waiting while the previous process still holds it. Returns if it did."""
+		if fcntl is None or self._lock is not None:
+			return self._lock is not None
+		self.path.parent.mkdir(parents=True, exist_ok=True)
+		fd = os.open(self.path.with_suffix(".lock"), os.O_RDWR | os.O_CREAT, 0o600)
+		deadline = time.monotonic() + self.lock_timeout
+		while True:
+			try:
+				fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+			except BlockingIOError:
+				if time.monotonic() > deadline:
+					os.close(fd)
+					logger.warning(f"{self.path} is still locked by another process, not waiting for it")
+					return False
+				await asyncio.sleep(0.1)
+			else:
+				self._lock = fd
+				return True
+
+	def unlock(self) -> None:
+		if self._lock is not None:
+			os.close(self._lock)
+			self._lock = None
+
+	def write(self, key: bytes, state: ResumeState) -> None:
+		"""
+		Writes the resume file, signed so it can't be swapped for another.
+
+		Parameters
+		----------
+		key: `bytes`
+			The key to sign it with, the bot token.
+		state: `ResumeState`
+			What to keep.
+		"""
+		body = json.dumps({"version": VERSION, **asdict(state)}, separators=(",", ":")).encode()
+		signature = hmac.new(key, body, hashlib.sha256).hexdigest().encode()
+		self.path.parent.mkdir(parents=True, exist_ok=True)
+		temporary = self.path.with_suffix(".tmp")
+		# holds the log webhooks' URLs and the sessions, only the bot's user may read it
+		with open(os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "wb") as file:
+			file.write(signature + b"\n" + body)
+			file.flush()
+			os.fsync(file.fileno())
+		os.replace(temporary, self.path)
+
+	def read(
+		self, key: bytes, user_id: int, shard_count: Optional[int], shard_ids: Optional[list[int]], intents: int
+	) -> Optional[ResumeState]:
+		"""
+		Reads and deletes the resume file.
+
+		Parameters
+		----------
+		key: `bytes`
+			The key it was signed with.
+		user_id: `int`
+			The ID of the bot, it has to be the one that wrote the file.
+		shard_count: Optional[`int`]
+			The total number of shards, it has to be unchanged. None if it isn't set, to use the file's.
+		shard_ids: Optional[list[`int`]]
+			The shards of this process, they have to be unchanged. None if they all are.
+		intents: `int`
+			The value of the intents to identify with, a session keeps the ones it identified with.
+
+		Returns
+		-------
+		Optional[`ResumeState`]
+			What was kept, or None if there's no file or it can't be used.
+		"""
+		try:
+			signature, body = self.path.read_bytes().split(b"\n", 1)
+		except FileNotFoundError:
+			return None
+		except (OSError, ValueError) as e:
+			logger.warning(f"Ignored the resume file {self.path}: {e}")
+			return None
+		finally:
+			self.path.unlink(missing_ok=True)
+
+		if not hmac.compare_digest(signature, hmac.new(key, body, hashlib.sha256).hexdigest().encode()):
+			reason = "the signature doesn't match"
+		else:
+			data = json.loads(body)
+			age = time.time() - data["saved_at"]
+			if data.pop("version") != VERSION:
+				reason = "it's of another version"
+			elif data["user_id"] != user_id:
+				reason = "it's of another bot"
+			elif shard_count is not None and data["shard_count"] != shard_count:
+				reason = "the shard count changed"
+			elif data["shard_ids"] != list(shard_ids or range(data["shard_count"])):
+				reason = "the shards changed"
+			elif data["intents"] != intents:
+				reason = "the intents changed"
+			elif age > self.max_age:
+				reason = f"it's {age:.0f}s old"
+			else:
+				data["sessions"] = {int(shard_id): ShardSession(**s) for shard_id, s in data["sessions"].items()}
+				return ResumeState(**data)
+		logger.warning(f"Ignored the resume file {self.path}, {reason}")
+		return None
+
+	def dump_caches(self, versions: dict[str, int]) -> dict[str, dict[str, Any]]:
+		"""Dumps the tracked caches, with the version of their table they're up to date with."""
+		return {
+			name: {"topic": topic, "version": versions.get(topic, 0), "values": cache.dump()}
+			for name, (topic, cache) in self.caches.items()
+		}
+
+	def restore_caches(self, caches: dict[str, dict[str, Any]], versions: dict[str, int]) -> list[str]:
+		"""Restores the dumped caches whose table didn't change since, returns their names."""
+		restored = []
+		for name, dumped in caches.items():
+			if name not in self.caches or versions.get(dumped["topic"], 0) != dumped["version"]:
+				continue
+			self.caches[name][1].restore(dumped["values"])
+			restored.append(name)
+		return restored
+
+
+def _time(value: Optional[Any]) -> Optional[str]:
+	return value.isoformat() if value else None
+
+
+def _user_payload(user: discord.abc.User) -> dict[str, Any]:
+	return {**user._to_minimal_user_json(), "public_flags": user._public_flags, "system": user.system}
+
+
+def _member_payload(member: discord.Member) -> dict[str, Any]:
+	return {
+		"user": _user_payload(member._user),
+		"nick": member.nick,
+		"avatar": member._avatar,
+		"banner": member._banner,
+		"roles": list(member._roles),
+		"joined_at": _time(member.joined_at),
+		"premium_since": _time(member.premium_since),
+		"pending": member.pending,
+		"flags": member._flags,
+		"communication_disabled_until": _time(member.timed_out_until),
+	}
+
+
+def _role_payload(role: discord.Role) -> dict[str, Any]:
+	data = {
+		"id": role.id,
+		"name": role.name,
+		"permissions": str(role.permissions.value),
+		"position": role.position,
+		"colors": {
+			"primary_color": role._colour,
+			"secondary_color": role._secondary_colour,
+			"tertiary_color": role._tertiary_colour,
+		},
+		"hoist": role.hoist,
+		"icon": role._icon,
+		"unicode_emoji": role.unicode_emoji,
+		"managed": role.managed,
+		"mentionable": role.mentionable,
+		"flags": role._flags,
+	}
+	if tags := role.tags:
+		# the flags are keys with a null value
+		data["tags"] = {
+			**{key: getattr(tags, key) for key in ("bot_id", "integration_id", "subscription_listing_id")},
+			**{
+				key: None
+				for key, present in (
+					("premium_subscriber", tags._premium_subscriber),
+					("available_for_purchase", tags._available_for_purchase),
+					("guild_connections", tags._guild_connections),
+				)
+				if present
+			},
+		}
+	return data
+
+
+def _channel_payload(channel: discord.abc.GuildChannel) -> dict[str, Any]:
+	data = {
+		"id": channel.id,
+		"type": channel.type.value,
+		"name": channel.name,
+		"position": channel.position,
+		"parent_id": channel.category_id,
+		"permission_overwrites": [overwrite._asdict() for overwrite in channel._overwrites],
+		"nsfw": getattr(channel, "nsfw", False),
+	}
+	for key, attribute in (
+		("topic", "topic"),
+		("rate_limit_per_user", "slowmode_delay"),
+		("default_auto_archive_duration", "default_auto_archive_duration"),
+		("default_thread_rate_limit_per_user", "default_thread_slowmode_delay"),
+		("last_message_id", "last_message_id"),
+		("bitrate", "bitrate"),
+		("user_limit", "user_limit"),
+		("rtc_region", "rtc_region"),
+		("flags", "_flags"),
+	):
+		if hasattr(channel, attribute):
+			data[key] = getattr(channel, attribute)
+	if isinstance(channel, (discord.VoiceChannel, discord.StageChannel)):
+		data["video_quality_mode"] = channel.video_quality_mode.value
+	if isinstance(channel, discord.ForumChannel):
+		data["available_tags"] = [tag.to_dict() for tag in channel.available_tags]
+		data["default_forum_layout"] = channel.default_layout.value
+		data["default_sort_order"] = channel.default_sort_order.value if channel.default_sort_order else None
+		if emoji := channel.default_reaction_emoji:
+			data["default_reaction_emoji"] = {"emoji_id": emoji.id, "emoji_name": None if emoji.id else emoji.name}
+	return data
+
+
+def _thread_payload(thread: discord.Thread) -> dict[str, Any]:
+	return {
+		"id": thread.id,
+		"type": thread.type.value,
+		"guild_id": thread.guild.id,
+		"parent_id": thread.parent_id,
+		"owner_id": thread.owner_id,
+		"name": thread.name,
+		"rate_limit_per_user": thread.slowmode_delay,
+		"message_count": thread.message_count,
+		"member_count": thread.member_count,
+		"last_message_id": thread.last_message_id,
+		"flags": thread._flags,
+		"applied_tags": list(thread._applied_tags),
+		"thread_metadata": {
+			"archived": thread.archived,
+			"archiver_id": thread.archiver_id,
+			"auto_archive_duration": thread.auto_archive_duration,
+			"archive_timestamp": _time(thread.archive_timestamp),
+			"locked": thread.locked,
+			"invitable": thread.invitable,
+			"create_timestamp": _time(thread._created_at),
+		},
+	}
+
+
+def guild_payload(guild: discord.Guild) -> dict[str, Any]:
+	"""
+	Turns a cached guild back into the payload of a GUILD_CREATE, to cache it again after a restart.
+
+	Only what the bot uses is kept: the guild, its roles, channels, threads, emojis, stickers and cached members. Voice
+	states, presences, stage instances and scheduled events aren't.
+
+	Parameters
+	----------
+	guild: `discord.Guild`
+		The guild.
+
+	Returns
+	-------
+	dict[`str`, Any]
+		The payload, for ``ConnectionState._add_guild_from_data``.
+	"""
+	return {
+		"id": guild.id,
+		"name": guild.name,
+		"icon": guild._icon,
+		"banner": guild._banner,
+		"splash": guild._splash,
+		"discovery_splash": guild._discovery_splash,
+		"description": guild.description,
+		"owner_id": guild.owner_id,
+		"afk_channel_id": guild._afk_channel_id,
+		"afk_timeout": guild.afk_timeout,
+		"verification_level": guild.verification_level.value,
+		"default_message_notifications": guild.default_notifications.value,
+		"explicit_content_filter": guild.explicit_content_filter.value,
+		"mfa_level": guild.mfa_level.value,
+		"nsfw_level": guild.nsfw_level.value,
+		"features": list(guild.features),
+		"premium_tier": guild.premium_tier,
+		"premium_subscription_count": guild.premium_subscription_count,
+		"premium_progress_bar_enabled": guild.premium_progress_bar_enabled,
+		"preferred_locale": guild.preferred_locale.value,
+		"vanity_url_code": guild.vanity_url_code,
+		"system_channel_id": guild._system_channel_id,
+		"system_channel_flags": guild._system_channel_flags,
+		"rules_channel_id": guild._rules_channel_id,
+		"public_updates_channel_id": guild._public_updates_channel_id,
+		"safety_alerts_channel_id": guild._safety_alerts_channel_id,
+		"widget_enabled": guild.widget_enabled,
+		"widget_channel_id": guild._widget_channel_id,
+		"max_members": guild.max_members,
+		"max_presences": guild.max_presences,
+		"max_video_channel_users": guild.max_video_channel_users,
+		"max_stage_video_channel_users": guild.max_stage_video_users,
+		"member_count": guild._member_count,
+		"roles": [_role_payload(role) for role in guild.roles],
+		"emojis": [
+			{
+				"id": emoji.id,
+				"name": emoji.name,
+				"animated": emoji.animated,
+				"managed": emoji.managed,
+				"require_colons": emoji.require_colons,
+				"available": emoji.available,
+				"roles": list(emoji._roles),
+			}
+			for emoji in guild.emojis
+		],
+		"stickers": [
+			{
+				"id": sticker.id,
+				"name": sticker.name,
+				"description": sticker.description,
+				"tags": sticker.emoji,
+				"format_type": sticker.format.value,
+				"available": sticker.available,
+				"guild_id": guild.id,
+				"type": 2,
+			}
+			for sticker in guild.stickers
+		],
+		"channels": [_channel_payload(channel) for channel in guild.channels],
+		"threads": [_thread_payload(thread) for thread in guild.threads],
+		"members": [_member_payload(member) for member in guild.members],
+	}
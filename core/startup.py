@@ -0,0 +1,155 @@
+"""Runs the startup of the bot as a graph of phases, so the steps that don't depend on each other run concurrently.
+
+`MyClient.setup_hook` adds a phase for every step, naming the phases it has to wait for, and logs the `Startup.report`
+when they are all done. A cog that needs another one to be loaded first can say so in `MyClient.load_cogs`.
+"""
+
+import asyncio
+from dataclasses import dataclass
+from logging import getLogger
+from time import perf_counter
+from typing import Any, Awaitable, Callable, Iterable, Optional
+
+logger = getLogger(__name__)
+
+
+@dataclass(slots=True)
+class Phase:
+	"""A step of the startup and when it ran, relative to the start of the startup."""
+
+	name: str
+	run: Callable[[], Awaitable[Any]]
+	after: tuple[str, ...] = ()
+	started: Optional[float] = None
+	finished: Optional[float] = None
+	error: Optional[BaseException] = None
+
+	@property
+	def duration(self) -> Optional[float]:
+		if self.started is None or self.finished is None:
+			return None
+		return self.finished - self.started
+
+	@property
+	def status(self) -> str:
+		if self.error is not None:
+			return f"failed: {type(self.error).__name__}"
+		if self.finished is None:
+			return "skipped"
+		return "ok"
+
+
+class Startup:
+	def __init__(self):
+		"""A graph of startup phases.
+
+		Every phase starts as soon as the phases it comes after are done, and phases that don't wait for each other
+		run concurrently. If a phase fails, the phases after it are skipped and `run` raises the error once the
+		others are done.
+		"""
+		self.phases: dict[str, Phase] = {}
+		self.started: Optional[float] = None
+		self.finished: Optional[float] = None
+
+	def add(self, name: str, run: Callable[[], Awaitable[Any]], *, after: Iterable[str] = ()) -> None:
+		"""
+		Adds a phase to the graph.
+
+		Parameters
+		----------
+		name: `str`
+			The unique name of the phase, shown in the report.
+		run: Callable[[], Awaitable[Any]]
+			The coroutine function that runs the phase.
+		after: Iterable[`str`]
+			The names of the phases that have to be done before this one starts.
+
+		Raises
+		------
+		ValueError
+			If there is a phase with this name already.
+		"""
+		if name in self.phases:
+			raise ValueError(f"Startup phase {name!r} was added twice")
+		self.phases[name] = Phase(name, run, tuple(after))
+
+	def _check(self) -> None:
+		# a missing phase or a cycle would make the phases waiting on it wait forever
+		for phase in self.phases.values():
+			for name in phase.after:
+				if name not in self.phases:
+					raise ValueError(f"Startup phase {phase.name!r} comes after {name!r}, which doesn't exist")
+		visited: set[str] = set()
+
+		def visit(name: str, path: tuple[str, ...]) -> None:
+			if name in path:
+				raise ValueError(f"Startup phases depend on each other: {' -> '.join((*path, name))}")
+			if name in visited:
+				return
+			for dependency in self.phases[name].after:
+				visit(dependency, (*path, name))
+			visited.add(name)
+
+		for name in self.phases:
+			visit(name, ())
+
+	async def run(self) -> None:
+		"""
+		Runs every phase, each as soon as the phases it comes after are done.
+
+		Raises
+		------
+		ValueError
+			If a phase comes after one that doesn't exist, or the phases depend on each other in a cycle.
+		BaseException
+			The first error a phase raised.
+		"""
+		self._check()
+		self.started = perf_counter()
+		tasks: dict[str, asyncio.Task] = {}
+
+		async def run_phase(phase: Phase) -> None:
+			if phase.after:
+				# raises the error of a failed dependency, so this phase is skipped
+				await asyncio.gather(*(tasks[name] for name in phase.after))
+			phase.started = perf_counter()
+			try:
+				await phase.run()
+			except BaseException as e:
+				phase.error = e
+				raise
+			finally:
+				phase.finished = perf_counter()
+
+		# the tasks only start running once they are all created
+		for phase in self.phases.values():
+			tasks[phase.name] = asyncio.create_task(run_phase(phase), name=f"startup:{phase.name}")
+		results = await asyncio.gather(*tasks.values(), return_exceptions=True)
+		self.finished = perf_counter()
+
+		for phase in self.phases.values():
+			if phase.error is not None:
+				raise phase.error
+		for result in results:
+			if isinstance(result, BaseException):
+				raise result
+
+	def report(self) -> str:
+		"""
+		Describes when each phase started, how long it took and what it waited for, in the order they started.
+
+		Returns
+		-------
+		`str`
+			The report, one phase per line.
+		"""
+		origin = self.started or 0.0
+		total = (self.finished or perf_counter()) - origin
+		width = max((len(name) for name in self.phases), default=0)
+		lines = [f"Startup took {total:.2f}s:"]
+		for phase in sorted(self.phases.values(), key=lambda phase: (phase.started is None, phase.started or 0.0)):
+			start = f"+{phase.started - origin:.2f}s" if phase.started is not None else "-"
+			duration = f"{phase.duration:.2f}s" if phase.duration is not None else "-"
+			after = f" after {', '.join(phase.after)}" if phase.after else ""
+			lines.append(f"  {phase.name:<{width}}  {start:>8}  {duration:>7}  {phase.status}{after}")
+		return "\n".join(lines)
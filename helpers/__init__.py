@@ -7,6 +7,7 @@ from .convert import *
 from .custom_args import *
 from .custom_response import *
 from .emojis import *
+from .lazy import *
 from .pagination import *
 from .random_helper import *
 from .regex import *
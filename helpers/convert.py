@@ -1,9 +1,6 @@
 """A helper for converting stuff."""
 
 import re
-from typing import Optional
-
-import discord
 
 
 def text_to_seconds(time: str, base: int = 0) -> int:
@@ -143,56 +140,6 @@ def seconds_to_text(seconds: int) -> str:
 	return time.strip()
 
 
-def convert_to_query(
-	table: str,
-	guild: Optional[discord.Guild] = None,
-	limit: Optional[int] = None,
-	**filters,
-):
-	"""Converts a set of filters to an SQL query.
-
-	Parameters
-	----------
-	table: `str`
-	        The table to get the results from.
-	guild: Optional[`discord.Guild`]
-	        The guild to get the results from.
-	limit: Optional[`int`]
-	        The number of results to return. If ``None``, all results will be returned.
-	**filters
-	        The conditions to filter the results by.
-
-	Returns
-	-------
-	(`str`, list[Any])
-	        The query string and the query parameters.
-	"""
-	processed_filters = {}
-	for key, value in filters.items():
-		if isinstance(value, (discord.User, discord.Guild, discord.Member, discord.Message)):
-			processed_filters[f"{key}_id"] = value.id
-		else:
-			processed_filters[key] = value
-
-	if guild:
-		processed_filters["guild_id"] = guild.id
-
-	# Construct WHERE clause from processed filters
-	where_clauses = []
-	query_parameters = []
-	for idx, (key, value) in enumerate(processed_filters.items(), start=1):
-		where_clauses.append(f"{key} = ${idx}")
-		query_parameters.append(value)
-
-	where_statement = " AND ".join(where_clauses) if where_clauses else "1=1"
-	query = f"SELECT * FROM {table} WHERE {where_statement}"
-	if limit is not None:
-		query += f" LIMIT ${len(query_parameters) + 1}"
-		query_parameters.append(limit)
-
-	return query, query_parameters
-
-
 def text_to_emoji(text: str) -> list[str]:
 	"""Converts a string to an emoji."""
 	base = 0x1F1E6
@@ -5,11 +5,14 @@ from dataclasses import dataclass, field
 from typing import Literal, Optional, Sequence, Union
 
 import discord
-import psutil
-from cpuinfo import get_cpu_info
-from emoji import demojize
 
 from .convert import seconds_to_text
+from .lazy import LazyModule
+
+# only the info commands use these
+cpuinfo = LazyModule("cpuinfo")
+emoji = LazyModule("emoji")
+psutil = LazyModule("psutil")
 
 
 class CustomColor:
@@ -836,7 +839,7 @@ class IPAddress:
 class CPU:
 	@property
 	def name(self):
-		return get_cpu_info().get("brand_raw")
+		return cpuinfo.get_cpu_info().get("brand_raw")
 
 	@property
 	def usage(self):
@@ -1442,7 +1445,7 @@ class CustomPartialEmoji:
 	@property
 	def name(self) -> str:
 		if self._is_unicode:
-			name = demojize(self._name)
+			name = emoji.demojize(self._name)
 			return name.strip(":")
 		return self._name
 
@@ -1851,7 +1854,7 @@ class CustomTemplate:
 			name=data["name"],
 			_guild=await client.fetch_guild(data["guild_id"]),
 			_author=await client.fetch_user(data["author_id"]),
-			_created_at=data["date"],
+			_created_at=data["date"].replace(tzinfo=datetime.timezone.utc),  # stored as UTC without a time zone
 			code=data["code"],
 			roles=len(data["payload"].get("roles", [])),
 			channels=len(data["payload"].get("channels", [])),
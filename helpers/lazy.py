@@ -0,0 +1,41 @@
+"""Lazy imports, for heavy modules that only a few commands use."""
+
+import importlib
+from types import ModuleType
+from typing import Any, Optional
+
+
+class LazyModule:
+	"""A module that is only imported once one of its attributes is used.
+
+	Importing modules like `psutil` or `emoji` costs startup time and memory in every shard process, even though only a
+	command or two ever use them. Assign the proxy where the module would be imported and use it like the module, e.g.
+	``psutil = LazyModule("psutil")`` then ``psutil.cpu_percent()``. ``from x import y`` can't be deferred, so use
+	``x.y`` instead.
+
+	Parameters
+	----------
+	name: `str`
+	        The absolute name of the module, e.g. ``"emoji.unicode_codes"``.
+	"""
+
+	__slots__ = ("_name", "_module")
+
+	def __init__(self, name: str) -> None:
+		self._name = name
+		self._module: Optional[ModuleType] = None
+
+	def _load(self) -> ModuleType:
+		if self._module is None:
+			self._module = importlib.import_module(self._name)
+		return self._module
+
+	def __getattr__(self, name: str) -> Any:
+		return getattr(self._load(), name)
+
+	def __dir__(self) -> list[str]:
+		return dir(self._load())
+
+	def __repr__(self) -> str:
+		state = "loaded" if self._module is not None else "not loaded"
+		return f"<LazyModule {self._name!r} ({state})>"
@@ -2,11 +2,14 @@ import asyncio
 import logging
 import os
 import platform
+import signal
 
 import discord
 from dotenv import load_dotenv
 
 from core.bot import MyClient
+from core.cluster import ClusterClient, ClusterSupervisor
+from core.interactions import use_api
 
 for handler in logging.root.handlers[:]:
 	# prevent double logging
@@ -21,6 +24,11 @@ TOKEN = os.getenv("TOKEN")
 if __debug__:
 	TOKEN = os.getenv("DEBUG_TOKEN")
 
+# with more than one cluster, this process only supervises the bot processes, see `core.cluster`
+CLUSTERS = int(os.getenv("CLUSTERS") or 1)
+# with a port, this process only receives interactions over HTTP and never connects, see `core.interactions`
+INTERACTIONS_PORT = os.getenv("INTERACTIONS_PORT")
+
 if __name__ == "__main__":
 	if platform.system() != "Windows":
 		import uvloop  # type: ignore
@@ -32,11 +40,22 @@ if __name__ == "__main__":
 		asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
 		logger.info("Using default event loop policy")
 
-logger.info("Starting the bot...")
-client = MyClient()
-
 
 async def main():
+	logger.info("Starting the bot...")
+	if INTERACTIONS_PORT:
+		if os.getenv("DISCORD_API_BASE"):
+			# e.g. an `InteractionStandIn`, to try the worker out
+			use_api(os.environ["DISCORD_API_BASE"])
+		client = MyClient(interactions_only=True)
+		await client.serve_interactions(TOKEN, os.environ["DISCORD_PUBLIC_KEY"], int(INTERACTIONS_PORT))
+		return
+	# the supervisor starts each cluster with its shards in the environment
+	client = MyClient(cluster=ClusterClient.from_env())
+	if platform.system() != "Windows":
+		# a deploy ends the process with a signal, closing gracefully keeps the sessions for the next one to resume
+		for signum in (signal.SIGTERM, signal.SIGHUP, signal.SIGINT):
+			asyncio.get_running_loop().add_signal_handler(signum, lambda: asyncio.create_task(client.close()))
 	try:
 		await client.start(TOKEN)
 	except KeyboardInterrupt:
@@ -50,7 +69,11 @@ if __name__ == "__main__":
 	else:
 		logger.info("Running in production mode")
 	try:
-		asyncio.run(main())
+		if CLUSTERS > 1 and "CLUSTER_ID" not in os.environ:
+			shard_count = os.getenv("SHARD_COUNT")
+			asyncio.run(ClusterSupervisor(TOKEN, CLUSTERS, shard_count=int(shard_count) if shard_count else None).run())
+		else:
+			asyncio.run(main())
 	except KeyboardInterrupt:
 		logger.error("KeyboardInterrupt: Bot shut down by console")
 	else:
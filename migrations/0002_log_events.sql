@@ -0,0 +1,22 @@
+create table if not exists log_events
+(
+    id        bigserial,
+    guild_id  bigint      not null,
+    event     text        not null,
+    action    text        not null,
+    actor_id  bigint,
+    target_id bigint,
+    ts        timestamptz not null default now(),
+    data      jsonb
+) partition by range (ts);
+
+comment on table log_events is 'Partitioned by month, partitions are created and dropped by the log cog';
+
+create index if not exists log_events_guild_event_ts_idx
+    on log_events (guild_id, event, ts);
+
+create index if not exists log_events_guild_actor_idx
+    on log_events (guild_id, actor_id);
+
+alter table log_events
+    owner to lumin;
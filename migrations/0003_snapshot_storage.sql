@@ -0,0 +1,26 @@
+alter table snapshots
+    add column if not exists version smallint not null default 1;
+
+alter table snapshots
+    add column if not exists base_code text;
+
+alter table snapshots
+    add column if not exists depth smallint not null default 0;
+
+create unique index if not exists snapshots_code_idx
+    on snapshots (code);
+
+create index if not exists snapshots_guild_date_idx
+    on snapshots (guild_id, date);
+
+create table if not exists snapshot_blobs
+(
+    hash text  not null
+        primary key,
+    data bytea not null
+);
+
+comment on table snapshot_blobs is 'Role icons of snapshots, keyed by the SHA-256 of their content';
+
+alter table snapshot_blobs
+    owner to lumin;
@@ -0,0 +1,20 @@
+alter table snapshots
+    add column if not exists automatic boolean not null default false;
+
+create index if not exists snapshots_base_code_idx
+    on snapshots (base_code);
+
+create table if not exists snapshot_schedules
+(
+    guild_id       bigint      not null
+        primary key,
+    interval       text        not null,
+    next_run       timestamptz not null,
+    structure_hash text
+);
+
+create index if not exists snapshot_schedules_next_run_idx
+    on snapshot_schedules (next_run);
+
+alter table snapshot_schedules
+    owner to lumin;
@@ -0,0 +1,135 @@
+-- duplicates have to go before the unique constraints can be added, the oldest row of each group is kept
+
+delete from afk a
+    using afk b
+where a.guild_id = b.guild_id
+  and a.user_id = b.user_id
+  and a.id > b.id;
+
+-- the balances of duplicate economy rows are added up into the oldest one, so no money is lost
+update economy e
+set cash = d.cash,
+    bank = d.bank
+from (select min(id) as id, sum(cash) as cash, sum(bank) as bank
+      from economy
+      group by guild_id, user_id
+      having count(*) > 1) d
+where e.id = d.id;
+
+delete from economy a
+    using economy b
+where a.guild_id = b.guild_id
+  and a.user_id = b.user_id
+  and a.id > b.id;
+
+delete from guilds a
+    using guilds b
+where a.guild_id = b.guild_id
+  and a.id > b.id;
+
+delete from cooldowns a
+    using cooldowns b
+where a.guild_id = b.guild_id
+  and a.command = b.command
+  and a.id > b.id;
+
+delete from shop a
+    using shop b
+where a.guild_id = b.guild_id
+  and lower(a.item_name) = lower(b.item_name)
+  and a.id > b.id;
+
+delete from global_ban_blacklist a
+    using global_ban_blacklist b
+where a.user_id = b.user_id
+  and a.id > b.id;
+
+delete from giveaways a
+    using giveaways b
+where a.message_id = b.message_id
+  and a.id > b.id;
+
+delete from cases a
+    using cases b
+where a.case_id = b.case_id
+  and a.id > b.id;
+
+delete from closed_beta a
+    using closed_beta b
+where a.guild_id = b.guild_id
+  and a.ctid > b.ctid;
+
+-- primary keys, and unique keys that also serve the lookups by the same columns. Case IDs are message snowflakes, so
+-- they are unique across guilds. Each is only added if it's missing, so the migration can run again, and a table that
+-- already has a primary key keeps it
+do
+$$
+    declare
+        con record;
+    begin
+        for con in select *
+                   from (values ('afk', 'afk_pk', 'primary key (id)'),
+                                ('cooldowns', 'cooldowns_pk', 'primary key (id)'),
+                                ('economy', 'economy_pk', 'primary key (id)'),
+                                ('global_ban', 'global_ban_pk', 'primary key (id)'),
+                                ('global_ban_blacklist', 'global_ban_blacklist_pk', 'primary key (id)'),
+                                ('guilds', 'guilds_pk', 'primary key (id)'),
+                                ('join_messages', 'join_messages_pk', 'primary key (id)'),
+                                ('leave_messages', 'leave_messages_pk', 'primary key (id)'),
+                                ('messages', 'messages_pk', 'primary key (id)'),
+                                ('shop', 'shop_pk', 'primary key (id)'),
+                                ('snapshots', 'snapshots_pk', 'primary key (id)'),
+                                ('giveaways', 'giveaways_pk', 'primary key (id)'),
+                                ('log', 'log_id_pk', 'primary key (id)'),
+                                ('closed_beta', 'closed_beta_pk', 'primary key (guild_id)'),
+                                ('afk', 'afk_guild_user_key', 'unique (guild_id, user_id)'),
+                                ('economy', 'economy_guild_user_key', 'unique (guild_id, user_id)'),
+                                ('guilds', 'guilds_guild_key', 'unique (guild_id)'),
+                                ('cooldowns', 'cooldowns_guild_command_key', 'unique (guild_id, command)'),
+                                ('global_ban_blacklist', 'global_ban_blacklist_user_key', 'unique (user_id)'),
+                                ('giveaways', 'giveaways_message_key', 'unique (message_id)'),
+                                ('cases', 'cases_case_key', 'unique (case_id)')) as c (tbl, name, definition)
+            loop
+                if not exists (select
+                               from pg_constraint
+                               where conrelid = con.tbl::regclass
+                                 and (conname = con.name or
+                                      (contype = 'p' and con.definition like 'primary key%'))) then
+                    execute format('alter table %I add constraint %I %s', con.tbl, con.name, con.definition);
+                end if;
+            end loop;
+    end
+$$;
+
+create unique index if not exists shop_guild_item_name_key
+    on shop (guild_id, lower(item_name));
+
+-- indexes for the other hot queries
+
+create index if not exists economy_guild_total_idx
+    on economy (guild_id, (cash + bank));
+
+create index if not exists giveaways_ended_ends_at_idx
+    on giveaways (ended, ends_at);
+
+create index if not exists cases_guild_user_created_idx
+    on cases (guild_id, user_id, created);
+
+create index if not exists cases_guild_moderator_idx
+    on cases (guild_id, moderator_id);
+
+create index if not exists cases_expires_idx
+    on cases (expires)
+    where expires is not null;
+
+create index if not exists global_ban_user_idx
+    on global_ban (user_id);
+
+create index if not exists join_messages_guild_idx
+    on join_messages (guild_id);
+
+create index if not exists leave_messages_guild_idx
+    on leave_messages (guild_id);
+
+create index if not exists messages_guild_idx
+    on messages (guild_id);
@@ -0,0 +1,189 @@
+"""Converts the snowflake and money columns from numeric to bigint without locking the tables for a rewrite.
+
+For every table, the new values are written to shadow columns, kept in sync by a trigger and backfilled in batches.
+The indexes are rebuilt concurrently on the shadow columns, then the columns are swapped in one short transaction.
+Every step can be repeated, so the migration resumes where it stopped if it fails halfway.
+"""
+
+import re
+
+import asyncpg
+
+BATCH_SIZE = 5000
+
+COLUMNS: dict[str, list[str]] = {
+	"afk": ["user_id", "guild_id"],
+	"cooldowns": ["guild_id"],
+	"economy": ["guild_id", "user_id", "cash", "bank"],
+	"global_ban": ["user_id", "reported_by", "accepted_by"],
+	"global_ban_blacklist": ["user_id"],
+	"guilds": ["guild_id", "global_ban_channel_id"],
+	"join_messages": ["guild_id", "channel_id"],
+	"leave_messages": ["guild_id", "channel_id"],
+	"messages": ["guild_id"],
+	"shop": ["guild_id", "creator_id", "item_price", "role"],
+	"snapshots": ["guild_id", "author_id"],
+	"cases": ["guild_id", "case_id", "user_id", "moderator_id"],
+	"giveaways": ["guild_id", "channel_id", "message_id", "author_id", "role_id", "won_by"],
+	"closed_beta": ["guild_id", "added_by"],
+	"log": ["guild_id", "channel"],
+}
+
+
+def _shadow(column: str) -> str:
+	return f"{column}__bigint"
+
+
+async def _numeric_columns(connection: asyncpg.Connection, table: str) -> list[tuple[str, str]]:
+	"""Returns the columns of a table that still have to be converted, with their new type."""
+	rows = await connection.fetch(
+		"SELECT column_name, udt_name FROM information_schema.columns"
+		" WHERE table_schema = current_schema() AND table_name = $1 AND column_name = ANY($2::text[])"
+		" AND udt_name IN ('numeric', '_numeric')",
+		table,
+		COLUMNS[table],
+	)
+	return [(row["column_name"], "bigint" if row["udt_name"] == "numeric" else "bigint[]") for row in rows]
+
+
+async def _prepare(connection: asyncpg.Connection, table: str, columns: list[tuple[str, str]]) -> None:
+	"""Adds the shadow columns and the trigger keeping them in sync with new writes."""
+	for column, new_type in columns:
+		await connection.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {_shadow(column)} {new_type}")
+
+	assignments = " ".join(f"NEW.{_shadow(column)} := NEW.{column};" for column, _ in columns)
+	async with connection.transaction():
+		await connection.execute(
+			f"CREATE OR REPLACE FUNCTION {table}__bigint_sync() RETURNS trigger LANGUAGE plpgsql AS"
+			f" $$ BEGIN {assignments} RETURN NEW; END $$"
+		)
+		await connection.execute(f"DROP TRIGGER IF EXISTS {table}__bigint_sync ON {table}")
+		await connection.execute(
+			f"CREATE TRIGGER {table}__bigint_sync BEFORE INSERT OR UPDATE ON {table}"
+			f" FOR EACH ROW EXECUTE FUNCTION {table}__bigint_sync()"
+		)
+
+
+async def _backfill(connection: asyncpg.Connection, table: str, columns: list[tuple[str, str]]) -> None:
+	"""Copies the existing values in batches, each batch in its own transaction."""
+	key = "guild_id" if table == "closed_beta" else "id"
+	stale = " OR ".join(f"{_shadow(column)} IS DISTINCT FROM {column}::{new_type}" for column, new_type in columns)
+	# the trigger does the copying, touching the rows is enough
+	first_column = columns[0][0]
+	last = None
+	while True:
+		last = await connection.fetchval(
+			f"WITH batch AS ("
+			f" SELECT {key} FROM {table} WHERE ($1::numeric IS NULL OR {key} > $1) AND ({stale})"
+			f" ORDER BY {key} LIMIT {BATCH_SIZE}"
+			f"), updated AS ("
+			f" UPDATE {table} SET {first_column} = {first_column} WHERE {key} IN (SELECT {key} FROM batch)"
+			f" RETURNING {key}"
+			f") SELECT max({key}) FROM updated",
+			last,
+		)
+		if last is None:
+			return
+
+
+async def _build_indexes(connection: asyncpg.Connection, table: str, columns: list[tuple[str, str]]) -> None:
+	"""Builds a copy of every index using the converted columns on the shadow columns, without blocking writes."""
+	names = [column for column, _ in columns]
+	pattern = re.compile(rf"\b({'|'.join(names)})\b")
+	indexes = await connection.fetch(
+		"SELECT i.indexrelid::regclass::text AS name, pg_get_indexdef(i.indexrelid) AS definition FROM pg_index i"
+		" WHERE i.indrelid = $1::regclass AND i.indexrelid::regclass::text NOT LIKE '%\\_\\_bigint'",
+		table,
+	)
+	for index in indexes:
+		head, _, body = index["definition"].partition(" USING ")
+		if not pattern.search(body):
+			continue
+		new_name = f"{index['name']}__bigint"
+		# a concurrent build that failed leaves an invalid index behind
+		if await connection.fetchval(
+			"SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass($1)", new_name
+		):
+			await connection.execute(f"DROP INDEX CONCURRENTLY {new_name}")
+		head = head.replace(f"INDEX {index['name']} ON", f"INDEX CONCURRENTLY IF NOT EXISTS {new_name} ON", 1)
+		await connection.execute(f"{head} USING {pattern.sub(lambda match: _shadow(match[1]), body)}")
+
+
+async def _swap(connection: asyncpg.Connection, table: str, columns: list[tuple[str, str]]) -> None:
+	"""Replaces the old columns with the shadow columns, recreating their constraints, defaults and indexes."""
+	names = [column for column, _ in columns]
+	not_null = {
+		row["column_name"]
+		for row in await connection.fetch(
+			"SELECT column_name FROM information_schema.columns"
+			" WHERE table_schema = current_schema() AND table_name = $1 AND column_name = ANY($2::text[]) AND is_nullable = 'NO'",
+			table,
+			names,
+		)
+	}
+	# validating a check constraint doesn't block writes, and lets SET NOT NULL skip its own scan later
+	for column in not_null:
+		await connection.execute(
+			f"ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {column}__bigint_not_null,"
+			f" ADD CONSTRAINT {column}__bigint_not_null CHECK ({_shadow(column)} IS NOT NULL) NOT VALID"
+		)
+		await connection.execute(f"ALTER TABLE {table} VALIDATE CONSTRAINT {column}__bigint_not_null")
+
+	defaults = {
+		row["column_name"]: row["column_default"]
+		for row in await connection.fetch(
+			"SELECT column_name, column_default FROM information_schema.columns"
+			" WHERE table_schema = current_schema() AND table_name = $1 AND column_name = ANY($2::text[])"
+			" AND column_default IS NOT NULL",
+			table,
+			names,
+		)
+	}
+	constraints = await connection.fetch(
+		"SELECT c.conname, c.contype = 'p' AS is_primary, c.conindid::regclass::text AS index FROM pg_constraint c"
+		" WHERE c.conrelid = $1::regclass AND c.contype IN ('p', 'u')"
+		" AND EXISTS (SELECT 1 FROM pg_attribute a WHERE a.attrelid = c.conrelid AND a.attnum = ANY(c.conkey)"
+		" AND a.attname = ANY($2::text[]))",
+		table,
+		names,
+	)
+	indexes = await connection.fetch(
+		"SELECT indexrelid::regclass::text AS name FROM pg_index"
+		" WHERE indrelid = $1::regclass AND indexrelid::regclass::text LIKE '%\\_\\_bigint'",
+		table,
+	)
+
+	async with connection.transaction():
+		await connection.execute(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE")
+		await connection.execute(f"DROP TRIGGER {table}__bigint_sync ON {table}")
+		await connection.execute(f"DROP FUNCTION {table}__bigint_sync()")
+		for column in names:
+			# drops the old indexes and constraints with it
+			await connection.execute(f"ALTER TABLE {table} DROP COLUMN {column} CASCADE")
+			await connection.execute(f"ALTER TABLE {table} RENAME COLUMN {_shadow(column)} TO {column}")
+		for index in indexes:
+			await connection.execute(f"ALTER INDEX {index['name']} RENAME TO {index['name'].removesuffix('__bigint')}")
+		for constraint in constraints:
+			kind = "PRIMARY KEY" if constraint["is_primary"] else "UNIQUE"
+			await connection.execute(
+				f"ALTER TABLE {table} ADD CONSTRAINT {constraint['conname']} {kind} USING INDEX {constraint['index']}"
+			)
+		for column in not_null:
+			await connection.execute(f"ALTER TABLE {table} ALTER COLUMN {column} SET NOT NULL")
+			await connection.execute(f"ALTER TABLE {table} DROP CONSTRAINT {column}__bigint_not_null")
+		for column, default in defaults.items():
+			if "nextval" not in default:
+				await connection.execute(f"ALTER TABLE {table} ALTER COLUMN {column} SET DEFAULT {default}")
+
+
+async def upgrade(connection: asyncpg.Connection) -> None:
+	for table in COLUMNS:
+		columns = await _numeric_columns(connection, table)
+		if not columns:
+			continue
+		await _prepare(connection, table, columns)
+		await _backfill(connection, table, columns)
+		await _build_indexes(connection, table, columns)
+		await _swap(connection, table, columns)
+		# the backfill left a dead version of every row behind, and the planner needs statistics for the new columns
+		await connection.execute(f"VACUUM ANALYZE {table}")
@@ -0,0 +1,44 @@
+-- notifies the bot processes of changes to the settings they cache, see core/invalidation.py
+-- the payload is {"topic": <table>, "guild_id": <guild_id>, "key": <the column named by the trigger argument>}
+create or replace function notify_invalidation() returns trigger
+    language plpgsql as
+$$
+declare
+    data jsonb;
+begin
+    if tg_op = 'DELETE' then
+        data := to_jsonb(old);
+    else
+        data := to_jsonb(new);
+    end if;
+    perform pg_notify('invalidation', json_build_object(
+        'topic', tg_table_name,
+        'guild_id', data -> 'guild_id',
+        'key', data ->> tg_argv[0]
+    )::text);
+    return null;
+end;
+$$;
+
+alter function notify_invalidation() owner to lumin;
+
+drop trigger if exists guilds_invalidation on guilds;
+create trigger guilds_invalidation
+    after insert or update or delete
+    on guilds
+    for each row
+execute function notify_invalidation();
+
+drop trigger if exists log_invalidation on log;
+create trigger log_invalidation
+    after insert or update or delete
+    on log
+    for each row
+execute function notify_invalidation();
+
+drop trigger if exists afk_invalidation on afk;
+create trigger afk_invalidation
+    after insert or update or delete
+    on afk
+    for each row
+execute function notify_invalidation('user_id');
@@ -0,0 +1,36 @@
+-- counts the changes to each cached table, so a cache kept over a restart can tell that it missed one, see core/resume.py
+-- updated in the changing transaction, so a count read by a process never runs ahead of the notifications it will get.
+-- counted per guild, so writes to different guilds don't wait on each other for the same row
+create table if not exists invalidation_versions
+(
+    topic    text   not null,
+    guild_id bigint not null,
+    version  bigint not null,
+    primary key (topic, guild_id)
+);
+
+alter table invalidation_versions
+    owner to lumin;
+
+create or replace function notify_invalidation() returns trigger
+    language plpgsql as
+$$
+declare
+    data jsonb;
+begin
+    if tg_op = 'DELETE' then
+        data := to_jsonb(old);
+    else
+        data := to_jsonb(new);
+    end if;
+    insert into invalidation_versions (topic, guild_id, version)
+    values (tg_table_name, (data ->> 'guild_id')::bigint, 1)
+    on conflict (topic, guild_id) do update set version = invalidation_versions.version + 1;
+    perform pg_notify('invalidation', json_build_object(
+        'topic', tg_table_name,
+        'guild_id', data -> 'guild_id',
+        'key', data ->> tg_argv[0]
+    )::text);
+    return null;
+end;
+$$;
@@ -0,0 +1,68 @@
+"""Checks what starting the bot costs in imports, which every shard process pays for.
+
+The time is measured with ``python -X importtime`` against importing discord.py, asyncpg and aiohttp on the same
+machine, so the budget doesn't depend on how fast the machine is.
+"""
+
+import re
+import subprocess
+import sys
+import unittest
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+
+IMPORT_BUDGET = 0.35
+"""The most the bot's own imports may take, as a fraction of the time discord.py, asyncpg and aiohttp take."""
+RUNS = 5
+"""How often each import is timed. The fastest run is used, the others are slowed down by the machine."""
+DEFERRED = ("psutil", "cpuinfo", "emoji", "PIL", "pypokedex", "requests", "art", "aiohttp.web")
+"""Modules only a few commands use, which have to be imported through `helpers.LazyModule`."""
+_LINE = re.compile(r"import time:\s+(?P<self>\d+) \|\s+\d+ \| +(?P<module>\S+)")
+
+
+def import_times(code: str) -> dict[str, int]:
+	"""Runs code in a new interpreter and returns the time every module took to import, in microseconds.
+
+	Parameters
+	----------
+	code: `str`
+	        The code to run, e.g. ``"import core.bot"``.
+
+	Returns
+	-------
+	`dict[str, int]`
+	        The modules imported, with the time spent in the module itself, excluding the modules it imported.
+	"""
+	result = subprocess.run(
+		[sys.executable, "-X", "importtime", "-c", code], cwd=ROOT, capture_output=True, text=True, check=True
+	)
+	return {match["module"]: int(match["self"]) for match in _LINE.finditer(result.stderr)}
+
+
+def fastest(code: str) -> dict[str, int]:
+	return min((import_times(code) for _ in range(RUNS)), key=lambda times: sum(times.values()))
+
+
+class ImportTimeTest(unittest.TestCase):
+	def test_startup_import_budget(self) -> None:
+		libraries = fastest("import discord.ext.commands, asyncpg, aiohttp")
+		bot = fastest("import core.bot")
+		own = {module: time for module, time in bot.items() if module not in libraries}
+		budget = sum(libraries.values()) * IMPORT_BUDGET
+		slowest = ", ".join(
+			f"{module} {time / 1000:.1f}ms" for module, time in sorted(own.items(), key=lambda x: -x[1])[:5]
+		)
+		self.assertLessEqual(
+			sum(own.values()),
+			budget,
+			f"importing core.bot takes {sum(own.values()) / 1000:.0f}ms on top of the libraries, the budget is"
+			f" {budget / 1000:.0f}ms. Slowest: {slowest}",
+		)
+
+	def test_heavy_modules_are_deferred(self) -> None:
+		cogs = ", ".join(f"cogs.{path.stem}" for path in sorted((ROOT / "cogs").glob("*.py")))
+		imported = import_times(f"import core.bot, {cogs}")
+		for module in DEFERRED:
+			with self.subTest(module=module):
+				self.assertFalse(module in imported, f"{module} is imported on startup, use helpers.LazyModule")
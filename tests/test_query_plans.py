@@ -0,0 +1,90 @@
+"""Checks that the registered statements are served by an index.
+
+The migrations are applied to a scratch schema of the database in the `.env` file (or the `DB_*` environment variables),
+which is dropped afterwards. Skipped when the database can't be reached.
+"""
+
+import json
+import os
+import unittest
+import uuid
+
+import asyncpg
+from dotenv import load_dotenv
+
+from core.migrations import migrate
+from core.queries import STATEMENTS
+
+load_dotenv()
+
+FULL_SCANS: dict[str, str] = {
+	"log.enabled_guilds": "runs once on startup",
+	# joined on the unique index of code, but the row estimates of an empty table make the planner walk that index
+	"snapshots.chain": "only runs when a snapshot is loaded",
+	"snapshots.prune": "ranks every snapshot by design, runs once a day",
+	"invalidation_versions.all": "adds up every count, runs once per restart",
+}
+"""The statements allowed to scan a whole table, with the reason."""
+
+
+def _full_scans(plan: dict) -> list[str]:
+	"""Returns the relations read in full anywhere in a plan.
+
+	With sequential scans disabled, the planner reads a table through any of its indexes rather than scanning it, so an
+	index scan without a condition counts as well.
+	"""
+	full = plan["Node Type"] == "Seq Scan"
+	full |= plan["Node Type"] in ("Index Scan", "Index Only Scan") and "Index Cond" not in plan
+	scans = [plan["Relation Name"]] if full else []
+	for child in plan.get("Plans", []):
+		scans += _full_scans(child)
+	return scans
+
+
+class QueryPlanTest(unittest.IsolatedAsyncioTestCase):
+	async def asyncSetUp(self) -> None:
+		self.schema = f"test_query_plans_{uuid.uuid4().hex[:8]}"
+		options = dict(
+			host=os.getenv("DB_HOST"),
+			port=os.getenv("DB_PORT"),
+			database=os.getenv("DB_NAME", "lumin_beta"),
+			user="lumin",
+			password=os.getenv("DB_PASSWORD"),
+		)
+		try:
+			self.connection = await asyncpg.connect(**options, timeout=5)
+		except (OSError, asyncpg.PostgresError) as e:
+			self.skipTest(f"the database can't be reached: {e}")
+		if self.connection.get_server_version().major < 16:
+			await self.connection.close()
+			self.skipTest("EXPLAIN (GENERIC_PLAN) needs PostgreSQL 16")
+
+		await self.connection.execute(f"CREATE SCHEMA {self.schema}")
+		self.pool = await asyncpg.create_pool(
+			**options, min_size=1, max_size=1, server_settings={"search_path": self.schema}
+		)
+		await migrate(self.pool)
+
+	async def asyncTearDown(self) -> None:
+		await self.pool.close()
+		await self.connection.execute(f"DROP SCHEMA {self.schema} CASCADE")
+		await self.connection.close()
+
+	async def test_statements_use_an_index(self) -> None:
+		async with self.pool.acquire() as connection:
+			# the tables are empty, so scanning them whole is always the cheapest unless it's disabled. Joins are
+			# planned as nested loops, the only join that looks the rows of the inner table up by the outer ones
+			await connection.execute("SET enable_seqscan = off; SET enable_hashjoin = off; SET enable_mergejoin = off")
+			# binding values to the parameters would plan for those values, a dynamic EXECUTE leaves them unbound
+			await connection.execute(
+				"CREATE FUNCTION pg_temp.generic_plan(query text) RETURNS json LANGUAGE plpgsql AS"
+				" $$ DECLARE plan json; BEGIN EXECUTE 'EXPLAIN (GENERIC_PLAN, FORMAT JSON) ' || query INTO plan;"
+				" RETURN plan; END $$"
+			)
+			for name, query in STATEMENTS.items():
+				if name in FULL_SCANS:
+					continue
+				with self.subTest(statement=name):
+					plan = json.loads(await connection.fetchval("SELECT pg_temp.generic_plan($1)", query))
+					scans = [relation for relation in _full_scans(plan[0]["Plan"]) if not relation.startswith("pg_")]
+					self.assertFalse(scans, f"{name} scans {', '.join(scans)}")